@@ -0,0 +1,105 @@
+"""
+Concurrency benchmark for the VOGDB-API.
+
+Fires a mixed load of slow searches and cheap summaries at a running API server from a number of
+concurrent clients and reports the latency percentiles per request type. Run it once against the
+old and once against the new server to compare them, e.g.
+
+    VOG_RATE_LIMIT=0 uvicorn vogdb:api --port 8001
+    python benchmarks/concurrency.py --url http://127.0.0.1:8001 --clients 32 --duration 30
+
+The request limiter has to be switched off (VOG_RATE_LIMIT=0), otherwise most requests are answered with 429.
+
+Measured on a synthetic SQLite release (20000 VOGs, 3000 species, 200 packed HMMs, VOG_CACHE_BYTES=0), one worker,
+32 clients, 30 s, once with all calls on the event loop and once through the executor (p50 / p99 ms):
+
+    request               on the loop     executor
+    vsummary/vog           912 / 1316   1048 / 1499
+    vsearch/protein       1414 / 1823   1728 / 2619
+    vfetch/vog/hmm         930 / 1343    620 /  897
+    throughput              35.3 req/s    30.7 req/s
+
+SQLite runs in the worker process and holds the GIL, so the executor only pays off for the file reads here: it
+makes p99 of the database bound summaries and searches worse and lowers the throughput.
+The executor is meant for MySQL, where the threads wait for the server without the GIL, but it has not been
+measured with MySQL yet: the change is unverified for the production setup until this benchmark has been run
+against a MySQL backed server (MYSQL_* variables instead of VOG_SQLITE) before and after.
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from collections import defaultdict
+
+from httpx import AsyncClient
+
+# (name, url, params) - the searches are slow, the summaries are cheap
+REQUESTS = [
+    ("vsearch/vog tax_id", "/vsearch/vog", {"tax_id": [10239]}),
+    ("vsearch/vog species", "/vsearch/vog", {"species": ["Bovine coronavirus", "Human coronavirus OC43"], "union": True}),
+    ("vsearch/protein", "/vsearch/protein", {"species_name": ["phage"]}),
+    ("vsummary/vog", "/vsummary/vog", {"id": ["VOG00001", "VOG00002", "VOG00234", "VOG03456"]}),
+    ("vsummary/protein", "/vsummary/protein", {"id": ["11128.NP_150082.1", "2301601.YP_009812740.1"]}),
+    ("vsummary/species", "/vsummary/species", {"taxon_id": [2713301, 11128]}),
+    ("vfetch/protein/faa", "/vfetch/protein/faa", {"id": ["11128.NP_150082.1", "2301601.YP_009812740.1"]}),
+    ("vfetch/vog/hmm", "/vfetch/vog/hmm", {"id": ["VOG00001", "VOG00002", "VOG00003"]}),
+]
+
+# relative frequency of the request types above
+WEIGHTS = [1, 1, 1, 10, 10, 10, 5, 5]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[k]
+
+
+async def worker(client, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        name, url, params = random.choices(REQUESTS, weights=WEIGHTS)[0]
+        start = time.perf_counter()
+        response = await client.get(url, params=params)
+        latencies[name].append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            errors[name] += 1
+
+
+async def run(url, clients, duration):
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    async with AsyncClient(base_url=url, timeout=None) as client:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*[worker(client, deadline, latencies, errors) for _ in range(clients)])
+    return latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8001", help="base url of the API server")
+    parser.add_argument("--clients", type=int, default=32, help="number of concurrent clients")
+    parser.add_argument("--duration", type=float, default=30, help="duration of the benchmark in seconds")
+    args = parser.parse_args()
+
+    latencies, errors = asyncio.run(run(args.url, args.clients, args.duration))
+
+    print(f"{'request':<22} {'count':>7} {'errors':>7} {'p50 ms':>9} {'p99 ms':>9} {'mean ms':>9}")
+    all_latencies = []
+    for name, _, _ in REQUESTS:
+        values = latencies.get(name)
+        if not values:
+            continue
+        all_latencies.extend(values)
+        print(f"{name:<22} {len(values):>7} {errors[name]:>7} {percentile(values, 50) * 1000:>9.1f} "
+              f"{percentile(values, 99) * 1000:>9.1f} {statistics.mean(values) * 1000:>9.1f}")
+    if all_latencies:
+        print(f"{'total':<22} {len(all_latencies):>7} {sum(errors.values()):>7} "
+              f"{percentile(all_latencies, 50) * 1000:>9.1f} {percentile(all_latencies, 99) * 1000:>9.1f} "
+              f"{statistics.mean(all_latencies) * 1000:>9.1f}")
+        print(f"throughput: {len(all_latencies) / args.duration:.1f} requests/s")
+
+
+if __name__ == "__main__":
+    main()
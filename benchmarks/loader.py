@@ -0,0 +1,115 @@
+"""
+Micro-benchmark of the membership stages of the loader.
+
+Writes a synthetic vog.members.tsv.gz (and vog.species.list) scaled to the given number of VOGs and proteins,
+and times the per-row Python implementation of the membership and protein extraction against the vectorized one
+in vogdb.loader.frames. Both have to produce the same frames, e.g.
+
+    python benchmarks/loader.py --vogs 40000 --proteins-per-vog 30 --repeat 3
+"""
+
+import argparse
+import gzip
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from vogdb.loader.frames import count_phages, extract_membership, extract_proteins, load_members, load_species
+
+
+def write_data(data_path, vogs, proteins_per_vog, species_count):
+    random.seed(1)
+    taxa = random.sample(range(10000, 3000000), species_count)
+    with open(os.path.join(data_path, "vog.species.list"), "wt") as f:
+        f.write("#SpeciesName\tTaxonID\tPhage\tSource\tVersion\n")
+        for taxon in taxa:
+            f.write(f"Species {taxon}\t{taxon}\t{random.choice(['phage', 'nonphage'])}\tNCBI Refseq\t202\n")
+
+    with gzip.open(os.path.join(data_path, "vog.members.tsv.gz"), "wt") as f:
+        f.write("#GroupName\tProteinCount\tSpeciesCount\tFunctionalCategory\tProteinIDs\n")
+        for i in range(vogs):
+            count = random.randint(2, 2 * proteins_per_vog)
+            proteins = [f"{random.choice(taxa)}.YP_{random.randint(0, 10 ** 7):09d}.1" for _ in range(count)]
+            f.write(f"VOG{i:05d}\t{count}\t{count}\tXu\t{','.join(proteins)}\n")
+
+
+def legacy(members, species):
+    """
+    The per-row implementation with Python sets, list comprehensions and apply.
+    """
+    members = members.assign(Proteins=lambda df: df.Proteins.apply(lambda s: set(s.split(","))))
+    data = [(v, p) for v, ps in members.Proteins.items() for p in ps]
+    membership = (
+        pd.DataFrame.from_records(data, columns=["VOG_ID", "ProteinID"])
+        .sort_values(["VOG_ID", "ProteinID"])
+        .reset_index(drop=True)
+    )
+    unique_proteins = pd.Series(membership.ProteinID.unique())
+    taxa = unique_proteins.apply(lambda p: int(p.split(".")[0]))
+    proteins = (
+        pd.DataFrame({"ProteinID": unique_proteins, "TaxonID": taxa})
+        .sort_values("ProteinID")
+        .set_index("ProteinID")
+    )
+    protein_phage = proteins.TaxonID.map(species.Phage.apply(lambda s: 1 if s else 0))
+    phages = pd.DataFrame({
+        "NumPhages": membership.set_index("VOG_ID").ProteinID.map(protein_phage).groupby("VOG_ID").sum(),
+        "NumNonPhages": membership.set_index("VOG_ID").ProteinID.map(1 - protein_phage).groupby("VOG_ID").sum(),
+    })
+    return membership, proteins, phages
+
+
+def vectorized(members, species):
+    membership = extract_membership(members)
+    proteins = extract_proteins(membership)
+    return membership, proteins, count_phages(membership, proteins, species)
+
+
+def measure(name, repeat, run):
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run()
+        times.append(time.perf_counter() - start)
+    print(f"{name:<12} {statistics.median(times):>9.2f} {min(times):>9.2f}")
+    return result, statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vogs", type=int, default=40000, help="number of VOGs")
+    parser.add_argument("--proteins-per-vog", type=int, default=30, help="mean number of proteins per VOG")
+    parser.add_argument("--species", type=int, default=5000, help="number of species")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per implementation, the median is reported")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_path:
+        write_data(data_path, args.vogs, args.proteins_per_vog, args.species)
+        start = time.perf_counter()
+        members = load_members(data_path)
+        species = load_species(data_path)
+        print(f"members file read in {time.perf_counter() - start:.2f} s")
+
+    print(f"{'stage':<12} {'median s':>9} {'min s':>9}")
+    (membership, proteins, phages), legacy_time = measure("legacy", args.repeat, lambda: legacy(members, species))
+    (new_membership, new_proteins, new_phages), new_time = measure("vectorized", args.repeat,
+                                                                   lambda: vectorized(members, species))
+    print(f"{len(membership)} memberships, {len(proteins)} proteins, speedup {legacy_time / new_time:.1f}x")
+
+    same = (
+        membership.equals(new_membership.astype(str))
+        and proteins.equals(new_proteins)
+        and np.array_equal(phages.sort_index().to_numpy(), new_phages.sort_index().to_numpy())
+    )
+    if not same:
+        print("The vectorized implementation returns different frames!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Serialization benchmark for the VOG and protein summaries.
+
+Builds the summaries for the given IDs once through the ORM objects and the pydantic schemas (the default path)
+and once as plain rows encoded with the fast JSON encoder (VOG_FAST_JSON=1), and reports the time per call
+split into the database part and the serialization part. Both paths have to produce the same JSON. Run it against
+a loaded database with the usual MYSQL_* environment variables, e.g.
+
+    python benchmarks/serialization.py --vogs 200 --proteins 2000 --repeat 5
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+from vogdb.database import SessionLocal
+from vogdb.fastjson import dumps
+from vogdb.functionality import find_protein_profile_rows, find_proteins_by_id, find_vog_profile_rows, \
+    find_vogs_by_uid
+from vogdb.models import VOG, Protein
+from vogdb.schemas import Protein_profile, VOG_profile
+
+
+def schema_path(find, schema, db, ids):
+    start = time.perf_counter()
+    rows = list(find(db, ids))
+    loaded = time.perf_counter()
+    body = json.dumps([schema.from_orm(row).dict() for row in rows]).encode("utf-8")
+    return loaded - start, time.perf_counter() - loaded, body
+
+
+def fast_path(find, db, ids):
+    start = time.perf_counter()
+    rows = list(find(db, ids))
+    loaded = time.perf_counter()
+    body = dumps(rows)
+    return loaded - start, time.perf_counter() - loaded, body
+
+
+def normalized(content):
+    """
+    The order of the rows and of the proteins/VOGs within a row is not defined, so both are sorted.
+    """
+    if isinstance(content, list):
+        return sorted((normalized(item) for item in content), key=lambda item: json.dumps(item, sort_keys=True))
+    if isinstance(content, dict):
+        return {key: normalized(value) for key, value in content.items()}
+    return content
+
+
+def measure(name, repeat, run):
+    database, serialization = [], []
+    body = None
+    for _ in range(repeat):
+        # a fresh session per call, so that the ORM path does not profit from the identity map
+        db = SessionLocal()
+        try:
+            db_time, serialization_time, body = run(db)
+        finally:
+            db.close()
+        database.append(db_time)
+        serialization.append(serialization_time)
+    print(f"{name:<22} {statistics.median(database) * 1000:>9.1f} {statistics.median(serialization) * 1000:>9.1f} "
+          f"{statistics.median(map(sum, zip(database, serialization))) * 1000:>9.1f} {len(body) / 1024:>9.1f}")
+    return body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vogs", type=int, default=200, help="number of VOGs, the largest ones are taken")
+    parser.add_argument("--proteins", type=int, default=2000, help="number of proteins")
+    parser.add_argument("--repeat", type=int, default=5, help="calls per path, the median is reported")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        vog_ids = [row[0] for row in db.query(VOG.id).order_by(VOG.protein_count.desc()).limit(args.vogs)]
+        protein_ids = [row[0] for row in db.query(Protein.id).order_by(Protein.id).limit(args.proteins)]
+    finally:
+        db.close()
+
+    print(f"{'path':<22} {'db ms':>9} {'json ms':>9} {'total ms':>9} {'KiB':>9}")
+    for name, find_orm, schema, find_rows, ids in [
+            ("vsummary/vog", find_vogs_by_uid, VOG_profile, find_vog_profile_rows, vog_ids),
+            ("vsummary/protein", find_proteins_by_id, Protein_profile, find_protein_profile_rows, protein_ids)]:
+        expected = measure(name + " schema", args.repeat, lambda db: schema_path(find_orm, schema, db, ids))
+        body = measure(name + " fast", args.repeat, lambda db: fast_path(find_rows, db, ids))
+        if normalized(json.loads(body)) != normalized(json.loads(expected)):
+            print(f"{name}: the fast path returns a different result!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Memory benchmark of the pre-forking server (python -m vogdb.serve).
+
+Starts the server with each given number of workers, sends every worker some searches, so that they touch
+the shared structures, and reports the total memory of the server (proportional set size of the parent and
+the workers, Linux only). With the shared structures it should grow much less than the number of workers, e.g.
+
+    VOG_RATE_LIMIT=0 python benchmarks/workers.py --workers 1 2 4 8 --port 8002
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from httpx import Client, TransportError
+
+REQUESTS = [
+    ("/vsearch/vog", {"tax_id": [10239]}),
+    ("/vsearch/vog", {"species": ["Bovine coronavirus", "Human coronavirus OC43"], "union": True}),
+    ("/vsearch/vog", {"consensus_function": ["capsid"]}),
+    ("/vsummary/vog", {"id": ["VOG00001", "VOG00002"]}),
+]
+
+
+def children(pid):
+    result = []
+    for name in os.listdir("/proc"):
+        if name.isdigit():
+            try:
+                with open(f"/proc/{name}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except OSError:
+                continue
+            if ppid == pid:
+                result.append(int(name))
+    return result
+
+
+def pss_bytes(pid):
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Pss:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def wait_ready(client, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            client.get("/vsummary/vog", params={"id": ["VOG00001"]})
+            return
+        except TransportError:
+            time.sleep(0.5)
+    raise TimeoutError("The server did not start.")
+
+
+def measure(workers, port, rounds, timeout):
+    server = subprocess.Popen([sys.executable, "-m", "vogdb.serve", "--host", "127.0.0.1", "--port", str(port),
+                               "--workers", str(workers)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        # a new connection per request, so that the requests are spread over the workers
+        with Client(base_url=f"http://127.0.0.1:{port}", timeout=None) as client:
+            wait_ready(client, timeout)
+        for _ in range(rounds * workers):
+            with Client(base_url=f"http://127.0.0.1:{port}", timeout=None) as client:
+                for url, params in REQUESTS:
+                    client.get(url, params=params)
+        pids = [server.pid] + children(server.pid)
+        return len(pids) - 1, sum(pss_bytes(pid) for pid in pids)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="numbers of workers to measure")
+    parser.add_argument("--port", type=int, default=8002)
+    parser.add_argument("--rounds", type=int, default=5, help="rounds of searches per worker")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for the server to start")
+    args = parser.parse_args()
+
+    print(f"{'workers':>7} {'processes':>9} {'total PSS MiB':>13} {'MiB/worker':>10}")
+    for workers in args.workers:
+        processes, pss = measure(workers, args.port, args.rounds, args.timeout)
+        print(f"{workers:>7} {processes:>9} {pss / 2 ** 20:>13.1f} {pss / 2 ** 20 / workers:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
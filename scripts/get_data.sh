@@ -22,9 +22,8 @@ for FILE in *.md5; do
   md5sum -c $FILE
 done
 
-# unzip FASTA files, but keep the original so that timestamping works
-rm *.fa
-gunzip -k *.fa.gz
+# the FASTA files are read gzipped by the loader, remove unzipped ones of earlier versions
+rm -f *.fa
 
 # untar hmm and raw_algs archives (faa not needed so far), and rezip them
 for f in hmm raw_algs; do
@@ -1,14 +1,37 @@
+import asyncio
+import io
 import os
 import random
 import string
 import time
+from typing import List
 
 import pytest
 from fastapi.testclient import TestClient
+from starlette.requests import Request
 import pandas as pd
 from six import assertCountEqual
 
-from vogdb.main import api
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.orm import sessionmaker
+
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+
+from vogdb import cache, database
+from vogdb.main import api, error_handling, get_db, get_stream_db, limiter, plain_text_response, response_cache
+from vogdb.ratelimit import WAYS, CostLimiter, SharedBuckets, client_address
+from vogdb.catalog import ReleaseSnapshot, SpeciesBitmaps, VOGCatalog, load_release_version
+from vogdb.database import SessionLocal, engine, sqlite_engine, sqlite_url
+from vogdb.functionality import find_protein_fna_by_id, find_protein_profile_rows, find_proteins_by_id, \
+    find_vog_profile_rows, find_vogs_by_uid, get_proteins
+from vogdb.loader import save_db_sqlite
+from vogdb.models import Species
+from vogdb.loader.bulk import write_tsv
+from vogdb.loader.frames import assign_keys, count_phages, extract_membership, extract_proteins
+from vogdb.loader.hashes import protein_hashes
+from vogdb.schemas import Protein_profile, VOG_profile
+from vogdb.sequences import pack_nt, unpack_nt
 from httpx import AsyncClient
 
 """ Tests for vogdb.main.py
@@ -42,6 +65,11 @@ def get_test_asynclient():
 def teardown():
     time.sleep(0.1)
 
+@pytest.fixture(autouse=True)
+def rate_limit_buckets(tmp_path):
+    # every test starts with full buckets, independent of the other tests and of running servers
+    limiter.open(str(tmp_path / "ratelimit"))
+
 #------------------------
 # vSummary/vog tests
 #------------------------
@@ -402,6 +430,52 @@ async def test_vsummaryProtein_ERROR429_11requestsPerSecond(get_test_asynclient)
     expected = 429
     assert response.status_code == expected
 
+@pytest.mark.vsummary_protein
+def test_vsummaryProtein_noSequencesTwoQueries_ids():
+    ids = ["11128.NP_150082.1", "2301601.YP_009812740.1"]
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    db = SessionLocal()
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        proteins = list(find_proteins_by_id(db, ids))
+        summaries = [Protein_profile.from_orm(p) for p in proteins]
+        # bytes of all column values that were loaded into the session
+        loaded = sum(len(str(value)) for obj in db.identity_map.values()
+                     for key, value in inspect(obj).dict.items() if key in inspect(obj).mapper.column_attrs)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+        db.close()
+
+    assert [s.id for s in summaries] == ids
+    assert len(statements) == 2
+    assert not any("AAseq" in s or "NTseq" in s for s in statements)
+    assert loaded < 4096
+
+@pytest.mark.fast_json
+@pytest.mark.parametrize("find_rows, find_orm, schema, ids", [
+    (find_vog_profile_rows, find_vogs_by_uid, VOG_profile, ["VOG00001", "VOG00002", "VOG00234", "VOG03456"]),
+    (find_protein_profile_rows, find_proteins_by_id, Protein_profile, ["11128.NP_150082.1", "2301601.YP_009812740.1"])])
+def test_fastJson_sameAsSchema_ids(find_rows, find_orm, schema, ids):
+    def by_id(rows):
+        return sorted(rows, key=lambda row: row["id"])
+
+    db = SessionLocal()
+    try:
+        rows = list(find_rows(db, ids))
+        expected = [schema.from_orm(row).dict() for row in find_orm(db, ids)]
+    finally:
+        db.close()
+
+    for row in rows + expected:
+        for key in ("proteins", "vogs"):
+            if key in row:
+                row[key] = by_id(row[key])
+    assert by_id(rows) == by_id(expected)
+
 
 
 
@@ -686,6 +760,39 @@ def test_vfetchVogMSA_ERROR22_longParameter(get_test_client):
     assert response.status_code == expected
 
 
+#------------------------
+# vplain/vog
+#------------------------
+
+@pytest.mark.vplain_vog
+@pytest.mark.parametrize("kind", ["hmm", "msa"])
+def test_vplainVog_sameContentAsVfetch_gzip(kind, get_test_client):
+    client = get_test_client
+    response = client.get(url="/vplain/vog/{0}/VOG00234".format(kind), headers={"Accept-Encoding": "gzip"})
+    expected = client.get(url="/vfetch/vog/{0}/".format(kind), params={"id": ["VOG00234"]}).json()["VOG00234"]
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.text == expected
+
+@pytest.mark.vplain_vog
+@pytest.mark.parametrize("kind", ["hmm", "msa"])
+def test_vplainVog_plainText_identity(kind, get_test_client):
+    client = get_test_client
+    response = client.get(url="/vplain/vog/{0}/VOG00234".format(kind), headers={"Accept-Encoding": "identity"})
+    expected = client.get(url="/vfetch/vog/{0}/".format(kind), params={"id": ["VOG00234"]}).json()["VOG00234"]
+
+    assert "content-encoding" not in response.headers
+    assert response.text == expected
+
+@pytest.mark.vplain_vog
+def test_vplainVog_ERROR404_invalidVOG(get_test_client):
+    client = get_test_client
+    response = client.get(url="/vplain/vog/hmm/VOG99999999")
+    expected = 404
+
+    assert response.status_code == expected
+
+
 #------------------------
 # vfetch/protein/faa
 #------------------------
@@ -943,6 +1050,43 @@ def test_vfetchProteinFNA_ERROR422_longParameter(get_test_client):
     assert response.status_code == expected
 
 
+#------------------------
+# vplain/protein
+#------------------------
+
+@pytest.mark.vplain_protein
+@pytest.mark.parametrize("kind, key", [("faa", "aa_seq"), ("fna", "nt_seq")])
+@pytest.mark.parametrize("encoding", ["gzip", "identity"])
+def test_vplainProtein_sameContentAsVfetch_ids(kind, key, encoding, get_test_client):
+    client = get_test_client
+    params = {"id": ["11128.NP_150082.1", "2301601.YP_009812740.1"]}
+    response = client.get(url="/vplain/protein/{0}".format(kind), params=params, headers={"Accept-Encoding": encoding})
+    data = client.get(url="/vfetch/protein/{0}/".format(kind), params=params).json()
+    expected = "".join(">{0}\n{1}\n".format(row["id"], row[key]) for row in sorted(data, key=lambda row: row["id"]))
+
+    assert response.status_code == 200
+    assert response.headers.get("content-encoding") == ("gzip" if encoding == "gzip" else None)
+    assert response.text == expected
+
+@pytest.mark.vplain_protein
+def test_vplainProtein_sameAsGet_post(get_test_client):
+    client = get_test_client
+    ids = ["11128.NP_150082.1", "2301601.YP_009812740.1"]
+    response = client.post(url="/vplain/protein/faa", data="\n".join(ids))
+    expected = client.get(url="/vplain/protein/faa", params={"id": ids})
+
+    assert response.text == expected.text
+
+@pytest.mark.vplain_protein
+def test_vplainProtein_ERROR404_invalidID(get_test_client):
+    client = get_test_client
+    params = {"id": ["11128.NP_000000.0"]}
+    response = client.get(url="/vplain/protein/faa", params=params)
+    expected = 404
+
+    assert response.status_code == expected
+
+
 
 
 #------------------------
@@ -1568,6 +1712,15 @@ def test_vsearchVOG_CorrectVOGs_consensus_function(get_test_client):
     data = response.text.split("\n")
     assert set(expected) <= set(data)
 
+@pytest.mark.vsearch_vog
+def test_vsearchVOG_IntersectionOfTerms_consensus_functionMultipleTerms(get_test_client):
+    client = get_test_client
+    single = client.get(url="/vsearch/vog/", params={"consensus_function": ["terminator"]}).text.split("\n")
+    both = client.get(url="/vsearch/vog/", params={"consensus_function": ["Terminator", "large"]}).text.split("\n")
+    other = client.get(url="/vsearch/vog/", params={"consensus_function": ["large"]}).text.split("\n")
+
+    assert set(both) == set(single) & set(other)
+
 @pytest.mark.vsearch_vog
 def test_vsearchVOG_consensus_functionRandomString(get_test_client):
     client = get_test_client
@@ -1972,3 +2125,557 @@ def test_vsearchVOG_CorrectVOGs_UnionAndTaxonID(get_test_client):
 
 
 
+
+
+#------------------------
+# bulk POST requests
+#------------------------
+
+@pytest.mark.bulk
+@pytest.mark.parametrize("url, ids", [("/vsummary/vog", ["VOG00001", "VOG00002", "VOG00234", "VOG03456"]),
+                                      ("/vsummary/protein", ["11128.NP_150082.1", "2301601.YP_009812740.1"]),
+                                      ("/vfetch/protein/faa", ["11128.NP_150082.1", "2301601.YP_009812740.1"]),
+                                      ("/vfetch/protein/fna", ["11128.NP_150082.1", "2301601.YP_009812740.1"])])
+def test_bulkPost_sameAsGet_jsonAndLines(url, ids, get_test_client):
+    client = get_test_client
+    expected = client.get(url=url, params={"id": ids}).json()
+
+    json_response = client.post(url=url, json=ids)
+    lines_response = client.post(url=url, data="\n".join(ids), headers={"Content-Type": "text/plain"})
+
+    assert json_response.json() == expected
+    assert lines_response.json() == expected
+
+@pytest.mark.bulk
+def test_bulkPost_manyIds_moreThanFitInUrl(get_test_client):
+    client = get_test_client
+    ids = client.get(url="/vsearch/protein/", params={"species_name": ["phage"]}).text.split("\n")[:3000]
+    response = client.post(url="/vsummary/protein", json=ids)
+
+    data = response.json()
+    assert response.status_code == 200
+    assert sorted(p["id"] for p in data) == sorted(set(ids))
+
+@pytest.mark.bulk
+def test_bulkPost_ERROR404_unknownIds(get_test_client):
+    client = get_test_client
+    response = client.post(url="/vsummary/protein", json=["1.YP_000000000.1"])
+    expected = 404
+
+    assert response.status_code == expected
+
+@pytest.mark.bulk
+@pytest.mark.parametrize("url, id", [("/vsummary/vog", "VOG" + "0" * 8), ("/vsummary/protein", "1.YP_" + "0" * 21)])
+def test_bulkPost_ERROR422_idsLongerThanForGet(url, id, get_test_client):
+    client = get_test_client
+
+    assert client.get(url=url, params={"id": [id]}).status_code == 422
+    assert client.post(url=url, json=[id]).status_code == 422
+
+@pytest.mark.bulk
+@pytest.mark.parametrize("body", ['{"id": "VOG00001"}', "[1, 2]", "", "SOMETHING"])
+def test_bulkPost_ERROR422_invalidBody(body, get_test_client):
+    client = get_test_client
+    response = client.post(url="/vsummary/vog", data=body, headers={"Content-Type": "application/json"})
+    expected = 422
+
+    assert response.status_code == expected
+
+
+# streaming
+
+def failing_lines(before):
+    yield from before
+    raise RuntimeError("The connection to the database was lost.")
+
+
+@pytest.mark.streaming
+def test_plainTextResponse_ERROR500_queryFails():
+    async def respond():
+        with error_handling():
+            return await plain_text_response(failing_lines([]), "VOGs")
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(respond())
+
+    assert error.value.status_code == 500
+
+@pytest.mark.streaming
+def test_plainTextResponse_aborted_errorAfterFirstChunk():
+    async def read():
+        response = await plain_text_response(failing_lines(["VOG00001" * 10000]), "VOGs")
+        chunks = []
+        with pytest.raises(RuntimeError):
+            async for chunk in response.body_iterator:
+                chunks.append(chunk)
+        return chunks
+
+    chunks = asyncio.run(read())
+
+    assert chunks == ["VOG00001" * 10000]
+
+@pytest.mark.streaming
+def test_plainTextResponse_emptyBody_noLines():
+    response = asyncio.run(plain_text_response(iter([]), "VOGs"))
+
+    assert response.status_code == 200
+    assert response.body == b""
+
+
+@pytest.mark.streaming
+def test_getStreamDb_sessionsLeft_streamsAtLimit(monkeypatch):
+    monkeypatch.setattr(database, "MAX_SESSIONS", 2)
+    monkeypatch.setattr(database, "MAX_STREAM_SESSIONS", 1)
+    monkeypatch.setattr(database, "_session_slots", None)
+    monkeypatch.setattr(database, "_stream_slots", None)
+
+    async def sessions():
+        stream = get_stream_db()
+        await stream.__anext__()
+        waiting = get_stream_db()
+        second = asyncio.ensure_future(waiting.__anext__())
+        await asyncio.sleep(0.1)
+        blocked = not second.done()
+
+        other = get_db()
+        await asyncio.wait_for(other.__anext__(), 1)
+        await other.aclose()
+        await stream.aclose()
+        await asyncio.wait_for(second, 1)
+        await waiting.aclose()
+        return blocked
+
+    assert asyncio.run(sessions())
+
+
+# response cache
+
+@pytest.mark.cache
+def test_cache_sameETag_parameterOrder(get_test_client):
+    client = get_test_client
+    response1 = client.get(url="/vsummary/vog", params={"id": ["VOG00001", "VOG00002"]})
+    response2 = client.get(url="/vsummary/vog", params={"id": ["VOG00002", "VOG00001"]})
+
+    assert response1.status_code == 200
+    assert response1.headers["ETag"] == response2.headers["ETag"]
+    assert response1.json() == response2.json()
+
+@pytest.mark.cache
+@pytest.mark.parametrize("url, params", [("/vsummary/vog", {"id": ["VOG00001"]}),
+                                         ("/vsearch/vog", {"pmin": 2, "pmax": 5}),
+                                         ("/vplain/vog/hmm/VOG00001", {})])
+def test_cache_ERROR304_ifNoneMatch(url, params, get_test_client):
+    client = get_test_client
+    etag = client.get(url=url, params=params).headers["ETag"]
+    response = client.get(url=url, params=params, headers={"If-None-Match": etag})
+    expected = 304
+
+    assert response.status_code == expected
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+
+@pytest.mark.cache
+def test_cache_differentETag_differentEncoding(get_test_client):
+    client = get_test_client
+    gzipped = client.get(url="/vplain/vog/hmm/VOG00001", headers={"Accept-Encoding": "gzip"})
+    identity = client.get(url="/vplain/vog/hmm/VOG00001", headers={"Accept-Encoding": "identity"})
+
+    assert gzipped.headers["ETag"] != identity.headers["ETag"]
+    assert gzipped.text == identity.text
+
+@pytest.mark.cache
+def test_cache_noETag_ERROR404(get_test_client):
+    client = get_test_client
+    response = client.get(url="/vsummary/vog", params={"id": ["VOG99999"]})
+
+    assert response.status_code == 404
+    assert "ETag" not in response.headers
+
+class Public(BaseModel):
+    id: str
+
+
+@pytest.mark.cache
+def test_cache_sameBody_responseModelOnHit(monkeypatch):
+    async def version():
+        return 1
+
+    monkeypatch.setattr(cache, "current_version", version)
+    app = FastAPI()
+    response_cache = cache.ResponseCache(2 ** 20, 2 ** 20)
+
+    @app.get("/items", response_model=List[Public])
+    @response_cache.cached()
+    async def items(request: Request):
+        return [{"id": "VOG00001", "secret": "hidden"}]
+
+    client = TestClient(app)
+    miss = client.get(url="/items")
+    hit = client.get(url="/items")
+
+    assert miss.json() == [{"id": "VOG00001"}]
+    assert hit.content == miss.content
+    assert len(response_cache.entries) == 1
+
+
+# metrics
+
+@pytest.mark.metrics
+def test_metricsPool_checkoutsCounted_afterRequest(get_test_client):
+    client = get_test_client
+    before = client.get(url="/metrics/pool").json()
+    client.get(url="/")
+    after = client.get(url="/metrics/pool").json()
+
+    assert after["checkouts"] > before["checkouts"]
+    assert after["checked_out"] <= after["max_checked_out"] <= after["max_connections"]
+    assert after["wait_seconds_max"] >= 0
+
+
+@pytest.mark.surrogate_keys
+def test_memberTable_integerKeys_schema():
+    columns = {column["name"]: column for column in inspect(engine).get_columns("Member")}
+    assert list(columns) == ["VOGKey", "ProteinKey"]
+    assert all(column["type"].python_type is int for column in columns.values())
+
+    unique = [index["column_names"] for index in inspect(engine).get_indexes("VOG") if index["unique"]]
+    assert ["VOG_ID"] in unique
+
+
+@pytest.mark.surrogate_keys
+def test_vsearchProtein_sameAsVogMembers_VOGId(get_test_client):
+    client = get_test_client
+    vog = client.get(url="/vsummary/vog/", params={"id": ["VOG00001"]}).json()[0]
+    response = client.get(url="/vsearch/protein/", params={"VOG_id": ["VOG00001"]})
+
+    assertCountEqual(response.text.split("\n"), [protein["id"] for protein in vog["proteins"]])
+
+
+def explain_plans(client, url, params):
+    """
+    Calls the endpoint and returns the EXPLAIN plan rows of every SELECT it sent to the database.
+    The endpoint is called once before, so that cached data such as the VOG catalog is not queried.
+    The cached response of that call is dropped, otherwise the second call would not reach the database.
+    """
+    client.get(url=url, params=params)
+    response_cache.clear()
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        client.get(url=url, params=params)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+    plans = []
+    con = engine.raw_connection()
+    try:
+        for statement, parameters in statements:
+            cursor = con.cursor()
+            cursor.execute("EXPLAIN " + statement, parameters)
+            names = [column[0] for column in cursor.description]
+            plans.append([dict(zip(names, row)) for row in cursor.fetchall()])
+            cursor.close()
+    finally:
+        con.close()
+    return plans
+
+
+@pytest.mark.explain
+@pytest.mark.parametrize("url, params", [
+    ("/vsearch/vog/", {"proteins": ["1821555.YP_009603357.1"]}),
+    ("/vsearch/protein/", {"taxon_id": ["10295", "10298"]}),
+    ("/vsearch/protein/", {"VOG_id": ["VOG00001"]}),
+    ("/vsearch/protein/", {"species_name": ["lacto"], "taxon_id": "37105", "VOG_id": ["VOG00001"]}),
+    ("/vsearch/species/", {"taxon_id": ["11128", "1335626", "1384461"]}),
+    ("/vsummary/protein/", {"id": ["1821555.YP_009603357.1", "10295.NP_042084.1"]}),
+])
+def test_explain_noFullScans_searchQueries(url, params, get_test_client):
+    plans = explain_plans(get_test_client, url, params)
+
+    # the small Species table is scanned by the LIKE searches on the species name, derived tables have no index
+    scans = [(row["table"], row["type"]) for plan in plans for row in plan
+             if row["type"] == "ALL" and row["table"] != "Species" and not str(row["table"]).startswith("<")]
+    assert plans
+    assert scans == []
+
+
+@pytest.mark.sequences
+@pytest.mark.parametrize("seq", ["", "A", "ACGT", "ACGTA", "NNNNACGTRYacgtN", "ACGTNNNNNNNNNNCG" * 50,
+                                 "".join(random.choice("ACGT") for _ in range(1001))])
+def test_packNt_sameSequence_unpacked(seq):
+    packed = pack_nt(seq)
+
+    assert unpack_nt(packed) == seq
+    if set(seq) <= set("ACGT"):
+        assert len(packed) <= 6 + (len(seq) + 3) // 4
+
+
+@pytest.mark.sequences
+def test_proteinTable_noSequences_schema():
+    assert not {"AAseq", "NTseq"} & {column["name"] for column in inspect(engine).get_columns("Protein")}
+    columns = {column["name"]: column for column in inspect(engine).get_columns("Sequence")}
+    assert columns["NTseq"]["type"].python_type is bytes
+
+
+def small_release():
+    """
+    The frames of a release with two VOGs, two proteins and two species, as load_frames returns them.
+    """
+    members = pd.DataFrame({"ProteinCount": [2, 1], "SpeciesCount": [2, 1], "FunctionalCategory": ["Xu", "XrXs"],
+                            "Proteins": ["10295.NP_000001.1,10298.YP_000002.1", "10298.YP_000002.1"]},
+                           index=pd.Index(["VOG00001", "VOG00002"], name="VOG_ID"))
+    species = pd.DataFrame({"SpeciesName": ["Bovine herpesvirus", "Lactococcus phage"], "Phage": [False, True],
+                            "Source": ["NCBI Refseq", "NCBI Refseq"], "Version": [202, 202]},
+                           index=pd.Index([10295, 10298], name="TaxonID"))
+    membership = extract_membership(members)
+    proteins = extract_proteins(membership)
+    vog = members.drop(columns="Proteins").assign(
+        Consensus_func_description=["a function", "another function"], GenomesInGroup=[2, 1], GenomesTotal=[3, 4],
+        Ancestors=["Viruses", "Viruses"], StringencyHigh=[True, False], StringencyMedium=[True, False],
+        StringencyLow=[True, True], VirusSpecific=[True, True],
+    ).join(count_phages(membership, proteins, species)).assign(PhageNonphage=["mixed", "phages_only"])
+    vog, proteins, membership = assign_keys(vog, proteins, membership)
+    return vog, species, proteins, membership
+
+
+@pytest.mark.bulk_load
+def test_writeTsv_loadDataFormat_escapedValues():
+    frame = pd.DataFrame({"ID": ["a\tb", "c\\d\ne", None], "Count": [1, 2, 3], "Flag": [True, False, True],
+                          "Score": [0.5, float("nan"), 2.0]}, index=[5, 5, 7])
+    f = io.StringIO()
+    write_tsv(f, frame, ["ID", "Count", "Flag", "Score"])
+
+    assert f.getvalue() == "a\\tb\t1\t1\t0.5\nc\\\\d\\ne\t2\t0\t\\N\n\\N\t3\t1\t2.0\n"
+
+
+@pytest.mark.delta
+def test_proteinHashes_sameHashes_missingSequence():
+    _, _, proteins, _ = small_release()
+    aa_hashes = pd.Series([11, 12], index=proteins.index, dtype="uint64")
+    nt_hashes = pd.Series([21, 22], index=proteins.index, dtype="uint64")
+
+    complete = protein_hashes(proteins, aa_hashes, nt_hashes)
+    missing = protein_hashes(proteins, aa_hashes, nt_hashes.iloc[:1])
+
+    assert missing.iloc[0] == complete.iloc[0]
+    assert missing.iloc[1] != complete.iloc[1]
+
+
+@pytest.mark.sqlite
+def test_saveDbSqlite_sameRows_readOnlyFile(tmp_path):
+    ids = pd.Index(["10295.NP_000001.1", "10298.YP_000002.1"], name="ProteinID")
+    aa_seq = [pd.DataFrame({"AAseq": ["MKV", "MTT"]}, index=ids)]
+    nt_seq = [pd.DataFrame({"NTseq": ["ATGAAAGTN", "ATGACCACC"]}, index=ids)]
+    path = str(tmp_path / "vogdb.sqlite")
+    save_db_sqlite(path, *small_release(), aa_seq, nt_seq)
+
+    db = sessionmaker(bind=create_engine(sqlite_url(path)))()
+    try:
+        assert [row[0] for row in get_proteins(db, None, None, ["VOG00002"])] == ["10298.YP_000002.1"]
+        assert [tuple(row) for row in find_protein_fna_by_id(db, list(ids))] == \
+               [("10295.NP_000001.1", "ATGAAAGTN"), ("10298.YP_000002.1", "ATGACCACC")]
+        assert [vog["proteins"] for vog in find_vog_profile_rows(db, ["VOG00001"])] == \
+               [[{"id": "10295.NP_000001.1"}, {"id": "10298.YP_000002.1"}]]
+    finally:
+        db.close()
+
+
+@pytest.mark.sqlite
+def test_sqliteEngine_newRelease_replacedFile(tmp_path):
+    path = str(tmp_path / "vogdb.sqlite")
+    vog, species, proteins, membership = small_release()
+    save_db_sqlite(path, vog, species, proteins, membership)
+    sqlite = sqlite_engine(path)
+    Session = sessionmaker(bind=sqlite)
+
+    db = Session()
+    try:
+        assert db.query(Species.version).first()[0] == 202
+    finally:
+        db.close()
+
+    save_db_sqlite(path, vog, species.assign(Version=203), proteins, membership)
+    db = Session()
+    try:
+        assert db.query(Species.version).first()[0] == 203
+    finally:
+        db.close()
+    sqlite.dispose()
+
+
+@pytest.mark.delta
+def test_loadReleaseVersion_newVersion_changedInputFiles(tmp_path):
+    versions = []
+    for files in [None, {"vog.members.tsv.gz": "0" * 32}, {"vog.members.tsv.gz": "f" * 32}]:
+        path = str(tmp_path / "vogdb.sqlite")
+        save_db_sqlite(path, *small_release(), files=files)
+        sqlite = create_engine(sqlite_url(path))
+        db = sessionmaker(bind=sqlite)()
+        try:
+            versions.append(load_release_version(db))
+        finally:
+            db.close()
+            sqlite.dispose()
+
+    assert versions[0] == "202"
+    assert versions[1].startswith("202-")
+    assert versions[2].startswith("202-")
+    assert versions[1] != versions[2]
+
+
+@pytest.mark.bitmaps
+def test_speciesBitmaps_unionAndIntersection_species(tmp_path):
+    path = str(tmp_path / "vogdb.sqlite")
+    save_db_sqlite(path, *small_release())
+
+    db = sessionmaker(bind=create_engine(sqlite_url(path)))()
+    try:
+        # not cached like release_snapshot, which belongs to the release of the test database
+        catalog = VOGCatalog.load(db, 0)
+        bitmaps = SpeciesBitmaps.load(db, catalog)
+    finally:
+        db.close()
+
+    assert bitmaps.size == len(catalog)
+
+    assert bitmaps.taxa(["lactococcus PHAGE", "unknown"]) == [10298]
+    assert catalog.select(bitmaps.vogs([10295])) == ["VOG00001"]
+    assert catalog.select(bitmaps.vogs([10295, 10298])) == ["VOG00001", "VOG00002"]
+    assert catalog.select(bitmaps.vogs([10295]) & bitmaps.vogs([10298])) == ["VOG00001"]
+    assert catalog.select(bitmaps.vogs([1])) == []
+
+
+@pytest.mark.bitmaps
+def test_releaseSnapshot_ERROR_bitmapsOfOtherCatalog(tmp_path):
+    path = str(tmp_path / "vogdb.sqlite")
+    save_db_sqlite(path, *small_release())
+
+    db = sessionmaker(bind=create_engine(sqlite_url(path)))()
+    try:
+        catalog = VOGCatalog.load(db, 0)
+        bitmaps = SpeciesBitmaps.load(db, catalog)
+    finally:
+        db.close()
+    smaller = VOGCatalog(0, catalog.ids[:1], {name: column[:1] for name, column in catalog.columns.items()},
+                         catalog.keys[:1])
+
+    assert ReleaseSnapshot(catalog, bitmaps).catalog is catalog
+    with pytest.raises(ValueError):
+        ReleaseSnapshot(smaller, bitmaps)
+
+
+@pytest.mark.bitmaps
+def test_vsearchVog_sameAsSql_speciesIntersection(get_test_client):
+    client = get_test_client
+    species = ["Bovine coronavirus", "Human coronavirus OC"]
+    response = client.get(url="/vsearch/vog/", params={"species": species})
+
+    with engine.connect() as con:
+        rows = con.execute(
+            "SELECT VOG.VOG_ID FROM VOG JOIN Member USING (VOGKey) JOIN Protein USING (ProteinKey) "
+            "JOIN Species USING (TaxonID) WHERE Species.SpeciesName IN %s "
+            "GROUP BY VOG.VOG_ID HAVING COUNT(DISTINCT Species.SpeciesName) = %s ORDER BY VOG.VOG_ID",
+            (species, len(species)),
+        ).fetchall()
+    expected = [row[0] for row in rows]
+
+    assert (response.text.split("\n") if response.text else []) == expected
+
+
+def limited_request(ids):
+    return Request({"type": "http", "method": "GET", "path": "/vsummary/protein/", "headers": [],
+                    "query_string": "&".join("id={0}".format(i) for i in range(ids)).encode(),
+                    "client": ("10.0.0.1", 1234)})
+
+
+@pytest.mark.rate_limit
+def test_costLimiter_sharedBudget_workers(tmp_path):
+    path = str(tmp_path / "ratelimit")
+    # two limiters on the same file, as in two worker processes
+    workers = [CostLimiter(client_address, path=path, rate=1, burst=9, slots=64) for _ in range(2)]
+
+    waits = [workers[i % 2].check(limited_request(1))[1] for i in range(10)]
+
+    assert waits[:9] == [0] * 9
+    assert waits[9] > 0
+
+
+@pytest.mark.rate_limit
+def test_costLimiter_costByIds_bulkRequest(tmp_path):
+    limiter = CostLimiter(client_address, path=str(tmp_path / "ratelimit"), rate=1, burst=9, slots=64)
+
+    assert limiter.check(limited_request(25)) == (7, 0)
+    cost, wait = limiter.check(limited_request(25))
+    assert cost == 7
+    assert wait > 0
+    assert limiter.check(limited_request(1)) == (1, 0)
+
+
+@pytest.mark.rate_limit
+def test_costLimiter_ownBuckets_endpoints(tmp_path):
+    limiter = CostLimiter(client_address, path=str(tmp_path / "ratelimit"), rate=1, burst=9, slots=64)
+
+    assert limiter.check(limited_request(33), scope="summary") == (9, 0)
+    assert limiter.check(limited_request(1), scope="summary")[1] > 0
+    assert limiter.check(limited_request(1), scope="search") == (1, 0)
+
+
+@pytest.mark.rate_limit
+def test_costLimiter_wholeBucket_chunkedBody(tmp_path):
+    limiter = CostLimiter(client_address, path=str(tmp_path / "ratelimit"), rate=1, burst=9, slots=64)
+    request = Request({"type": "http", "method": "POST", "path": "/vsummary/protein", "query_string": b"",
+                       "headers": [(b"transfer-encoding", b"chunked")], "client": ("10.0.0.1", 1234)})
+
+    assert limiter.check(request)[1] == 0
+    assert limiter.check(limited_request(1))[1] > 0
+
+
+@pytest.mark.rate_limit
+def test_costLimiter_debt_largeBulkRequest(tmp_path):
+    limiter = CostLimiter(client_address, path=str(tmp_path / "ratelimit"), rate=1, burst=9, slots=64)
+    request = Request({"type": "http", "method": "POST", "path": "/vsummary/protein", "query_string": b"",
+                       "headers": [(b"content-length", b"2000")], "client": ("10.0.0.1", 1234)})
+
+    cost, wait = limiter.check(request)
+    assert (cost, wait) == (25.75, 0)
+    # the debt of 16.75 units has to be paid off before a single lookup fits again
+    assert limiter.check(limited_request(1))[1] > 17
+
+
+@pytest.mark.rate_limit
+def test_costLimiter_filtersFree_searchParameters(tmp_path):
+    limiter = CostLimiter(client_address, path=str(tmp_path / "ratelimit"), rate=1, burst=9, slots=64)
+    request = Request({"type": "http", "method": "GET", "path": "/vsearch/vog/", "headers": [],
+                       "query_string": b"tax_id=1&tax_id=2&union=true&mingLCA=2&phages_nonphages=phages_only",
+                       "client": ("10.0.0.1", 1234)})
+
+    assert limiter.check(request) == (1.25, 0)
+
+
+@pytest.mark.rate_limit
+def test_sharedBuckets_noRefill_collidingClients(tmp_path):
+    # a single set, so that all clients collide
+    buckets = SharedBuckets(str(tmp_path / "ratelimit"), WAYS)
+    clients = ["10.0.0.{0}".format(i) for i in range(WAYS + 1)]
+
+    assert [buckets.take(client, 9, 1, 9) for client in clients[:WAYS]] == [0] * WAYS
+    assert buckets.take(clients[0], 1, 1, 9) > 0
+    # no free slot left, the last client takes over the empty bucket of the least recently used one
+    assert buckets.take(clients[WAYS], 1, 1, 9) > 0
+    buckets.close()
+
+
+@pytest.mark.rate_limit
+@pytest.mark.asyncio
+async def test_vsummaryProtein_retryAfter_bulkRequests(get_test_asynclient):
+    ids = ["{0}.YP_{1:09d}.1".format(i, i) for i in range(25)]
+    responses = [await get_test_asynclient.get("/vsummary/protein/", params={"id": ids}) for _ in range(3)]
+
+    assert responses[-1].status_code == 429
+    assert int(responses[-1].headers["Retry-After"]) >= 1
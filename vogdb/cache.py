@@ -0,0 +1,211 @@
+import functools
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+from fastapi.routing import APIRoute, serialize_response
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+
+from .catalog import known_release_version, release_version
+from .database import SessionLocal, run_db
+
+# get logger:
+log = logging.getLogger(__name__)
+
+"""
+The data behind the endpoints only changes when a new release is loaded, so responses are cached per release.
+The cache key is the endpoint together with its sorted query parameters and the release version.
+Every cached response carries a strong ETag derived from the key, so that clients can revalidate it with
+If-None-Match and get a 304 without any database access.
+Results that are not responses yet are rendered through the response model of the route, as FastAPI would,
+before they are cached, so that a cached response has the same (filtered and validated) body as a fresh one.
+"""
+
+
+class CachedResponse:
+
+    def __init__(self, status_code: int, headers: List[Tuple[bytes, bytes]], body: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+
+    def response(self) -> Response:
+        response = Response(self.body, status_code=self.status_code)
+        response.raw_headers = [(k, v) for k, v in response.raw_headers if k == b"content-length"] + self.headers
+        return response
+
+
+class ResponseCache:
+    """
+    LRU cache of complete responses with a memory budget.
+
+    :param max_bytes: the budget for the bodies of all cached responses, 0 switches off caching
+    :param max_entry_bytes: larger responses are not cached (but still get an ETag)
+    """
+
+    def __init__(self, max_bytes: int, max_entry_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.version = None
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, entry: CachedResponse):
+        if len(entry.body) > self.max_entry_bytes:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old.body)
+        self.entries[key] = entry
+        self.size += len(entry.body)
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted.body)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def cached(self, vary: Callable[[Request], object] = None):
+        """
+        Decorator for endpoints (with a request parameter) whose response only depends on the query parameters
+        and the release. Apply it below the request limiter, so cached responses are limited as well.
+
+        :param vary: returns further request properties the response depends on (e.g. the accepted encoding)
+        """
+
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                request: Request = kwargs["request"]
+                version = await current_version()
+                if version != self.version:
+                    # a new release has been loaded
+                    self.clear()
+                    self.version = version
+                key = cache_key(request, version, vary(request) if vary else None)
+                etag = '"{0}-{1}"'.format(version, hashlib.sha1(key.encode("utf-8")).hexdigest()[:20])
+
+                if etag_matches(request.headers.get("if-none-match"), etag):
+                    return Response(status_code=304, headers={"ETag": etag})
+
+                entry = self.get(key)
+                if entry is not None:
+                    log.debug("Response for {0} taken from the cache.".format(request.url.path))
+                    return entry.response()
+
+                result = await func(*args, **kwargs)
+                response = result if isinstance(result, Response) else await render(request, result)
+                if response.status_code != 200:
+                    return response
+                response.headers["ETag"] = etag
+
+                if self.max_bytes <= 0:
+                    return response
+                if isinstance(response, StreamingResponse):
+                    response.body_iterator = self._tee(key, response, response.body_iterator)
+                else:
+                    self.put(key, CachedResponse(response.status_code, _headers(response), response.body))
+                return response
+
+            return wrapper
+
+        return decorator
+
+    async def _tee(self, key: str, response: StreamingResponse,
+                   body: AsyncIterator) -> AsyncIterator[bytes]:
+        """
+        Passes the chunks of a streaming response through and caches the body once it is complete,
+        unless it got too large.
+        """
+        chunks, size = [], 0
+        async for chunk in body:
+            if not isinstance(chunk, bytes):
+                chunk = chunk.encode(response.charset)
+            yield chunk
+            if chunks is not None:
+                size += len(chunk)
+                if size <= self.max_entry_bytes:
+                    chunks.append(chunk)
+                else:
+                    chunks = None
+        if chunks is not None:
+            self.put(key, CachedResponse(response.status_code, _headers(response), b"".join(chunks)))
+
+
+def _route(request: Request) -> Optional[APIRoute]:
+    endpoint = request.scope.get("endpoint")
+    for route in request.app.router.routes:
+        if isinstance(route, APIRoute) and route.endpoint is endpoint:
+            return route
+    return None
+
+
+async def render(request: Request, result) -> Response:
+    """
+    Renders the result of an endpoint with the response model and response class of its route.
+    """
+    route = _route(request)
+    if route is None:
+        raise LookupError("No route for the endpoint of {0}.".format(request.url.path))
+    content = await serialize_response(field=route.secure_cloned_response_field,
+                                       response_content=result,
+                                       include=route.response_model_include,
+                                       exclude=route.response_model_exclude,
+                                       by_alias=route.response_model_by_alias,
+                                       exclude_unset=route.response_model_exclude_unset,
+                                       exclude_defaults=route.response_model_exclude_defaults,
+                                       exclude_none=route.response_model_exclude_none)
+    response_class = route.response_class
+    # FastAPI keeps the configured class in a DefaultPlaceholder
+    response_class = getattr(response_class, "value", response_class)
+    return response_class(content, status_code=route.status_code or 200)
+
+
+def _headers(response: Response) -> List[Tuple[bytes, bytes]]:
+    return [(k, v) for k, v in response.raw_headers if k != b"content-length"]
+
+
+def cache_key(request: Request, version: str, variant=None) -> str:
+    """
+    The endpoint, its query parameters in a normalized (sorted) order, the release version and the variant.
+    """
+    params = "&".join("{0}={1}".format(k, v) for k, v in sorted(request.query_params.multi_items()))
+    return "{0} {1}?{2} {3} {4}".format(request.method, request.url.path.rstrip("/"), params, version, variant)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if (tag[2:] if tag.startswith("W/") else tag) == etag:
+            return True
+    return False
+
+
+def _load_version() -> str:
+    db = SessionLocal()
+    try:
+        return release_version(db)
+    finally:
+        db.close()
+
+
+async def current_version() -> str:
+    """
+    Returns the version of the loaded release, asking the database (in the executor) only when the
+    last check is older than VOG_VERSION_TTL seconds.
+    """
+    version = known_release_version()
+    if version is None:
+        version = await run_db(_load_version)
+    return version
@@ -0,0 +1,319 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+
+from .models import VOG, Member, Protein, RowHash, Species
+
+# get logger:
+log = logging.getLogger(__name__)
+
+"""
+The VOG catalog keeps the columns of the VOG table in memory as NumPy arrays (one entry per VOG, ordered by VOG ID),
+so that the column filters of a VOG search are evaluated as vectorized masks without a database round-trip.
+The catalog belongs to a release (see release_version) and is rebuilt when a new release has been loaded.
+The species bitmaps hold the VOGs of every species as a set of the same ordinals, so that the species and
+taxonomy filters are unions and intersections of these sets in memory. Both are loaded together from one
+database session into one ReleaseSnapshot, so that the ordinals of the bitmaps are those of the catalog.
+"""
+
+# seconds between two checks of the release version in the database
+VERSION_TTL = float(os.environ.get("VOG_VERSION_TTL", 60))
+
+# attribute name, model column and dtype of the columns kept in the catalog
+COLUMNS = [
+    ("protein_count", VOG.protein_count, np.int32),
+    ("species_count", VOG.species_count, np.int32),
+    ("function", VOG.function, bytes),
+    ("consensus_function", VOG.consensus_function, bytes),
+    ("genomes_in_group", VOG.genomes_in_group, np.int32),
+    ("genomes_total_in_LCA", VOG.genomes_total_in_LCA, np.int32),
+    ("ancestors", VOG.ancestors, bytes),
+    ("h_stringency", VOG.h_stringency, np.bool_),
+    ("m_stringency", VOG.m_stringency, np.bool_),
+    ("l_stringency", VOG.l_stringency, np.bool_),
+    ("virus_specific", VOG.virus_specific, np.bool_),
+    ("phages_nonphages", VOG.phages_nonphages, bytes),
+]
+
+# text columns with an inverted trigram index
+INDEXED = ["consensus_function"]
+
+_lock = threading.Lock()
+_version = None
+_version_checked = 0.0
+_snapshot = None
+
+
+class TrigramIndex:
+    """
+    Inverted index from the byte trigrams of a text column to the sorted ordinals of the rows containing them.
+    A substring query intersects the posting lists of the trigrams of the term and verifies the remaining
+    candidates, so it does not have to scan the whole column.
+    """
+
+    def __init__(self, column: np.ndarray):
+        self.column = column
+        postings = {}
+        for ordinal, text in enumerate(column.tolist()):
+            for trigram in {text[i:i + 3] for i in range(len(text) - 2)}:
+                postings.setdefault(trigram, []).append(ordinal)
+        self.postings = {trigram: np.array(ordinals, dtype=np.int32) for trigram, ordinals in postings.items()}
+
+    def candidates(self, term: bytes) -> Optional[np.ndarray]:
+        """
+        Returns the ordinals of the rows that contain all trigrams of the term,
+        or None if the term is too short to be looked up in the index.
+        """
+        if len(term) < 3:
+            return None
+        lists = []
+        for trigram in {term[i:i + 3] for i in range(len(term) - 2)}:
+            ordinals = self.postings.get(trigram)
+            if ordinals is None:
+                return np.empty(0, dtype=np.int32)
+            lists.append(ordinals)
+        lists.sort(key=len)
+        result = lists[0]
+        for ordinals in lists[1:]:
+            result = np.intersect1d(result, ordinals, assume_unique=True)
+        return result
+
+    def search(self, terms: Iterable[bytes]) -> np.ndarray:
+        """
+        Selects the rows that contain all terms (AND), by intersecting their posting lists.
+        """
+        terms = set(terms)
+        result = None
+        for term in terms:
+            ordinals = self.candidates(term)
+            if ordinals is not None:
+                result = ordinals if result is None else np.intersect1d(result, ordinals, assume_unique=True)
+        if result is None:
+            result = np.arange(len(self.column), dtype=np.int32)
+
+        for term in terms:
+            result = result[np.char.find(self.column[result], term) >= 0]
+
+        mask = np.zeros(len(self.column), dtype=bool)
+        mask[result] = True
+        return mask
+
+
+class VOGCatalog:
+    """
+    In-memory, column oriented copy of the VOG table of one release.
+    Text columns are stored lower case and utf-8 encoded, because LIKE in MySQL is case insensitive.
+    """
+
+    def __init__(self, version: str, ids: np.ndarray, columns: dict, keys: Optional[np.ndarray] = None):
+        self.version = version
+        self.ids = ids
+        self.columns = columns
+        # the VOGKey of every VOG
+        self.keys = keys if keys is not None else np.zeros(len(ids), dtype=np.int64)
+        self.indexes = {name: TrigramIndex(columns[name]) for name in INDEXED}
+
+    @classmethod
+    def load(cls, db: Session, version: str) -> "VOGCatalog":
+        log.info("Loading the VOG catalog of version {0}...".format(version))
+        rows = db.query(VOG.id, VOG.key, *[column for _, column, _ in COLUMNS]).order_by(VOG.id).all()
+        values = list(zip(*rows)) if rows else [()] * (len(COLUMNS) + 2)
+
+        ids = np.array(values[0], dtype=object)
+        keys = np.array(values[1], dtype=np.int64)
+        columns = {}
+        for (name, _, dtype), data in zip(COLUMNS, values[2:]):
+            if dtype is bytes:
+                columns[name] = np.array([(v or "").lower().encode("utf-8") for v in data], dtype=bytes)
+            else:
+                columns[name] = np.array(data, dtype=dtype)
+        log.info("VOG catalog loaded: {0} VOGs.".format(len(ids)))
+        return cls(version, ids, columns, keys)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def everything(self) -> np.ndarray:
+        return np.ones(len(self), dtype=bool)
+
+    def isin(self, ids: Iterable[str]) -> np.ndarray:
+        return np.isin(self.ids, np.array(list(ids), dtype=object))
+
+    def contains(self, name: str, terms: Iterable[str]) -> np.ndarray:
+        """
+        Selects the VOGs whose text column contains all the given terms (LIKE '%term%').
+        """
+        if name in self.indexes:
+            return self.indexes[name].search(term.lower().encode("utf-8") for term in terms)
+
+        mask = self.everything()
+        for term in set(terms):
+            mask &= np.char.find(self.columns[name], term.lower().encode("utf-8")) >= 0
+        return mask
+
+    def between(self, name: str, min: Optional[int], max: Optional[int]) -> np.ndarray:
+        column = self.columns[name]
+        mask = self.everything()
+        if min is not None:
+            mask &= column >= min
+        if max is not None:
+            mask &= column <= max
+        return mask
+
+    def equals(self, name: str, value) -> np.ndarray:
+        return self.columns[name] == value
+
+    def select(self, mask: np.ndarray) -> List[str]:
+        return self.ids[mask].tolist()
+
+
+class SpeciesBitmaps:
+    """
+    The VOGs with proteins of each species, as compressed sets of VOG ordinals (the positions in the VOG catalog).
+    Like a roaring bitmap container, a set is stored as sorted ordinals while it is sparse,
+    and as a bitset (np.packbits) when that is smaller.
+    """
+
+    def __init__(self, version: str, size: int, bitmaps: Dict[int, np.ndarray], taxa_by_name: Dict[str, List[int]]):
+        self.version = version
+        self.size = size
+        self.bitmaps = bitmaps
+        self.taxa_by_name = taxa_by_name
+
+    @classmethod
+    def load(cls, db: Session, catalog: VOGCatalog) -> "SpeciesBitmaps":
+        """
+        Loads the bitmaps with the ordinals of the given catalog, it has to be loaded in the same session.
+        """
+        version = catalog.version
+        log.info("Loading the species bitmaps of version {0}...".format(version))
+        keys = catalog.keys
+        ordinals = np.zeros(keys.max() + 1 if len(keys) else 1, dtype=np.int64)
+        ordinals[keys] = np.arange(len(keys))
+
+        rows = db.query(Protein.taxon_id, Member.vog_key).select_from(Member).join(Protein).distinct().all()
+        pairs = np.array(rows, dtype=np.int64).reshape(-1, 2)
+        if not np.isin(pairs[:, 1], keys).all():
+            raise ValueError("The Member table references VOGs that are not in the catalog.")
+        taxa, vogs = pairs[:, 0], ordinals[pairs[:, 1]]
+        order = np.lexsort((vogs, taxa))
+        taxa, vogs = taxa[order], vogs[order]
+
+        dtype = np.uint16 if len(keys) <= 2 ** 16 else np.uint32
+        bitmaps = {}
+        bounds = np.flatnonzero(np.diff(taxa)) + 1
+        for taxon_vogs, taxon in zip(np.split(vogs, bounds), taxa[np.r_[0, bounds]] if len(taxa) else []):
+            if len(taxon_vogs) * np.dtype(dtype).itemsize * 8 > len(keys):
+                bits = np.zeros(len(keys), dtype=bool)
+                bits[taxon_vogs] = True
+                bitmaps[int(taxon)] = np.packbits(bits)
+            else:
+                bitmaps[int(taxon)] = taxon_vogs.astype(dtype)
+
+        taxa_by_name = {}
+        for taxon_id, name in db.query(Species.taxon_id, Species.species_name):
+            taxa_by_name.setdefault(name.lower().strip(), []).append(taxon_id)
+
+        log.info("Species bitmaps loaded: {0} species, {1} bytes.".format(
+            len(bitmaps), sum(bitmap.nbytes for bitmap in bitmaps.values())))
+        return cls(version, len(keys), bitmaps, taxa_by_name)
+
+    def taxa(self, names: Iterable[str]) -> List[int]:
+        """
+        Returns the taxon IDs of the species with the given names (case insensitive, as in MySQL).
+        """
+        return [taxon for name in names for taxon in self.taxa_by_name.get(name.lower().strip(), [])]
+
+    def vogs(self, taxa: Iterable[int]) -> np.ndarray:
+        """
+        Selects the VOGs with proteins of any of the given species (OR of their bitmaps).
+        """
+        mask = np.zeros(self.size, dtype=bool)
+        for taxon in set(taxa):
+            bitmap = self.bitmaps.get(taxon)
+            if bitmap is None:
+                continue
+            if bitmap.dtype == np.uint8:
+                mask |= np.unpackbits(bitmap, count=self.size).astype(bool)
+            else:
+                mask[bitmap] = True
+        return mask
+
+
+def load_release_version(db: Session) -> str:
+    """
+    Reads the version of the loaded release: Species.version and a hash of the MD5 sums of its input files
+    (the File rows of the row hashes), so that a delta load, which keeps Species.version, is a new release too.
+    Releases without row hashes only have Species.version.
+    """
+    version = str(db.query(Species.version).first()[0])
+    if not inspect(db.get_bind()).has_table(RowHash.__tablename__):
+        return version
+    files = db.query(RowHash.hash).filter(RowHash.table_name == "File").order_by(RowHash.row_key).all()
+    if not files:
+        return version
+    digest = hashlib.blake2b(" ".join(str(row[0]) for row in files).encode("utf-8"), digest_size=4)
+    return "{0}-{1}".format(version, digest.hexdigest())
+
+
+def release_version(db: Session) -> str:
+    """
+    Returns the version of the loaded release (see load_release_version).
+    The database is asked at most every VOG_VERSION_TTL seconds.
+    """
+    global _version, _version_checked
+    now = time.monotonic()
+    if _version is None or now - _version_checked > VERSION_TTL:
+        _version = load_release_version(db)
+        _version_checked = now
+    return _version
+
+
+def known_release_version() -> Optional[str]:
+    """
+    Returns the version of the loaded release if it has been checked within the last VOG_VERSION_TTL seconds,
+    otherwise None. Never touches the database.
+    """
+    if _version is not None and time.monotonic() - _version_checked <= VERSION_TTL:
+        return _version
+    return None
+
+
+class ReleaseSnapshot:
+    """
+    The VOG catalog and the species bitmaps of one release, loaded from the same database session.
+    """
+
+    def __init__(self, catalog: VOGCatalog, bitmaps: SpeciesBitmaps):
+        if len(catalog) != bitmaps.size:
+            raise ValueError("The species bitmaps have {0} VOGs, the catalog has {1}.".format(
+                bitmaps.size, len(catalog)))
+        self.version = catalog.version
+        self.catalog = catalog
+        self.bitmaps = bitmaps
+
+    @classmethod
+    def load(cls, db: Session, version: str) -> "ReleaseSnapshot":
+        catalog = VOGCatalog.load(db, version)
+        return cls(catalog, SpeciesBitmaps.load(db, catalog))
+
+
+def release_snapshot(db: Session) -> ReleaseSnapshot:
+    """
+    Returns the catalog and species bitmaps of the loaded release, (re)building them if necessary.
+    A search takes both from the same snapshot.
+    """
+    global _snapshot
+    version = release_version(db)
+    if _snapshot is None or _snapshot.version != version:
+        with _lock:
+            if _snapshot is None or _snapshot.version != version:
+                _snapshot = ReleaseSnapshot.load(db, version)
+    return _snapshot
@@ -1,10 +1,16 @@
+import asyncio
+import functools
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
-""" This module is used for establishing a connection to the MYSQL database
+""" This module is used for establishing a connection to the MYSQL database, or to the SQLite release file
 Note: you might need to change the MYSQL login credentials if you have setted up your MYSQL database differently
 """
 
@@ -18,11 +24,207 @@ def database_url():
     return "mysql+pymysql://{0}:{1}@{2}/{3}".format(username, password, server, database)
 
 
+# SQLite release file written by the loader (see vogdb.loader.sqlite). If set, the API reads it instead of MySQL.
+SQLITE_PATH = os.environ.get("VOG_SQLITE")
+
+
+def sqlite_url(path):
+    """
+    URL of the SQLite release file, opened read-only and immutable: SQLite neither locks it nor checks it for
+    changes. The loader replaces the file instead of changing it, open connections keep reading the old one
+    until the pool replaces them (see sqlite_engine).
+    """
+    return "sqlite:///file:{0}?mode=ro&immutable=1&uri=true".format(path)
+
+
+def sqlite_file_id(path):
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns
+
+
+class PoolStats:
+    """
+    Counts the connection checkouts of the pool and the time spent waiting for them.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.max_checked_out = 0
+
+    def record(self, wait: float, checked_out: int = 0, timeout: bool = False):
+        with self.lock:
+            if timeout:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self.max_checked_out = max(self.max_checked_out, checked_out)
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that records how long every checkout takes (waiting for a free connection,
+    opening a new one and the pre-ping) in pool_stats.
+    """
+
+    def __init__(self, creator, pool_size=5, max_overflow=10, **kw):
+        super().__init__(creator, pool_size=pool_size, max_overflow=max_overflow, **kw)
+        self.max_connections = pool_size + max_overflow if max_overflow >= 0 else None
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            pool_stats.record(time.perf_counter() - start, timeout=True)
+            raise
+        pool_stats.record(time.perf_counter() - start, self.checkedout())
+        return connection
+
+
+def pool_args():
+    """
+    Connection pool settings, read from the environment like the connection parameters:
+    MYSQL_POOL_SIZE connections are kept open, up to MYSQL_MAX_OVERFLOW more are opened under load,
+    a checkout waits at most MYSQL_POOL_TIMEOUT seconds, connections are replaced after MYSQL_POOL_RECYCLE seconds
+    (keep it below MySQL's wait_timeout) and tested before use unless MYSQL_POOL_PRE_PING=0.
+    """
+    return dict(poolclass=TimedQueuePool,
+                pool_size=int(os.environ.get("MYSQL_POOL_SIZE", 10)),
+                max_overflow=int(os.environ.get("MYSQL_MAX_OVERFLOW", 10)),
+                pool_timeout=float(os.environ.get("MYSQL_POOL_TIMEOUT", 30)),
+                pool_recycle=int(os.environ.get("MYSQL_POOL_RECYCLE", 3600)),
+                pool_pre_ping=os.environ.get("MYSQL_POOL_PRE_PING", "1") != "0")
+
+
+def sqlite_args():
+    """
+    Connection settings of the SQLite release file: the connections are shared by the threads of the executor
+    and memory-map up to VOG_SQLITE_MMAP bytes of the file.
+    """
+    return dict(poolclass=TimedQueuePool,
+                pool_size=int(os.environ.get("MYSQL_POOL_SIZE", 10)),
+                max_overflow=int(os.environ.get("MYSQL_MAX_OVERFLOW", 10)),
+                connect_args={"check_same_thread": False})
+
+
+def set_mmap_size(dbapi_connection, connection_record):
+    dbapi_connection.execute("PRAGMA mmap_size = {0:d};".format(int(os.environ.get("VOG_SQLITE_MMAP", 2 ** 30))))
+
+
+def sqlite_engine(path):
+    """
+    Engine of the SQLite release file at path. A connection remembers the file it has opened, and when the
+    loader has replaced the file, the pool closes the connection at its next checkout and opens the new file.
+    A session keeps its connection, so it reads one release only.
+    """
+    engine = create_engine(sqlite_url(path), echo=False, **sqlite_args())
+
+    @event.listens_for(engine, "do_connect")
+    def remember_file(dialect, connection_record, cargs, cparams):
+        # before the file is opened: if it is replaced in between, the connection is only replaced once more
+        connection_record.info["file"] = sqlite_file_id(path)
+
+    @event.listens_for(engine, "checkout")
+    def check_file(dbapi_connection, connection_record, connection_proxy):
+        if connection_record.info.get("file") != sqlite_file_id(path):
+            raise exc.DisconnectionError("The release file {0} has been replaced.".format(path))
+
+    event.listen(engine, "connect", set_mmap_size)
+    return engine
+
+
+def pool_metrics() -> dict:
+    """
+    Current utilization of the connection pool and the checkout statistics since the start.
+    """
+    pool = engine.pool
+    checked_out = pool.checkedout() if isinstance(pool, QueuePool) else 0
+    max_connections = getattr(pool, "max_connections", None)
+    with pool_stats.lock:
+        return {
+            "size": pool.size() if isinstance(pool, QueuePool) else 0,
+            "max_connections": max_connections,
+            "checked_out": checked_out,
+            "checked_in": pool.checkedin() if isinstance(pool, QueuePool) else 0,
+            "max_checked_out": pool_stats.max_checked_out,
+            "utilization": checked_out / max_connections if max_connections else None,
+            "checkouts": pool_stats.checkouts,
+            "timeouts": pool_stats.timeouts,
+            "wait_seconds_total": pool_stats.wait_total,
+            "wait_seconds_max": pool_stats.wait_max,
+            "wait_seconds_mean": pool_stats.wait_total / max(pool_stats.checkouts + pool_stats.timeouts, 1),
+        }
+
+
 # Create an engine object.
-engine = create_engine(database_url(), echo=False)
+if SQLITE_PATH:
+    engine = sqlite_engine(SQLITE_PATH)
+else:
+    engine = create_engine(database_url(), echo=False, **pool_args())
 
 # Each instance of the SessionLocal class will be a database session
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Bounded pool of threads that runs the blocking database calls of the async endpoints,
+# so that a slow query does not stall the event loop. It should not be larger than the connection pool
+# (MYSQL_POOL_SIZE + MYSQL_MAX_OVERFLOW), otherwise threads queue for connections.
+THREADS = int(os.environ.get("MYSQL_THREADS", 8))
+executor = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix="vogdb-db")
+
+
+# open sessions of the requests: every session holds a connection for its whole request, also while it waits
+# for an executor thread. With at most max_connections - threads sessions, a thread never waits for a connection,
+# otherwise all threads can block in checkouts while the sessions holding the connections wait for a thread.
+MAX_SESSIONS = max((getattr(engine.pool, "max_connections", None) or 2 ** 31) - THREADS, 1)
+_session_slots = None
+
+
+def session_slots() -> asyncio.Semaphore:
+    """
+    Bounds the open sessions of the requests to MAX_SESSIONS, the requests over it wait on the event loop.
+    Created in the event loop of the worker.
+    """
+    global _session_slots
+    if _session_slots is None:
+        _session_slots = asyncio.Semaphore(MAX_SESSIONS)
+    return _session_slots
+
+
+# streamed responses keep their session until the client has received the last chunk, which takes as long as the
+# slowest client needs. They hold at most half of the session slots, so that slow downloads cannot block the
+# other requests.
+MAX_STREAM_SESSIONS = max(MAX_SESSIONS // 2, 1)
+_stream_slots = None
+
+
+def stream_slots() -> asyncio.Semaphore:
+    """
+    Bounds the open sessions of the streamed responses to MAX_STREAM_SESSIONS, taken before the session slot.
+    Created in the event loop of the worker.
+    """
+    global _stream_slots
+    if _stream_slots is None:
+        _stream_slots = asyncio.Semaphore(MAX_STREAM_SESSIONS)
+    return _stream_slots
+
+
+async def run_db(func, *args, **kwargs):
+    """
+    Runs a blocking database call in the database executor and awaits its result,
+    so that the event loop can serve other requests in the meantime.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
 # returns a class. Later we will inherit from this class to create each of the database models or classes
 Base = declarative_base()
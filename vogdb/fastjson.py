@@ -0,0 +1,29 @@
+import json
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+"""
+Fast JSON encoding of plain rows (dicts, lists, str, int, bool, None) built directly from query results.
+It is used instead of the pydantic schemas for large responses, the schemas in schemas.py stay the documented
+response models. orjson is used if it is installed, otherwise the standard library encoder.
+"""
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response for content that is already made of plain rows, so it skips jsonable_encoder.
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -1,16 +1,23 @@
 import os
 import logging
 import gzip
-from typing import Dict, Optional, Set, List
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from typing import Dict, Iterable, Iterator, Optional, Set, List
+from sqlalchemy.orm import Session, defaultload, joinedload, load_only, noload, selectinload
 
-from .models import VOG, Species, Protein, Member
-from .taxa import ncbi_taxa
+from .models import VOG, Species, Protein, Sequence
+from .taxa import taxonomy_tree
+from .catalog import release_snapshot, release_version
+from .store import packed_store
 
 # get logger:
 log = logging.getLogger(__name__)
 
+# number of rows fetched at once from a server side cursor
+STREAM_BATCH = 1000
+
+# maximal number of IDs in one IN (...) query
+IN_CHUNK = 500
+
 """
 Here we define all the search methods that are used for extracting the data from the database
 """
@@ -29,13 +36,29 @@ if those two criteria are not fulfilled, pydantic will throw an ValidationError
 """
 
 
+# the VOG columns of VOG_base, e.g. for the VOGs of a protein summary
+PROFILE_VOG_COLUMNS = [VOG.protein_count, VOG.species_count, VOG.function, VOG.consensus_function,
+                       VOG.genomes_in_group, VOG.genomes_total_in_LCA, VOG.ancestors,
+                       VOG.h_stringency, VOG.m_stringency, VOG.l_stringency]
+
+
+def chunked(ids: Iterable, size: int = IN_CHUNK) -> Iterator[list]:
+    """
+    Splits the distinct IDs, in sorted order, into chunks for IN (...) queries.
+    """
+    ids = sorted(set(ids))
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
 def get_species(db: Session,
                 taxon_id: List[int],
                 species_name: List[str],
                 phage: Optional[bool],
                 source: Optional[str]):
     """
-    This function searches the Species based on the given query parameters
+    This function searches the Species based on the given query parameters.
+    The returned query streams its rows from a server side cursor.
     """
     log.debug("Searching Species in the database...")
 
@@ -54,7 +77,7 @@ def get_species(db: Session,
     if source:
         query = query.filter(Species.source.like("%" + source + "%"))
 
-    return query.order_by(Species.taxon_id).all()
+    return query.order_by(Species.taxon_id).execution_options(stream_results=True).yield_per(STREAM_BATCH)
 
 
 def find_species_by_id(db: Session, ids: List[int]):
@@ -92,12 +115,14 @@ def get_vogs(db: Session,
              tax_id: Optional[Set[int]],
              union: Optional[bool]):
     """
-    This function searches the VOG based on the given query parameters
+    This function searches the VOG based on the given query parameters.
+    The filters on the VOG columns are evaluated on the in-memory VOG catalog, the filters on species and taxa
+    on the species bitmaps, only the filter on proteins needs the database.
+
+    :return: the IDs of the matching VOGs, ordered by ID
     """
     log.info("Searching VOGs in the database...")
 
-    result = db.query(VOG.id)
-
     # make checks for validity of user input:
     def check_validity(pair):
         min = pair[0]
@@ -128,120 +153,112 @@ def get_vogs(db: Session,
             log.error("The 'Union' Parameter was provided, but the number of taxonomy IDs is smaller than 2.")
             raise ValueError("The 'Union' Parameter was provided, but the number of taxonomy IDs is smaller than 2.")
 
+    # the catalog and the bitmaps of the same release
+    snapshot = release_snapshot(db)
+    catalog, bitmaps = snapshot.catalog, snapshot.bitmaps
+    mask = catalog.everything()
+
     if id:
-        result = result.filter(VOG.id.in_(id))
+        mask &= catalog.isin(id)
 
     if consensus_function:
-        for d in set(consensus_function):
-            result = result.filter(VOG.consensus_function.like("%" + d + "%"))
+        mask &= catalog.contains("consensus_function", consensus_function)
 
     if function:
-        for d in set(function):
-            result = result.filter(VOG.function.like("%" + d + "%"))
-
-    if smin is not None:
-        result = result.filter(VOG.species_count >= smin)
-    if smax is not None:
-        result = result.filter(VOG.species_count <= smax)
-
-    if pmin is not None:
-        result = result.filter(VOG.protein_count >= pmin)
-    if pmax is not None:
-        result = result.filter(VOG.protein_count <= pmax)
+        mask &= catalog.contains("function", function)
 
-    if mingLCA is not None:
-        result = result.filter(VOG.genomes_total_in_LCA >= mingLCA)
-    if maxgLCA is not None:
-        result = result.filter(VOG.genomes_total_in_LCA <= maxgLCA)
-
-    if mingGLCA is not None:
-        result = result.filter(VOG.genomes_in_group >= mingGLCA)
-    if maxgGLCA is not None:
-        result = result.filter(VOG.genomes_in_group <= maxgGLCA)
+    mask &= catalog.between("species_count", smin, smax)
+    mask &= catalog.between("protein_count", pmin, pmax)
+    mask &= catalog.between("genomes_total_in_LCA", mingLCA, maxgLCA)
+    mask &= catalog.between("genomes_in_group", mingGLCA, maxgGLCA)
 
     if h_stringency is not None:
-        result = result.filter(VOG.h_stringency == h_stringency)
+        mask &= catalog.equals("h_stringency", h_stringency)
     if m_stringency is not None:
-        result = result.filter(VOG.m_stringency == m_stringency)
+        mask &= catalog.equals("m_stringency", m_stringency)
     if l_stringency is not None:
-        result = result.filter(VOG.l_stringency == l_stringency)
+        mask &= catalog.equals("l_stringency", l_stringency)
     if virus_specific is not None:
-        result = result.filter(VOG.virus_specific == virus_specific)
+        mask &= catalog.equals("virus_specific", virus_specific)
 
     if phages_nonphages:
-        result = result.filter(VOG.phages_nonphages.like("%" + phages_nonphages + "%"))
+        mask &= catalog.contains("phages_nonphages", [phages_nonphages])
 
     if ancestors:
-        for d in set(ancestors):
-            result = result.filter(VOG.ancestors.like("%" + d + "%"))
-
-    if proteins:
-        for d in set(proteins):
-            result = result.filter(VOG.proteins.any(Protein.id == d))
+        mask &= catalog.contains("ancestors", ancestors)
 
     if species:
         if union:
-            sub = db.query(Member.vog_id).join(Protein).join(Species) \
-                .filter(Species.species_name.in_(species)) \
-                .subquery()
+            mask &= bitmaps.vogs(bitmaps.taxa(species))
         else:
-            sub = db.query(Member.vog_id).join(Protein).join(Species) \
-                .filter(Species.species_name.in_(species)) \
-                .group_by(Member.vog_id).having(func.count(Species.species_name) == len(species)) \
-                .subquery()
-        result = result.filter(VOG.id.in_(sub))
+            # the VOGs with proteins of every species
+            for name in set(species):
+                mask &= bitmaps.vogs(bitmaps.taxa([name]))
 
     if tax_id:
-        ncbi = ncbi_taxa()
+        tree = taxonomy(db)
         try:
             if union:
                 # UNION SEARCH:
-                id_list = []
+                id_list = set()
                 for id in tax_id:
-                    id_list.extend(
-                        ncbi.get_descendant_taxa(id, collapse_subspecies=False, intermediate_nodes=True))
-                    id_list.append(id)
-
-                sub = db.query(Member.vog_id).join(Protein) \
-                    .filter(Protein.taxon_id.in_(id_list)) \
-                    .subquery()
-                result = result.filter(VOG.id.in_(sub))
+                    id_list.update(tree.descendant_species(id))
+                mask &= bitmaps.vogs(id_list)
             else:
                 for id in tax_id:
-                    id_list = [id]
-                    id_list.extend(
-                        ncbi.get_descendant_taxa(id, collapse_subspecies=False, intermediate_nodes=True))
-                    sub = db.query(Member.vog_id).join(Protein) \
-                        .filter(Protein.taxon_id.in_(id_list)) \
-                        .subquery()
-                    result = result.filter(VOG.id.in_(sub))
+                    mask &= bitmaps.vogs(tree.descendant_species(id))
         except ValueError:
             raise ValueError("The provided taxonomy ID is invalid: {0}".format(id))
 
-    return result.order_by(VOG.id).all()
+    if not proteins or not mask.any():
+        return catalog.select(mask)
+
+    result = db.query(VOG.id)
+
+    for d in set(proteins):
+        result = result.filter(VOG.proteins.any(Protein.id == d))
+
+    mask &= catalog.isin(row[0] for row in result)
+    return catalog.select(mask)
+
+
+def taxonomy(db: Session):
+    """
+    Returns the taxonomy tree of the species of the loaded release.
+    """
+    return taxonomy_tree(release_version(db), lambda: [row[0] for row in db.query(Species.taxon_id)])
 
 
 def find_vogs_by_uid(db: Session, ids: Optional[List[str]]):
     """
-    This function returns the VOG information based on the given VOG IDs
+    This function returns the VOG information based on the given VOG IDs.
+    The IDs are queried in chunks, the VOGs are yielded chunk by chunk.
+    Only the columns of VOG_profile are loaded: the IDs of the proteins, but neither the members
+    nor the species of the proteins. That are two queries per chunk: the VOGs, and the IDs of their proteins.
     """
 
     if ids:
         log.debug("Searching VOGs by IDs in the database...")
 
-        return db.query(VOG).filter(VOG.id.in_(ids)).all()
+        query = db.query(VOG).options(
+            load_only(VOG.id, *PROFILE_VOG_COLUMNS),
+            noload(VOG.members),
+            selectinload(VOG.proteins).load_only(Protein.id),
+            defaultload(VOG.proteins).noload(Protein.members),
+            defaultload(VOG.proteins).noload(Protein.species))
+        for chunk in chunked(ids):
+            yield from query.filter(VOG.id.in_(chunk))
     else:
         log.debug("No IDs were given.")
 
-        return list()
-
 
 def get_proteins(db: Session,
                  species: List[str],
                  taxon_id: List[int],
                  vog_id: List[str]):
     """
-    This function searches the for proteins based on the given query parameters
+    This function searches the for proteins based on the given query parameters.
+    The returned query streams its rows from a server side cursor.
     """
     log.debug("Searching Proteins in the database...")
 
@@ -251,29 +268,85 @@ def get_proteins(db: Session,
         query = query.filter(Protein.taxon_id.in_(set(taxon_id)))
 
     if vog_id:
-        query = query.join(Member)
-        query = query.filter(Member.vog_id.in_(vog_id))
+        query = query.join(Protein.vogs)
+        query = query.filter(VOG.id.in_(vog_id))
 
     if species:
         query = query.join(Species)
         for s in set(species):
             query = query.filter(Species.species_name.like("%" + s + "%"))
 
-    return query.order_by(Protein.id).all()
+    return query.order_by(Protein.id).execution_options(stream_results=True).yield_per(STREAM_BATCH)
 
 
 def find_proteins_by_id(db: Session, pids: List[str]):
     """
-    This function returns the Protein information based on the given Protein IDs
+    This function returns the Protein information based on the given Protein IDs.
+    The IDs are queried in chunks, the proteins are yielded chunk by chunk.
+    Only the columns of Protein_profile are loaded: no sequences, and neither the proteins of the species
+    nor the members of the VOGs. That are two queries per chunk: proteins joined with their species, and their VOGs.
     """
     if pids:
         log.debug("Searching Proteins by ProteinIDs in the database...")
 
-        return db.query(Protein).filter(Protein.id.in_(pids)).all()
+        query = db.query(Protein).options(
+            load_only(Protein.id, Protein.taxon_id),
+            noload(Protein.members),
+            joinedload(Protein.species).load_only(Species.species_name, Species.phage, Species.source,
+                                                  Species.version),
+            defaultload(Protein.species).noload(Species.proteins),
+            selectinload(Protein.vogs).load_only(VOG.id, *PROFILE_VOG_COLUMNS),
+            defaultload(Protein.vogs).noload(VOG.members))
+        for chunk in chunked(pids):
+            yield from query.filter(Protein.id.in_(chunk))
     else:
         log.debug("No IDs were given.")
 
-        return list()
+
+def find_vog_profile_rows(db: Session, ids: Optional[List[str]]) -> Iterator[dict]:
+    """
+    This function returns the VOG information based on the given VOG IDs as plain rows in the shape of VOG_profile,
+    built directly from the query results without ORM objects. Two queries per chunk: the VOGs and their members.
+    """
+    if ids:
+        log.debug("Searching VOG rows by IDs in the database...")
+
+        keys = ["id"] + [c.key for c in PROFILE_VOG_COLUMNS]
+        for chunk in chunked(ids):
+            proteins = {}
+            for vog_id, protein_id in db.query(VOG.id, Protein.id).join(VOG.proteins).filter(VOG.id.in_(chunk)):
+                proteins.setdefault(vog_id, []).append({"id": protein_id})
+
+            for row in db.query(VOG.id, *PROFILE_VOG_COLUMNS).filter(VOG.id.in_(chunk)).order_by(VOG.id):
+                vog = dict(zip(keys, row))
+                vog["proteins"] = proteins.get(vog["id"], [])
+                yield vog
+    else:
+        log.debug("No IDs were given.")
+
+
+def find_protein_profile_rows(db: Session, pids: Optional[List[str]]) -> Iterator[dict]:
+    """
+    This function returns the Protein information based on the given Protein IDs as plain rows in the shape of
+    Protein_profile, built directly from the query results without ORM objects.
+    Two queries per chunk: the proteins joined with their species, and their VOGs.
+    """
+    if pids:
+        log.debug("Searching Protein rows by ProteinIDs in the database...")
+
+        species_keys = ["taxon_id", "species_name", "phage", "source", "version"]
+        vog_keys = ["id"] + [c.key for c in PROFILE_VOG_COLUMNS]
+        for chunk in chunked(pids):
+            vogs = {}
+            for row in db.query(Protein.id, VOG.id, *PROFILE_VOG_COLUMNS).join(Protein.vogs) \
+                    .filter(Protein.id.in_(chunk)):
+                vogs.setdefault(row[0], []).append(dict(zip(vog_keys, row[1:])))
+
+            for row in db.query(Protein.id, Species.taxon_id, Species.species_name, Species.phage, Species.source,
+                                Species.version).join(Species).filter(Protein.id.in_(chunk)).order_by(Protein.id):
+                yield {"id": row[0], "vogs": vogs.get(row[0], []), "species": dict(zip(species_keys, row[1:]))}
+    else:
+        log.debug("No IDs were given.")
 
 
 def find_vogs_hmm_by_uid(uid: List[str]) -> Dict[str, str]:
@@ -297,6 +370,10 @@ def hmm_content(uid: str) -> str:
     return _load_gzipped_file_content(uid.upper(), "hmm", ".hmm.gz")
 
 
+def hmm_gzip(uid: str) -> bytes:
+    return _load_gzipped_file(uid.upper(), "hmm", ".hmm.gz")
+
+
 
 def find_vogs_msa_by_uid(uid: List[str]) -> Dict[str, str]:
     log.debug("Searching for Multiple Sequence Alignments (MSA) in the data files...")
@@ -319,38 +396,56 @@ def msa_content(uid: str) -> str:
     return _load_gzipped_file_content(uid.upper(), "raw_algs", ".msa.gz")
 
 
+def msa_gzip(uid: str) -> bytes:
+    return _load_gzipped_file(uid.upper(), "raw_algs", ".msa.gz")
 
 
 
-def _load_gzipped_file_content(id: str, prefix: str, suffix: str) -> str:
+
+
+def _load_gzipped_file(id: str, prefix: str, suffix: str) -> bytes:
+    """
+    Returns the gzipped data file from the packed store, or from the single file if the data has not been packed.
+    """
+    store = packed_store(prefix)
+    if store is not None:
+        return store.member(id)
+
     file_name = os.path.join(os.environ.get("VOG_DATA", "data"), prefix, id + suffix)
-    with gzip.open(file_name, "rt") as f:
+    with open(file_name, "rb") as f:
         return f.read()
 
 
+def _load_gzipped_file_content(id: str, prefix: str, suffix: str) -> str:
+    return gzip.decompress(_load_gzipped_file(id, prefix, suffix)).decode("utf-8")
+
+
 def find_protein_faa_by_id(db: Session, id: Optional[List[str]]):
     """
-    This function returns the Aminoacid sequences of the proteins based on the given Protein IDs
+    This function returns the Aminoacid sequences of the proteins based on the given Protein IDs.
+    The IDs are queried in chunks, the sequences of a chunk are streamed from a server side cursor.
     """
     if id:
         log.info("Searching AA sequence by ProteinIDs in the database...")
-        query = db.query(Protein.id, Protein.aa_seq)
-        return query.filter(Protein.id.in_(id)).all()
+        for chunk in chunked(id):
+            yield from db.query(Protein.id, Sequence.aa_seq).outerjoin(Protein.sequence) \
+                .filter(Protein.id.in_(chunk)) \
+                .execution_options(stream_results=True).yield_per(STREAM_BATCH)
     else:
         log.error("No IDs were given.")
 
-        return list()
-
 
 def find_protein_fna_by_id(db: Session, id: Optional[List[str]]):
     """
-    This function returns the Nucleotide sequences of the proteins based on the given Protein IDs
+    This function returns the Nucleotide sequences of the proteins based on the given Protein IDs.
+    The IDs are queried in chunks, the sequences of a chunk are streamed from a server side cursor
+    and unpacked (see vogdb.sequences) as they are fetched.
     """
     if id:
         log.info("Searching NT sequence by ProteinIDs in the database...")
-        query = db.query(Protein.id, Protein.nt_seq)
-        return query.filter(Protein.id.in_(id)).all()
+        for chunk in chunked(id):
+            yield from db.query(Protein.id, Sequence.nt_seq).outerjoin(Protein.sequence) \
+                .filter(Protein.id.in_(chunk)) \
+                .execution_options(stream_results=True).yield_per(STREAM_BATCH)
     else:
         log.error("No IDs were given.")
-
-        return list()
@@ -1,2 +1,7 @@
-from .frames import load_frames
-from .support import save_db_sql
\ No newline at end of file
+from .frames import load_frames, load_aa_seq, load_nt_seq
+from .support import save_db_sql, rollback
+from .bulk import save_db_bulk
+from .delta import save_db_delta
+from .sqlite import save_db_sqlite
+from .hashes import file_hashes
+from .packs import pack_files
\ No newline at end of file
@@ -2,18 +2,52 @@ import os
 import sys
 
 from ..database import database_url
-from . import load_frames, save_db_sql
+from ..store import INDEX_SUFFIX
+from . import load_frames, load_aa_seq, load_nt_seq, save_db_sql, save_db_bulk, save_db_delta, save_db_sqlite, \
+    file_hashes, pack_files, rollback
 
 
+if sys.argv[1:] == ["--rollback"]:
+    # restore the previous release
+    rollback(database_url())
+    sys.exit(0)
+
 data_dir = sys.argv[1] if len(sys.argv) > 1 else os.environ.get("VOG_DATA")
 
 if not data_dir:
-    print(f"usage: {sys.argv[0]} <data directory>")
+    print(f"usage: {sys.argv[0]} <data directory> | --rollback")
     sys.exit(2)
 
 if data_dir[:-1] != "/":
     data_dir += "/"
 
-vog, species, protein, member = load_frames(data_dir)
+# VOG_BULK_LOAD=1 loads the tables with LOAD DATA LOCAL INFILE (the server needs local_infile=ON)
+save = save_db_bulk if os.environ.get("VOG_BULK_LOAD", "0") != "0" else save_db_sql
+
+# VOG_SQLITE=<file> also writes the release into an SQLite file, VOG_SQLITE_ONLY=1 skips MySQL
+sqlite_path = os.environ.get("VOG_SQLITE")
+frames = None
+
+mysql = not sqlite_path or os.environ.get("VOG_SQLITE_ONLY", "0") == "0"
+
+# False if the delta load found the input files unchanged, the SQLite file and the packs are then only
+# written if they are missing
+changed = True
+
+if mysql and os.environ.get("VOG_DELTA_LOAD", "0") != "0":
+    # only write the rows that changed since the loaded release
+    changed = save_db_delta(database_url(), data_dir, save)
+elif mysql:
+    frames = load_frames(data_dir)
+    save(database_url(), *frames, load_aa_seq(data_dir), load_nt_seq(data_dir), file_hashes(data_dir))
+
+if sqlite_path and (changed or not os.path.exists(sqlite_path)):
+    save_db_sqlite(sqlite_path, *(frames or load_frames(data_dir)), load_aa_seq(data_dir), load_nt_seq(data_dir),
+                   file_hashes(data_dir))
 
-save_db_sql(database_url(), vog, species, protein, member)
+for prefix, suffix in [("hmm", ".hmm.gz"), ("raw_algs", ".msa.gz")]:
+    if not changed and os.path.exists(os.path.join(data_dir, prefix + INDEX_SUFFIX)):
+        print(f"The input files are unchanged, keeping the {prefix} pack!")
+    elif os.path.isdir(os.path.join(data_dir, prefix)):
+        count = pack_files(data_dir, prefix, suffix)
+        print(f"{count} {prefix} files packed!")
@@ -0,0 +1,236 @@
+import os
+import tempfile
+import time
+
+import numpy as np
+from pandas.api.types import is_bool_dtype, is_integer_dtype, is_numeric_dtype
+from sqlalchemy import create_engine
+
+from ..sequences import pack_nt
+from .hashes import SequenceHashes, row_hashes, save_row_hashes
+from .support import NEW, TABLES, create_indexes, drop_tables, drop_v1_tables, publish
+
+"""
+Bulk load of the tables: every frame is written to a TSV spool file and loaded with LOAD DATA LOCAL INFILE
+into a table whose primary and foreign keys are declared up front. The foreign key and unique checks are
+switched off during the load. The MySQL server has to allow it (local_infile=ON).
+"""
+
+# the tables are created as <name>_new, see publish
+DDL = {
+    "VOG": """
+        CREATE TABLE VOG{new} (
+            VOGKey int NOT NULL PRIMARY KEY,
+            VOG_ID varchar(30) NOT NULL UNIQUE,
+            ProteinCount int NOT NULL,
+            SpeciesCount int NOT NULL,
+            FunctionalCategory varchar(30) NOT NULL,
+            Consensus_func_description varchar(100) NOT NULL,
+            GenomesInGroup int NOT NULL,
+            GenomesTotal int NOT NULL,
+            Ancestors varchar(255) NULL,
+            StringencyHigh bool NOT NULL,
+            StringencyMedium bool NOT NULL,
+            StringencyLow bool NOT NULL,
+            VirusSpecific bool NOT NULL,
+            NumPhages int NOT NULL,
+            NumNonPhages int NOT NULL,
+            PhageNonphage varchar(32) NOT NULL
+        );
+    """,
+    "Species": """
+        CREATE TABLE Species{new} (
+            TaxonID int NOT NULL PRIMARY KEY,
+            SpeciesName varchar(100) NOT NULL,
+            Phage bool NOT NULL,
+            Source varchar(100) NOT NULL,
+            Version int NOT NULL
+        );
+    """,
+    "Protein": """
+        CREATE TABLE Protein{new} (
+            ProteinKey int NOT NULL PRIMARY KEY,
+            ProteinID varchar(30) NOT NULL UNIQUE,
+            TaxonID int NOT NULL,
+            FOREIGN KEY(TaxonID) REFERENCES Species{new}(TaxonID)
+        );
+    """,
+    "Sequence": """
+        CREATE TABLE Sequence{new} (
+            ProteinKey int NOT NULL PRIMARY KEY,
+            AAseq text NULL,
+            NTseq blob NULL,
+            FOREIGN KEY(ProteinKey) REFERENCES Protein{new}(ProteinKey)
+        );
+    """,
+    "Member": """
+        CREATE TABLE Member{new} (
+            VOGKey int NOT NULL,
+            ProteinKey int NOT NULL,
+            PRIMARY KEY(VOGKey, ProteinKey),
+            FOREIGN KEY(VOGKey) REFERENCES VOG{new}(VOGKey),
+            FOREIGN KEY(ProteinKey) REFERENCES Protein{new}(ProteinKey)
+        );
+    """,
+}
+
+
+def tsv_column(values):
+    """
+    The values of a column in the default format of LOAD DATA: NULL is \\N, booleans are 1 and 0,
+    and backslash, tab and newline are escaped.
+
+    :return: the values as list of str
+    """
+    nulls = values.isna().to_numpy()
+    if is_bool_dtype(values):
+        text = values.map({True: "1", False: "0"})
+    elif is_integer_dtype(values):
+        return list(map(str, values.tolist()))
+    elif is_numeric_dtype(values):
+        text = values.astype(str)
+    else:
+        text = values.astype(str).str.replace("\\", "\\\\", regex=False).str.replace("\t", "\\t", regex=False) \
+            .str.replace("\n", "\\n", regex=False)
+    return text.mask(nulls, "\\N").tolist()
+
+
+def write_tsv(f, frame, columns):
+    if frame.empty:
+        return
+    lines = map("\t".join, zip(*[tsv_column(frame[column]) for column in columns]))
+    f.write("\n".join(lines))
+    f.write("\n")
+
+
+def load_tsv(con, filename, table, columns, assignments=()):
+    """
+    :param assignments: SET clauses of the load, for columns computed from the @variables in columns
+    """
+    con.execute(
+        "LOAD DATA LOCAL INFILE '{0}' INTO TABLE {1} CHARACTER SET utf8mb4 ({2}){3};".format(
+            filename.replace("\\", "/"),
+            table,
+            ", ".join(columns),
+            " SET " + ", ".join(assignments) if assignments else "",
+        )
+    )
+
+
+def bulk_load(con, spool, table, frame, columns):
+    """
+    Writes the columns of the frame into a spool file and loads it into the table.
+    """
+    filename = os.path.join(spool, table + ".tsv")
+    with open(filename, "wt", encoding="utf-8") as f:
+        write_tsv(f, frame, columns)
+    load_tsv(con, filename, table, columns)
+    os.remove(filename)
+
+
+def bulk_load_sequences(con, spool, table, column, batches, pack=None):
+    """
+    Writes the sequence batches one after the other into a spool file and loads it into a staging table.
+
+    :param pack: converts a sequence into its binary stored form (e.g. pack_nt), which is spooled as hex
+    :return: the number of sequences
+    """
+    filename = os.path.join(spool, table + ".tsv")
+    count = 0
+    with open(filename, "wt", encoding="utf-8") as f:
+        for batch in batches:
+            if pack:
+                batch = batch.assign(**{column: batch[column].map(lambda seq: pack(seq).hex(), na_action="ignore")})
+            write_tsv(f, batch.reset_index(), ["ProteinID", column])
+            count += len(batch)
+
+    con.execute("DROP TABLE IF EXISTS {0};".format(table))
+    con.execute(
+        "CREATE TABLE {0} (ProteinID varchar(30) NOT NULL PRIMARY KEY, {1} {2} NULL);".format(
+            table, column, "blob" if pack else "text"
+        )
+    )
+    # duplicate IDs are skipped (LOCAL implies IGNORE)
+    if pack:
+        load_tsv(con, filename, table, ["ProteinID", "@hex"], ["{0} = UNHEX(@hex)".format(column)])
+    else:
+        load_tsv(con, filename, table, ["ProteinID", column])
+    os.remove(filename)
+    return count
+
+
+def save_db_bulk(db_url, vog, species, proteins, membership, aa_seq=(), nt_seq=(), files=None):
+    """
+    Creates and publishes all tables like save_db_sql, but loads them with LOAD DATA LOCAL INFILE.
+    The sequences are spooled into staging tables and joined into the Sequence table with one INSERT ... SELECT.
+    """
+    engine = create_engine(db_url, connect_args={"local_infile": True})
+    aa_seq = SequenceHashes(aa_seq)
+    nt_seq = SequenceHashes(nt_seq)
+
+    drop_v1_tables(engine)
+    drop_tables(engine, NEW)
+
+    with tempfile.TemporaryDirectory(prefix="vogdb-") as spool, \
+            engine.connect().execution_options(autocommit=True) as con:
+        con.execute("SET foreign_key_checks = 0;")
+        con.execute("SET unique_checks = 0;")
+
+        for table, frame in [("VOG", vog), ("Species", species)]:
+            start = time.perf_counter()
+            frame = frame.reset_index()
+            con.execute(DDL[table].format(new=NEW))
+            bulk_load(con, spool, table + NEW, frame, list(frame.columns))
+            print(f"{table} table loaded in {time.perf_counter() - start:.1f} s!")
+
+        start = time.perf_counter()
+        count = bulk_load_sequences(con, spool, "AAseqLoad", "AAseq", aa_seq)
+        print(f"{count} amino acid sequences loaded in {time.perf_counter() - start:.1f} s!")
+        start = time.perf_counter()
+        count = bulk_load_sequences(con, spool, "NTseqLoad", "NTseq", nt_seq, pack_nt)
+        print(f"{count} nucleotide sequences loaded in {time.perf_counter() - start:.1f} s!")
+
+        start = time.perf_counter()
+        con.execute(DDL["Protein"].format(new=NEW))
+        bulk_load(con, spool, "Protein" + NEW, proteins.reset_index(), ["ProteinKey", "ProteinID", "TaxonID"])
+        print(f"Protein table loaded in {time.perf_counter() - start:.1f} s!")
+
+        start = time.perf_counter()
+        con.execute(DDL["Sequence"].format(new=NEW))
+        con.execute(
+            """
+        INSERT INTO Sequence{0} (ProteinKey, AAseq, NTseq)
+            SELECT p.ProteinKey, a.AAseq, n.NTseq
+            FROM Protein{0} p
+            LEFT JOIN AAseqLoad a ON a.ProteinID = p.ProteinID
+            LEFT JOIN NTseqLoad n ON n.ProteinID = p.ProteinID;
+        """.format(NEW)
+        )
+        con.execute("DROP TABLE AAseqLoad, NTseqLoad;")
+        print(f"Sequence table loaded in {time.perf_counter() - start:.1f} s!")
+
+        start = time.perf_counter()
+        con.execute(DDL["Member"].format(new=NEW))
+        bulk_load(con, spool, "Member" + NEW, membership, ["VOGKey", "ProteinKey"])
+        print(f"Member table loaded in {time.perf_counter() - start:.1f} s!")
+
+        con.execute("SET unique_checks = 1;")
+        con.execute("SET foreign_key_checks = 1;")
+
+    # the secondary indexes are built once after the load instead of row by row
+    start = time.perf_counter()
+    create_indexes(engine, NEW)
+    print(f"Indexes created in {time.perf_counter() - start:.1f} s!")
+
+    start = time.perf_counter()
+    with engine.connect() as con:
+        con.execute("OPTIMIZE LOCAL TABLE {0};".format(", ".join(table + NEW for table in TABLES)))
+
+    print(f"All tables optimized in {time.perf_counter() - start:.1f} s!")
+
+    save_row_hashes(
+        engine, row_hashes(vog, species, proteins, membership, aa_seq.hashes(), nt_seq.hashes(), files), NEW
+    )
+
+    publish(engine, {"VOG": len(vog), "Species": len(species), "Protein": len(proteins), "Sequence": len(proteins),
+                     "Member": len(membership)})
@@ -0,0 +1,209 @@
+import time
+
+import pandas as pd
+from sqlalchemy import create_engine, inspect
+
+from ..sequences import pack_nt
+from .frames import assign_keys, load_frames, load_aa_seq, load_nt_seq
+from .hashes import MEMBER_KEY_SEPARATOR, SequenceHashes, file_hashes, file_row_hashes, row_hashes
+from .support import OLD, drop_tables
+
+"""
+Delta load of a release: the row hashes of the new frames are compared with the row hashes stored with the
+loaded release (see vogdb.loader.hashes), and only the inserted, updated and deleted rows are written,
+all in one transaction, so the API sees either the old or the new release.
+VOGs and proteins keep their surrogate keys, new ones are numbered after the largest key of the loaded release.
+A delta changes the live tables in place, so the tables <name>_old of the release before the last full load
+no longer are the previous release: they are dropped, and rollback refuses until the next full load.
+The File rows of the row hashes change with the input files, and with them the release version the API reads
+(see vogdb.catalog.release_version), so the API rebuilds its catalog and drops its cached responses.
+"""
+
+
+def stored_row_hashes(engine):
+    """
+    The row hashes of the loaded release as Series by RowKey per table, None if the release has none.
+    """
+    if "RowHash" not in inspect(engine).get_table_names():
+        return None
+    return split(pd.read_sql("SELECT TableName, RowKey, Hash FROM RowHash", engine))
+
+
+def stored_keys(engine):
+    """
+    The VOGKey by VOG_ID and the ProteinKey by ProteinID of the loaded release,
+    None if the release has an older layout, without surrogate keys or Sequence table.
+    """
+    inspector = inspect(engine)
+    if "Sequence" not in inspector.get_table_names() or \
+            "VOGKey" not in [column["name"] for column in inspector.get_columns("VOG")]:
+        return None
+    return (
+        pd.read_sql("SELECT VOG_ID, VOGKey FROM VOG", engine, index_col="VOG_ID").VOGKey,
+        pd.read_sql("SELECT ProteinID, ProteinKey FROM Protein", engine, index_col="ProteinID").ProteinKey,
+    )
+
+
+def member_rows(keys, vog_keys, protein_keys):
+    """
+    The Member rows (VOGKey, ProteinKey) of the given Member row keys (see row_hashes).
+    """
+    ids = [key.split(MEMBER_KEY_SEPARATOR) for key in keys]
+    return pd.DataFrame({
+        "VOGKey": vog_keys.reindex([vog_id for vog_id, _ in ids]).to_numpy(),
+        "ProteinKey": protein_keys.reindex([protein_id for _, protein_id in ids]).to_numpy(),
+    })
+
+
+def split(hashes):
+    return {
+        table: group.set_index("RowKey").Hash.astype("uint64")
+        for table, group in hashes.groupby("TableName")
+    }
+
+
+def compare(old, new):
+    """
+    :return: the keys of the inserted, the updated and the deleted rows
+    """
+    old = old if old is not None else pd.Series([], dtype="uint64")
+    common = new.index.intersection(old.index)
+    updated = common[new[common].values != old[common].values]
+    return new.index.difference(old.index), updated, old.index.difference(new.index)
+
+
+def native_rows(frame):
+    """
+    The rows of the frame as tuples of Python values, with None for missing values.
+    """
+    frame = frame.astype(object)
+    return list(frame.where(frame.notna(), None).itertuples(index=False, name=None))
+
+
+def upsert(con, table, frame):
+    if frame.empty:
+        return
+    columns = list(frame.columns)
+    con.execute(
+        "INSERT INTO {0} ({1}) VALUES ({2}) ON DUPLICATE KEY UPDATE {3};".format(
+            table,
+            ", ".join(columns),
+            ", ".join(["%s"] * len(columns)),
+            ", ".join("{0} = VALUES({0})".format(c) for c in columns[1:]),
+        ),
+        native_rows(frame),
+    )
+
+
+def delete(con, table, columns, keys):
+    if not keys:
+        return
+    con.execute(
+        "DELETE FROM {0} WHERE {1};".format(table, " AND ".join("{0} = %s".format(c) for c in columns)),
+        keys,
+    )
+
+
+def sequences(batches, ids):
+    """
+    The first sequence of each of the given proteins, read batch by batch.
+    """
+    parts = [batch[batch.index.isin(ids)] for batch in batches]
+    if not parts:
+        return pd.Series([], dtype=object)
+    found = pd.concat(parts).iloc[:, 0]
+    return found[~found.index.duplicated()]
+
+
+def save_db_delta(db_url, data_path, full_load):
+    """
+    Loads the release in data_path as a delta to the loaded release. If the loaded release has no row hashes,
+    the whole release is loaded with full_load (save_db_sql or save_db_bulk).
+
+    :return: False if the input files are unchanged and nothing was loaded, otherwise True
+    """
+    engine = create_engine(db_url)
+    stored = stored_row_hashes(engine)
+    files = file_hashes(data_path)
+
+    keys = stored_keys(engine) if stored is not None else None
+
+    if stored is None or keys is None:
+        print("The loaded release has no row hashes or an older layout, loading the whole release!")
+        vog, species, proteins, membership = load_frames(data_path)
+        full_load(db_url, vog, species, proteins, membership, load_aa_seq(data_path), load_nt_seq(data_path), files)
+        return True
+
+    stored_files = stored.get("File")
+    if stored_files is not None and stored_files.sort_index().equals(file_row_hashes(files).sort_index()):
+        print("The input files are unchanged, nothing to load!")
+        return False
+
+    start = time.perf_counter()
+    vog, species, proteins, membership = load_frames(data_path)
+    vog_keys, protein_keys = keys
+    vog, proteins, membership = assign_keys(vog, proteins, membership, vog_keys, protein_keys)
+    aa_seq = SequenceHashes(load_aa_seq(data_path))
+    nt_seq = SequenceHashes(load_nt_seq(data_path))
+    for _ in aa_seq:
+        pass
+    for _ in nt_seq:
+        pass
+    new_hashes = row_hashes(vog, species, proteins, membership, aa_seq.hashes(), nt_seq.hashes(), files)
+    new = split(new_hashes)
+    changes = {table: compare(stored.get(table), new[table]) for table in ["Species", "VOG", "Protein", "Member"]}
+    print(f"Release compared in {time.perf_counter() - start:.1f} s!")
+
+    for table, (inserted, updated, deleted) in changes.items():
+        print(f"{table}: {len(inserted)} inserted, {len(updated)} updated, {len(deleted)} deleted")
+
+    # restoring them after the delta would silently drop every change since the last full load
+    drop_tables(engine, OLD)
+    print("The tables of the previous release have been dropped, the delta cannot be rolled back!")
+
+    start = time.perf_counter()
+    with engine.begin() as con:
+        inserted, updated, deleted = changes["Species"]
+        upsert(con, "Species", species.loc[inserted.union(updated).astype(int)].reset_index())
+
+        inserted, updated, deleted = changes["VOG"]
+        upsert(con, "VOG", vog.loc[inserted.union(updated)].reset_index())
+
+        inserted, updated, deleted = changes["Protein"]
+        ids = inserted.union(updated)
+        if len(ids):
+            upsert(con, "Protein", proteins.loc[ids].reset_index())
+            upsert(
+                con,
+                "Sequence",
+                pd.DataFrame({
+                    "ProteinKey": proteins.ProteinKey[ids].to_numpy(),
+                    "AAseq": sequences(load_aa_seq(data_path), ids).reindex(ids).to_numpy(),
+                    "NTseq": sequences(load_nt_seq(data_path), ids).reindex(ids).map(pack_nt, na_action="ignore")
+                    .to_numpy(),
+                }),
+            )
+
+        inserted, updated, deleted = changes["Member"]
+        upsert(con, "Member", member_rows(inserted, vog.VOGKey, proteins.ProteinKey))
+
+        # deletes, referencing tables first, the deleted Member rows reference the keys of the loaded release
+        delete(con, "Member", ["VOGKey", "ProteinKey"], native_rows(member_rows(deleted, vog_keys, protein_keys)))
+        deleted = changes["Protein"][2]
+        delete(con, "Sequence", ["ProteinKey"], [(int(key),) for key in protein_keys[deleted]])
+        delete(con, "Protein", ["ProteinID"], [(key,) for key in deleted])
+        delete(con, "VOG", ["VOG_ID"], [(key,) for key in changes["VOG"][2]])
+        delete(con, "Species", ["TaxonID"], [(int(key),) for key in changes["Species"][2]])
+
+        # the row hashes of the new release
+        for table, (inserted, updated, deleted) in changes.items():
+            keys = inserted.union(updated)
+            upsert(con, "RowHash", pd.DataFrame({"TableName": table, "RowKey": keys, "Hash": new[table][keys].values},
+                                                columns=["TableName", "RowKey", "Hash"]))
+            delete(con, "RowHash", ["TableName", "RowKey"], [(table, key) for key in deleted])
+        con.execute("DELETE FROM RowHash WHERE TableName = 'File';")
+        upsert(con, "RowHash", new_hashes[new_hashes.TableName == "File"])
+
+    print(f"Delta applied in {time.perf_counter() - start:.1f} s!")
+    return True
+
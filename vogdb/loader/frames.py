@@ -1,7 +1,15 @@
+import gzip
 import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
-from Bio import SeqIO
+from Bio.SeqIO.FastaIO import SimpleFastaParser
+
+# number of sequences read and inserted at once
+SEQ_BATCH = 10000
+
+# number of processes parsing the input files of load_frames at the same time
+LOAD_WORKERS = int(os.environ.get("VOG_LOAD_WORKERS", os.cpu_count() or 1))
 
 
 def load_species(data_path):
@@ -37,7 +45,7 @@ def load_members(data_path):
             "Proteins",
         ],
         index_col="VOG_ID",
-    ).assign(Proteins=lambda df: df.Proteins.apply(lambda s: set(s.split(","))))
+    )
 
 
 def load_annotations(data_path):
@@ -88,34 +96,58 @@ def load_lca(data_path):
     )
 
 
-def load_nt_seq(data_path):
+def read_fasta(filename, batch_size):
     """
-    Loads the nucleotid sequences from FASTA file into a Dataframe
+    Reads the (ID, sequence) records of a FASTA file, gzipped or not, in batches of at most batch_size records.
     """
-    filename = os.path.join(data_path, "vog.genes.all.fa")
-    data = [[s.id, str(s.seq)] for s in SeqIO.parse(filename, "fasta")]
-    return pd.DataFrame(data, columns=["ProteinID", "NTseq"]).set_index("ProteinID")
+    opener = gzip.open if filename.endswith(".gz") else open
+    with opener(filename, "rt") as handle:
+        batch = []
+        for title, seq in SimpleFastaParser(handle):
+            batch.append((title.split(None, 1)[0], seq))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
 
 
-def load_aa_seq(data_path):
+def fasta_file(data_path, name):
     """
-    Loads the amino acid sequences from FASTA file into a Dataframe
+    The gzipped FASTA file as it is downloaded, or the unzipped one, if only that exists.
     """
+    filename = os.path.join(data_path, name + ".gz")
+    return filename if os.path.exists(filename) else os.path.join(data_path, name)
 
-    filename = os.path.join(data_path, "vog.proteins.all.fa")
-    data = [[s.id, str(s.seq)] for s in SeqIO.parse(filename, "fasta")]
-    return pd.DataFrame(data, columns=["ProteinID", "AAseq"]).set_index("ProteinID")
+
+def load_nt_seq(data_path, batch_size=SEQ_BATCH):
+    """
+    Loads the nucleotid sequences from the FASTA file into Dataframes of at most batch_size proteins
+    """
+    for batch in read_fasta(fasta_file(data_path, "vog.genes.all.fa"), batch_size):
+        yield pd.DataFrame(batch, columns=["ProteinID", "NTseq"]).set_index("ProteinID")
+
+
+def load_aa_seq(data_path, batch_size=SEQ_BATCH):
+    """
+    Loads the amino acid sequences from the FASTA file into Dataframes of at most batch_size proteins
+    """
+    for batch in read_fasta(fasta_file(data_path, "vog.proteins.all.fa"), batch_size):
+        yield pd.DataFrame(batch, columns=["ProteinID", "AAseq"]).set_index("ProteinID")
 
 
 def extract_membership(members):
     """
     Loads all vog<->protein relationships.
+    Both columns are categorical, their categories are the sorted distinct VOG and Protein IDs.
 
     :param the members frame
     """
-    data = [(v, p) for v, ps in members.Proteins.items() for p in ps]
+    proteins = members.Proteins.str.split(",").explode()
     return (
-        pd.DataFrame.from_records(data, columns=["VOG_ID", "ProteinID"])
+        pd.DataFrame({"VOG_ID": proteins.index.values, "ProteinID": proteins.values})
+        .drop_duplicates()
+        .astype("category")
         .sort_values(["VOG_ID", "ProteinID"])
         .reset_index(drop=True)
     )
@@ -124,53 +156,108 @@ def extract_membership(members):
 def extract_proteins(membership):
     """
     Extracts all distinct proteins from the membership table and associates them
-    with the taxid of their species.
+    with the taxid of their species. The proteins are in the order of the categories of membership.ProteinID.
     """
-    unique_proteins = pd.Series(membership.ProteinID.unique())
-    species = unique_proteins.apply(lambda p: int(p.split(".")[0]))
+    unique_proteins = membership.ProteinID.cat.categories.rename("ProteinID")
+    species = unique_proteins.str.extract(r"^(\d+)\.", expand=False).astype(int)
 
-    return (
-        pd.DataFrame({"ProteinID": unique_proteins, "TaxonID": species})
-        .sort_values("ProteinID")
-        .set_index("ProteinID")
+    return pd.DataFrame({"TaxonID": species}, index=unique_proteins)
+
+
+def count_phages(membership, proteins, species):
+    """
+    Counts the phage and the non phage proteins of every VOG. Proteins of unknown species are not counted.
+
+    :return: the frame with the columns NumPhages and NumNonPhages by VOG_ID
+    """
+    # 1 for phages, 0 for non phages, NaN for unknown species, per membership row
+    phage = proteins.TaxonID.map(species.Phage.astype(int)).to_numpy(dtype=float)[
+        membership.ProteinID.cat.codes.to_numpy()
+    ]
+    vogs = membership.VOG_ID.cat.categories
+    codes = membership.VOG_ID.cat.codes.to_numpy()
+
+    return pd.DataFrame(
+        {
+            "NumPhages": np.bincount(codes, weights=np.nan_to_num(phage), minlength=len(vogs)).astype(int),
+            "NumNonPhages": np.bincount(codes, weights=np.nan_to_num(1 - phage), minlength=len(vogs)).astype(int),
+        },
+        index=vogs.rename("VOG_ID"),
     )
 
 
-def load_frames(data_path):
-    species = load_species(data_path)
-    members = load_members(data_path)
-    annotations = load_annotations(data_path)
-    virusonly = load_virusonly(data_path)
-    lca = load_lca(data_path)
-    aa_seq = load_aa_seq(data_path)
-    nt_seq = load_nt_seq(data_path)
+def surrogate_keys(ids, existing=None):
+    """
+    The integer keys of the given IDs: the key of an ID in existing (a Series of keys by ID) is kept,
+    the other IDs are numbered in their sorted order, from 1 or after the largest existing key.
+    """
+    keys = pd.Series(np.nan, index=ids) if existing is None else existing.reindex(ids).astype(float)
+    new = keys.index[keys.isna().to_numpy()].sort_values()
+    start = 1 if existing is None or existing.empty else int(existing.max()) + 1
+    keys.loc[new] = np.arange(start, start + len(new))
+    return keys.astype(int)
+
 
-    membership = extract_membership(members)
+def assign_keys(vog, proteins, membership, vog_keys=None, protein_keys=None):
+    """
+    Assigns the integer surrogate keys VOGKey and ProteinKey to the VOGs and proteins, and both keys to the
+    membership rows, which reference the VOGs and proteins by them.
 
-    proteins = (
-        extract_proteins(membership).join(aa_seq, how="left").join(nt_seq, how="left")
+    :param vog_keys: the VOGKey by VOG_ID of the loaded release, which are kept (see surrogate_keys)
+    :param protein_keys: the ProteinKey by ProteinID of the loaded release
+    """
+    vog = vog.assign(VOGKey=surrogate_keys(vog.index, vog_keys))
+    proteins = proteins.assign(ProteinKey=surrogate_keys(proteins.index, protein_keys))
+    vog_codes = membership.VOG_ID.cat.codes.to_numpy()
+    protein_codes = membership.ProteinID.cat.codes.to_numpy()
+    membership = membership.assign(
+        VOGKey=vog.VOGKey.reindex(membership.VOG_ID.cat.categories).to_numpy()[vog_codes],
+        ProteinKey=proteins.ProteinKey.reindex(membership.ProteinID.cat.categories).to_numpy()[protein_codes],
     )
+    return vog, proteins, membership
+
+
+def load_inputs(data_path, workers):
+    """
+    Parses the independent input files, with more than one worker in a process pool.
+
+    :return: the frames of load_members, load_annotations, load_lca, load_virusonly and load_species
+    """
+    # the largest files first, so that they do not wait for a free worker
+    loads = [load_members, load_annotations, load_lca, load_virusonly, load_species]
+    if workers <= 1:
+        return [load(data_path) for load in loads]
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(loads))) as pool:
+        futures = [pool.submit(load, data_path) for load in loads]
+        return [future.result() for future in futures]
+
 
-    protein_phage = proteins.TaxonID.map(species.Phage.apply(lambda s: 1 if s else 0))
+def load_frames(data_path, workers=LOAD_WORKERS):
+    """
+    Loads all tables except the protein sequences, which are streamed with load_aa_seq and load_nt_seq.
+    VOGs and proteins are numbered in the order of their IDs (see assign_keys).
+    The input files are parsed by the given number of worker processes at the same time.
+    """
+    members, annotations, lca, virusonly, species = load_inputs(data_path, workers)
+
+    membership = extract_membership(members)
+
+    proteins = extract_proteins(membership)
 
     vog = (
         members.drop(columns="Proteins")
         .join(annotations)
         .join(lca)
         .join(virusonly)
+        .join(count_phages(membership, proteins, species))
         .assign(
-            NumPhages=membership.set_index("VOG_ID")
-            .ProteinID.map(protein_phage)
-            .groupby("VOG_ID")
-            .sum(),
-            NumNonPhages=membership.set_index("VOG_ID")
-            .ProteinID.map(1 - protein_phage)
-            .groupby("VOG_ID")
-            .sum(),
             PhageNonphage=lambda df: (
                 np.sign(df.NumPhages) + 2 * np.sign(df.NumNonPhages)
             ).map({1: "phages_only", 2: "np_only", 3: "mixed"}),
         )
     )
 
+    vog, proteins, membership = assign_keys(vog, proteins, membership)
+
     return (vog, species, proteins, membership)
@@ -0,0 +1,138 @@
+import hashlib
+import os
+
+import pandas as pd
+from pandas.util import hash_pandas_object
+from sqlalchemy.types import BigInteger, String
+
+from .frames import fasta_file
+
+"""
+Per-row content hashes of a release, stored in the table RowHash (TableName, RowKey, Hash) next to the release.
+The next load compares them with the hashes of the new frames to find the inserted, updated and deleted rows
+(see vogdb.loader.delta). The rows of TableName "File" hold the MD5 sums of the input files,
+so that an unchanged release is recognized without parsing it.
+"""
+
+# key of a Member row
+MEMBER_KEY_SEPARATOR = "\t"
+
+# the surrogate keys are not part of the content of a row (see assign_keys)
+KEY_COLUMNS = ["VOGKey", "ProteinKey"]
+
+
+def input_files(data_path):
+    return [os.path.join(data_path, name) for name in
+            ["vog.species.list", "vog.members.tsv.gz", "vog.annotations.tsv.gz", "vog.virusonly.tsv.gz",
+             "vog.lca.tsv.gz"]] + \
+           [fasta_file(data_path, "vog.proteins.all.fa"), fasta_file(data_path, "vog.genes.all.fa")]
+
+
+def file_hashes(data_path):
+    """
+    The MD5 sums of the input files by file name.
+    """
+    hashes = {}
+    for filename in input_files(data_path):
+        md5 = hashlib.md5()
+        with open(filename, "rb") as f:
+            for block in iter(lambda: f.read(2 ** 20), b""):
+                md5.update(block)
+        hashes[os.path.basename(filename)] = md5.hexdigest()
+    return hashes
+
+
+def file_row_hashes(files):
+    """
+    The MD5 sums of the input files, truncated to 64 bit, by file name.
+    """
+    return pd.Series([int(md5[:16], 16) for md5 in files.values()], index=list(files), dtype="uint64")
+
+
+class SequenceHashes:
+    """
+    Passes the sequence batches (see load_aa_seq) through and keeps the hash of every sequence.
+    """
+
+    def __init__(self, batches):
+        self.batches = batches
+        self.parts = []
+
+    def __iter__(self):
+        for batch in self.batches:
+            self.parts.append(hash_pandas_object(batch.iloc[:, 0], index=False))
+            yield batch
+
+    def hashes(self):
+        """
+        The hashes by ProteinID, of the first sequence if a ProteinID occurs more than once.
+        """
+        if not self.parts:
+            return pd.Series([], dtype="uint64")
+        hashes = pd.concat(self.parts)
+        return hashes[~hashes.index.duplicated()]
+
+
+def protein_hashes(proteins, aa_hashes, nt_hashes):
+    """
+    The hashes of the Protein rows with the hashes of their sequences, 0 for a missing sequence,
+    so that the sequence columns stay uint64 instead of float, which would change the hash of every row.
+    """
+    return hash_pandas_object(
+        proteins.drop(columns=KEY_COLUMNS, errors="ignore").assign(
+            AAseq=aa_hashes.reindex(proteins.index, fill_value=0).astype("uint64"),
+            NTseq=nt_hashes.reindex(proteins.index, fill_value=0).astype("uint64"),
+        ),
+        index=False,
+    )
+
+
+def row_hashes(vog, species, proteins, membership, aa_hashes, nt_hashes, files=None):
+    """
+    The hashes of all rows of a release as a frame with the columns TableName, RowKey and Hash.
+    Rows are identified by their public IDs, the Member rows by VOG_ID and ProteinID.
+    """
+    member_keys = membership.VOG_ID.astype(str) + MEMBER_KEY_SEPARATOR + membership.ProteinID.astype(str)
+    parts = [
+        ("Species", hash_pandas_object(species, index=False)),
+        ("VOG", hash_pandas_object(vog.drop(columns=KEY_COLUMNS, errors="ignore"), index=False)),
+        ("Protein", protein_hashes(proteins, aa_hashes, nt_hashes)),
+        ("Member", pd.Series(0, index=member_keys.values, dtype="uint64")),
+    ]
+    if files:
+        parts.append(("File", file_row_hashes(files)))
+
+    return pd.concat(
+        [
+            pd.DataFrame({"TableName": table, "RowKey": hashes.index.astype(str), "Hash": hashes.values})
+            for table, hashes in parts
+        ],
+        ignore_index=True,
+    )
+
+
+def save_row_hashes(engine, hashes, suffix):
+    """
+    Creates the table RowHash<suffix> with the given hashes.
+    """
+    with engine.connect() as con:
+        con.execute("DROP TABLE IF EXISTS RowHash{0};".format(suffix))
+        con.execute(
+            """
+        CREATE TABLE RowHash{0} (
+            TableName varchar(16) NOT NULL,
+            RowKey varchar(64) NOT NULL,
+            Hash bigint unsigned NOT NULL,
+            PRIMARY KEY(TableName, RowKey)
+        );
+        """.format(suffix)
+        )
+
+    hashes.to_sql(
+        name="RowHash" + suffix,
+        con=engine,
+        if_exists="append",
+        index=False,
+        chunksize=10000,
+        dtype={"TableName": String(16), "RowKey": String(64), "Hash": BigInteger},
+    )
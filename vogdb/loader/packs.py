@@ -0,0 +1,38 @@
+import os
+
+from ..store import PACK_SUFFIX, INDEX_SUFFIX
+
+"""
+Here we pack the gzipped HMM and MSA files of the VOGs into one data file with an offset index (see vogdb.store)
+"""
+
+
+def pack_files(data_path, prefix, suffix):
+    """
+    Packs all files <data_path>/<prefix>/<ID><suffix> into <data_path>/<prefix>.pack
+    and writes the index <data_path>/<prefix>.pack.idx.
+    The files are written under temporary names first and then replaced,
+    so the API always sees either the old or the new pack.
+
+    :return: the number of packed files
+    """
+    path = os.path.join(data_path, prefix)
+    names = sorted(name for name in os.listdir(path) if name.endswith(suffix))
+
+    index = []
+    offset = 0
+    with open(path + PACK_SUFFIX + ".tmp", "wb") as pack:
+        for name in names:
+            with open(os.path.join(path, name), "rb") as f:
+                content = f.read()
+            pack.write(content)
+            index.append("{0}\t{1}\t{2}\n".format(name[:-len(suffix)], offset, len(content)))
+            offset += len(content)
+
+    with open(path + INDEX_SUFFIX + ".tmp", "wt") as f:
+        f.write("#\t{0}\n".format(offset))
+        f.writelines(index)
+
+    os.replace(path + PACK_SUFFIX + ".tmp", path + PACK_SUFFIX)
+    os.replace(path + INDEX_SUFFIX + ".tmp", path + INDEX_SUFFIX)
+    return len(names)
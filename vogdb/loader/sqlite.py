@@ -0,0 +1,103 @@
+import os
+import sqlite3
+import time
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from ..models import Base
+from ..sequences import pack_nt
+from .delta import native_rows
+from .hashes import file_row_hashes
+from .support import INDEXES
+
+"""
+Embedded release: all tables of a release in one SQLite file, with the tables of vogdb.models and the
+secondary indexes of the MySQL release (see INDEXES). The API reads it instead of MySQL if VOG_SQLITE is set
+(see vogdb.database), so a replica only needs a copy of the file.
+"""
+
+
+def insert_rows(con, table, frame):
+    columns = list(frame.columns)
+    con.executemany(
+        "INSERT INTO {0} ({1}) VALUES ({2});".format(table, ", ".join(columns), ", ".join(["?"] * len(columns))),
+        native_rows(frame),
+    )
+
+
+def insert_sequences(con, column, batches, protein_keys, pack=None):
+    """
+    Sets a sequence column of the Sequence table batch by batch, only one batch is held in memory at a time.
+
+    :param protein_keys: the ProteinKey by ProteinID
+    :return: the number of sequences read
+    """
+    count = 0
+    for batch in batches:
+        seqs = batch.iloc[:, 0]
+        seqs = seqs[~seqs.index.duplicated() & seqs.index.isin(protein_keys.index)]
+        if pack:
+            seqs = seqs.map(pack, na_action="ignore")
+        con.executemany(
+            "UPDATE Sequence SET {0} = ? WHERE ProteinKey = ?;".format(column),
+            zip(seqs.tolist(), protein_keys[seqs.index].tolist()),
+        )
+        count += len(batch)
+    return count
+
+
+def save_db_sqlite(path, vog, species, proteins, membership, aa_seq=(), nt_seq=(), files=None):
+    """
+    Writes all tables of the release into the SQLite file at path. The file is built under a temporary name
+    and then replaced, so that readers always open either the old or the new release.
+
+    :param files: the MD5 sums of the input files, stored as the File rows of the row hashes
+    """
+    filename = path + ".tmp"
+    if os.path.exists(filename):
+        os.remove(filename)
+
+    engine = create_engine("sqlite:///" + filename)
+    Base.metadata.create_all(engine)
+    engine.dispose()
+
+    con = sqlite3.connect(filename)
+    try:
+        # nobody reads the file before it is complete
+        con.execute("PRAGMA journal_mode = OFF;")
+        con.execute("PRAGMA synchronous = OFF;")
+
+        start = time.perf_counter()
+        insert_rows(con, "Species", species.reset_index())
+        insert_rows(con, "VOG", vog.reset_index())
+        insert_rows(con, "Protein", proteins.reset_index())
+        insert_rows(con, "Member", membership[["VOGKey", "ProteinKey"]])
+        insert_rows(con, "Sequence", proteins[["ProteinKey"]])
+        if files:
+            # SQLite integers are signed
+            hashes = file_row_hashes(files).astype("int64")
+            insert_rows(con, "RowHash",
+                        pd.DataFrame({"TableName": "File", "RowKey": hashes.index, "Hash": hashes.values}))
+        print(f"SQLite tables written in {time.perf_counter() - start:.1f} s!")
+
+        start = time.perf_counter()
+        count = insert_sequences(con, "AAseq", aa_seq, proteins.ProteinKey)
+        print(f"{count} amino acid sequences written in {time.perf_counter() - start:.1f} s!")
+        start = time.perf_counter()
+        count = insert_sequences(con, "NTseq", nt_seq, proteins.ProteinKey, pack_nt)
+        print(f"{count} nucleotide sequences written in {time.perf_counter() - start:.1f} s!")
+
+        start = time.perf_counter()
+        for table, indexes in INDEXES.items():
+            for name, columns in indexes:
+                con.execute("CREATE INDEX {0} ON {1} ({2});".format(name, table, ", ".join(columns)))
+        con.commit()
+        con.execute("ANALYZE;")
+        con.execute("VACUUM;")
+        print(f"SQLite indexes created in {time.perf_counter() - start:.1f} s!")
+    finally:
+        con.close()
+
+    os.replace(filename, path)
+    print(f"SQLite release written to {path}!")
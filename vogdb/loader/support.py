@@ -1,16 +1,112 @@
-from sqlalchemy import create_engine
-from sqlalchemy.types import Integer, String, Boolean, Text
+import time
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.types import Integer, LargeBinary, String, Boolean
+
+from ..sequences import pack_nt
+from .hashes import SequenceHashes, row_hashes, save_row_hashes
 
 """
-Here we create our VOGDB and create all the tables that we are going to use
+Here we create our VOGDB and create all the tables that we are going to use.
+A new release is built in the tables <name>_new, its row counts are checked, and then all tables are swapped in
+with one atomic RENAME TABLE, so the API never sees a half loaded release. The previous release is kept in the
+tables <name>_old, so that it can be restored with rollback.
 """
 
+# the tables of a release, referenced tables first
+TABLES = ["Species", "VOG", "Protein", "Sequence", "Member"]
 
-def save_db_sql(db_url, vog, species, proteins, membership):
+# the data tables and the row hashes of a release (see vogdb.loader.hashes)
+RELEASE_TABLES = TABLES + ["RowHash"]
 
-    # Create an engine object.
-    engine = create_engine(db_url)
+# the secondary indexes of a release by table, as (name, columns). Member is read by protein as often as by VOG,
+# and Protein by taxon, both covered without touching the table rows. The numeric VOG filters
+# have composite indexes for the SQL clients of the database; the API evaluates them on the VOG catalog.
+INDEXES = {
+    "VOG": [
+        ("VOG_ProteinCount", ["ProteinCount", "SpeciesCount"]),
+        ("VOG_GenomesTotal", ["GenomesTotal", "GenomesInGroup"]),
+    ],
+    "Species": [("Species_SpeciesName", ["SpeciesName"])],
+    "Protein": [("Protein_TaxonID", ["TaxonID", "ProteinID"])],
+    "Member": [("Member_ProteinKey", ["ProteinKey", "VOGKey"])],
+}
+
+# suffixes of the tables of the release being built and of the previous release
+NEW = "_new"
+OLD = "_old"
+
+
+def save_sequences(engine, column, batches, pack=None):
+    """
+    Fills a sequence column of the new Sequence table batch by batch through a small staging table,
+    so that only one batch of sequences is held in memory at a time.
+
+    :param column: AAseq or NTseq
+    :param batches: Dataframes of sequences indexed by ProteinID
+    :param pack: converts a sequence into its binary stored form, e.g. pack_nt
+    :return: the number of sequences read
+    """
+    with engine.connect() as con:
+        con.execute("DROP TABLE IF EXISTS SeqLoad;")
+        con.execute(
+            "CREATE TABLE SeqLoad (ProteinID varchar(30) NOT NULL PRIMARY KEY, Seq {0} NULL);".format(
+                "blob" if pack else "text"
+            )
+        )
+
+    count = 0
+    for batch in batches:
+        batch = batch[~batch.index.duplicated()].rename(columns={column: "Seq"})
+        if pack:
+            batch = batch.assign(Seq=batch.Seq.map(pack, na_action="ignore"))
+        batch.reset_index().to_sql(
+            name="SeqLoad",
+            con=engine,
+            if_exists="append",
+            index=False,
+            chunksize=1000,
+            dtype={"Seq": LargeBinary} if pack else None,
+        )
+        with engine.connect() as con:
+            con.execute(
+                "UPDATE Sequence{0} JOIN Protein{0} USING (ProteinKey) JOIN SeqLoad USING (ProteinID) "
+                "SET Sequence{0}.{1} = SeqLoad.Seq;".format(NEW, column)
+            )
+            con.execute("TRUNCATE TABLE SeqLoad;")
+        count += len(batch)
+
+    with engine.connect() as con:
+        con.execute("DROP TABLE SeqLoad;")
+    return count
 
+
+def create_indexes(engine, suffix=""):
+    """
+    Creates the secondary indexes (see INDEXES) on the tables of a release with the given suffix.
+    The indexes that MySQL created for the foreign keys are dropped by MySQL, where an index replaces them.
+    """
+    with engine.connect() as con:
+        for table, indexes in INDEXES.items():
+            con.execute(
+                "ALTER TABLE {0}{1} {2};".format(
+                    table,
+                    suffix,
+                    ", ".join("ADD INDEX {0} ({1})".format(name, ", ".join(columns)) for name, columns in indexes),
+                )
+            )
+
+
+def drop_tables(engine, suffix=""):
+    """
+    Drops the tables of a release with the given suffix, referencing tables first.
+    """
+    with engine.connect() as con:
+        for table in reversed(RELEASE_TABLES):
+            con.execute("DROP TABLE IF EXISTS {0}{1};".format(table, suffix))
+
+
+def drop_v1_tables(engine):
     with engine.connect() as con:
         # V1 leftovers
         con.execute("DROP TABLE IF EXISTS NT_seq;")
@@ -18,24 +114,101 @@ def save_db_sql(db_url, vog, species, proteins, membership):
         con.execute("DROP TABLE IF EXISTS Protein_profile;")
         con.execute("DROP TABLE IF EXISTS VOG_profile;")
         con.execute("DROP TABLE IF EXISTS Species_profile;")
-        # V2
-        con.execute("DROP TABLE IF EXISTS Member;")
-        con.execute("DROP TABLE IF EXISTS Protein;")
-        con.execute("DROP TABLE IF EXISTS VOG;")
-        con.execute("DROP TABLE IF EXISTS Species;")
+
+
+def check_counts(engine, counts):
+    """
+    Checks that the new tables have the expected number of rows.
+
+    :param counts: the expected number of rows per table
+    """
+    with engine.connect() as con:
+        for table, expected in counts.items():
+            actual = con.execute("SELECT COUNT(*) FROM {0}{1};".format(table, NEW)).scalar()
+            if actual != expected:
+                raise RuntimeError(
+                    "Table {0}{1} has {2} rows instead of {3}, the release is not published.".format(
+                        table, NEW, actual, expected
+                    )
+                )
+
+
+def publish(engine, counts):
+    """
+    Checks the row counts of the new release and swaps it in with one atomic RENAME TABLE.
+    The current release becomes the previous one, the one before is dropped.
+    """
+    check_counts(engine, counts)
+
+    drop_tables(engine, OLD)
+    existing = set(inspect(engine).get_table_names())
+    renames = []
+    for table in RELEASE_TABLES:
+        if table in existing:
+            renames.append("{0} TO {0}{1}".format(table, OLD))
+        if table + NEW in existing:
+            renames.append("{0}{1} TO {0}".format(table, NEW))
+
+    with engine.connect() as con:
+        con.execute("RENAME TABLE {0};".format(", ".join(renames)))
+
+    print("New release published!")
+
+
+def rollback(db_url):
+    """
+    Swaps the previous release back in (and the current one out), with one atomic RENAME TABLE.
+    """
+    engine = create_engine(db_url)
+    existing = set(inspect(engine).get_table_names())
+    missing = [table + OLD for table in TABLES if table + OLD not in existing]
+    if missing:
+        raise RuntimeError("There is no previous release, {0} missing.".format(", ".join(missing)))
+
+    renames = []
+    for table in RELEASE_TABLES:
+        # the row hashes may be missing in one of the releases
+        if table in existing:
+            renames.append("{0} TO {0}_swap".format(table))
+        if table + OLD in existing:
+            renames.append("{0}{1} TO {0}".format(table, OLD))
+        if table in existing:
+            renames.append("{0}_swap TO {0}{1}".format(table, OLD))
+
+    with engine.connect() as con:
+        con.execute("RENAME TABLE {0};".format(", ".join(renames)))
+
+    print("Previous release restored!")
+
+
+def save_db_sql(db_url, vog, species, proteins, membership, aa_seq=(), nt_seq=(), files=None):
+    """
+    Creates all tables of a new release and publishes it. The sequences of the proteins are inserted from the
+    batches of aa_seq and nt_seq (see load_aa_seq and load_nt_seq) one at a time.
+
+    :param files: the MD5 sums of the input files, stored with the row hashes
+    """
+
+    # Create an engine object.
+    engine = create_engine(db_url)
+
+    drop_v1_tables(engine)
+    drop_tables(engine, NEW)
 
     # ---------------------
     # VOG_table generation
     # ----------------------
 
     # create a table in the database
+    start = time.perf_counter()
     vog.reset_index().to_sql(
-        name="VOG",
+        name="VOG" + NEW,
         con=engine,
         if_exists="replace",
         index=False,
         chunksize=1000,
         dtype={
+            "VOGKey": Integer,
             "VOG_ID": String(30),
             "FunctionalCategory": String(30),
             "Consensus_func_description": String(100),
@@ -56,9 +229,10 @@ def save_db_sql(db_url, vog, species, proteins, membership):
 
     with engine.connect() as con:
         con.execute(
-            """
-        ALTER TABLE VOG
-            MODIFY VOG_ID varchar(30) NOT NULL PRIMARY KEY,
+            f"""
+        ALTER TABLE VOG{NEW}
+            MODIFY VOGKey int NOT NULL PRIMARY KEY FIRST,
+            MODIFY VOG_ID varchar(30) NOT NULL UNIQUE,
             MODIFY FunctionalCategory varchar(30) NOT NULL,
             MODIFY Consensus_func_description varchar(100) NOT NULL,
             MODIFY ProteinCount int NOT NULL,
@@ -76,14 +250,15 @@ def save_db_sql(db_url, vog, species, proteins, membership):
         """
         )
 
-    print("VOG table created!")
+    print(f"VOG table created in {time.perf_counter() - start:.1f} s!")
 
     # ---------------------
     # Species generation
     # ----------------------
 
+    start = time.perf_counter()
     species.reset_index().to_sql(
-        name="Species",
+        name="Species" + NEW,
         con=engine,
         if_exists="replace",
         index=False,
@@ -99,8 +274,8 @@ def save_db_sql(db_url, vog, species, proteins, membership):
 
     with engine.connect() as con:
         con.execute(
-            """
-        ALTER TABLE Species
+            f"""
+        ALTER TABLE Species{NEW}
             MODIFY TaxonID int NOT NULL PRIMARY KEY,
             MODIFY SpeciesName varchar(100) NOT NULL,
             MODIFY Phage bool NOT NULL,
@@ -109,68 +284,106 @@ def save_db_sql(db_url, vog, species, proteins, membership):
         """
         )
 
-    print("Species table created!")
+    print(f"Species table created in {time.perf_counter() - start:.1f} s!")
 
     # ---------------------
     # Protein generation
     # ----------------------
 
+    start = time.perf_counter()
     proteins.reset_index().to_sql(
-        name="Protein",
+        name="Protein" + NEW,
         con=engine,
         if_exists="replace",
         index=False,
         chunksize=1000,
         dtype={
+            "ProteinKey": Integer,
             "ProteinID": String(30),
             "TaxonID": Integer,
-            "AAseq": Text(65000),
-            "NTseq": Text(65000),
         },
     )
 
     with engine.connect() as con:
         con.execute(
-            """
-        ALTER TABLE Protein
-            MODIFY ProteinID varchar(30) NOT NULL PRIMARY KEY,
+            f"""
+        ALTER TABLE Protein{NEW}
+            MODIFY ProteinKey int NOT NULL PRIMARY KEY FIRST,
+            MODIFY ProteinID varchar(30) NOT NULL UNIQUE,
             MODIFY TaxonID int NOT NULL,
-            MODIFY AAseq text NULL,
-            MODIFY NTseq text NULL,
-            ADD FOREIGN KEY(TaxonID) REFERENCES Species(TaxonID);
+            ADD FOREIGN KEY(TaxonID) REFERENCES Species{NEW}(TaxonID);
+        """
+        )
+
+    print(f"Protein table created in {time.perf_counter() - start:.1f} s!")
+
+    # ---------------------
+    # Sequence generation
+    # ----------------------
+
+    start = time.perf_counter()
+    with engine.connect() as con:
+        con.execute(
+            f"""
+        CREATE TABLE Sequence{NEW} (
+            ProteinKey int NOT NULL PRIMARY KEY,
+            AAseq text NULL,
+            NTseq blob NULL,
+            FOREIGN KEY(ProteinKey) REFERENCES Protein{NEW}(ProteinKey)
+        );
         """
         )
+        con.execute(f"INSERT INTO Sequence{NEW} (ProteinKey) SELECT ProteinKey FROM Protein{NEW};")
 
-    print("Protein table created!")
+    aa_seq = SequenceHashes(aa_seq)
+    count = save_sequences(engine, "AAseq", aa_seq)
+    print(f"{count} amino acid sequences inserted in {time.perf_counter() - start:.1f} s!")
+    start = time.perf_counter()
+    nt_seq = SequenceHashes(nt_seq)
+    count = save_sequences(engine, "NTseq", nt_seq, pack_nt)
+    print(f"{count} nucleotide sequences inserted in {time.perf_counter() - start:.1f} s!")
 
     # ---------------------
     # Member generation
     # ----------------------
 
-    membership.reset_index().to_sql(
-        name="Member",
+    start = time.perf_counter()
+    membership[["VOGKey", "ProteinKey"]].to_sql(
+        name="Member" + NEW,
         con=engine,
         if_exists="replace",
         index=False,
         chunksize=1000,
-        dtype={"VOG_ID": String(30), "ProteinID": String(30)},
+        dtype={"VOGKey": Integer, "ProteinKey": Integer},
     )
 
     with engine.connect() as con:
         con.execute(
-            """
-        ALTER TABLE Member  
-            MODIFY VOG_ID varchar(30) NOT NULL,
-            MODIFY ProteinID varchar(30) NOT NULL,
-            ADD PRIMARY KEY(VOG_ID, ProteinID),
-            ADD FOREIGN KEY(VOG_ID) REFERENCES VOG(VOG_ID),
-            ADD FOREIGN KEY(ProteinID) REFERENCES Protein(ProteinID);
+            f"""
+        ALTER TABLE Member{NEW}
+            MODIFY VOGKey int NOT NULL,
+            MODIFY ProteinKey int NOT NULL,
+            ADD PRIMARY KEY(VOGKey, ProteinKey),
+            ADD FOREIGN KEY(VOGKey) REFERENCES VOG{NEW}(VOGKey),
+            ADD FOREIGN KEY(ProteinKey) REFERENCES Protein{NEW}(ProteinKey);
         """
         )
 
-    print("Member table created!")
+    print(f"Member table created in {time.perf_counter() - start:.1f} s!")
+
+    start = time.perf_counter()
+    create_indexes(engine, NEW)
+    print(f"Indexes created in {time.perf_counter() - start:.1f} s!")
 
+    start = time.perf_counter()
     with engine.connect() as con:
-        con.execute("OPTIMIZE LOCAL TABLE VOG, Species, Protein, Member;")
+        con.execute("OPTIMIZE LOCAL TABLE {0};".format(", ".join(table + NEW for table in TABLES)))
+
+    print(f"All tables optimized in {time.perf_counter() - start:.1f} s!")
+
+    save_row_hashes(
+        engine, row_hashes(vog, species, proteins, membership, aa_seq.hashes(), nt_seq.hashes(), files), NEW
+    )
 
-    print("All tables optimized!")
+    publish(engine, {"VOG": len(vog), "Species": len(species), "Protein": len(proteins), "Sequence": len(proteins),
+                     "Member": len(membership)})
@@ -1,18 +1,27 @@
 import contextlib
+import gzip
+import itertools
+import json
+import os
+import re
+import zlib
+from typing import AsyncIterator, Iterable, Iterator, Optional
 
-from slowapi.errors import RateLimitExceeded
 from starlette.requests import Request
 
 from .functionality import *
-from .database import SessionLocal
+from .database import SessionLocal, pool_metrics, run_db, session_slots, stream_slots
+from .catalog import release_snapshot
+from .store import packed_store
+from .cache import ResponseCache
+from .fastjson import FastJSONResponse, dumps
+from .ratelimit import CostLimiter, client_address
 from sqlalchemy.orm import Session
 from fastapi import Depends, FastAPI, Query, Path, HTTPException
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from .schemas import *
 import logging
 from .models import Species
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
 
 # configuring logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s %(module)s- %(funcName)s: %(message)s',
@@ -23,10 +32,28 @@ log = logging.getLogger(__name__)
 
 api = FastAPI()
 
-# request limiter
-limiter = Limiter(key_func=get_remote_address)
-api.state.limiter = limiter
-api.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+# cache of complete responses of the current release
+response_cache = ResponseCache(int(os.environ.get("VOG_CACHE_BYTES", 64 * 2 ** 20)),
+                               int(os.environ.get("VOG_CACHE_ENTRY_BYTES", 4 * 2 ** 20)))
+
+# maximal number of IDs in the body of a bulk request
+MAX_BULK_IDS = 100000
+
+# build the VOG and protein summaries as plain rows and encode them with the fast JSON encoder instead of
+# validating every ORM object with its pydantic schema (switched on with VOG_FAST_JSON=1)
+FAST_JSON = os.environ.get("VOG_FAST_JSON", "0") != "0"
+
+# request limiter, shared by the workers of the host (can be switched off with VOG_RATE_LIMIT=0, e.g. for load testing)
+limiter = CostLimiter(key_func=client_address,
+                      enabled=os.environ.get("VOG_RATE_LIMIT", "1") != "0",
+                      path=os.environ.get("VOG_RATE_LIMIT_FILE"),
+                      rate=float(os.environ.get("VOG_RATE_LIMIT_RATE", 9)),
+                      burst=float(os.environ.get("VOG_RATE_LIMIT_BURST", 9)),
+                      id_cost=float(os.environ.get("VOG_RATE_LIMIT_ID_COST", 0.25)),
+                      max_ids=MAX_BULK_IDS)
+
+# cost factor of the endpoints that return sequences, HMMs or MSAs
+HEAVY = 2
 
 
 @contextlib.contextmanager
@@ -47,30 +74,297 @@ def error_handling():
 # redirected_app = HTTPToHTTPSRedirectMiddleware(api, host="example_domain.com")
 
 
-# Dependency. Connect to the database session
-def get_db():
+def to_schema(schema, func, *args):
+    """
+    Calls the search function and converts its ORM results into the given response schema.
+    This way lazy loaded relationships are resolved inside the database executor as well.
+    """
+    return [schema.from_orm(row) for row in func(*args)]
+
+
+def warm_up():
+    """
+    Loads the in-memory structures of the current release, so the first requests do not have to.
+    """
     db = SessionLocal()
     try:
-        yield db
+        release_snapshot(db)
+        taxonomy(db)
     finally:
         db.close()
+    for prefix in ("hmm", "raw_algs"):
+        packed_store(prefix)
+
+
+@api.on_event("startup")
+async def startup():
+    try:
+        await run_db(warm_up)
+    except Exception:
+        log.exception("Could not load the VOG catalog or the taxonomy at startup, they will be loaded on first use.")
+
+
+def accepts_gzip(request: Request) -> bool:
+    """
+    Checks whether the client accepts gzip encoded responses.
+    """
+    for coding in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = coding.partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            return params.replace(" ", "").lower() not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+def plain_gzip_response(request: Request, content: bytes) -> Response:
+    """
+    Returns the gzipped content as it is to clients that accept gzip, and decompressed to all others.
+    """
+    headers = {"Vary": "Accept-Encoding"}
+    if accepts_gzip(request):
+        headers["Content-Encoding"] = "gzip"
+        return Response(content, media_type="text/plain; charset=utf-8", headers=headers)
+    return PlainTextResponse(gzip.decompress(content).decode("utf-8"), headers=headers)
+
+
+def gzip_file_response(request: Request, load, id: str) -> Response:
+    """
+    Reads the gzip file of the ID with load (e.g. hmm_gzip) into a plain_gzip_response, in the executor.
+    """
+    return plain_gzip_response(request, load(id))
+
+
+def text_chunks(lines: Iterable[str], size: int = 65536) -> Iterator[str]:
+    """
+    Joins the lines with newlines and cuts the text into chunks of about the given size.
+    """
+    chunk, length, first = [], 0, True
+    for line in lines:
+        chunk.append(line)
+        length += len(line) + 1
+        if length >= size:
+            yield ("" if first else "\n") + "\n".join(chunk)
+            chunk, length, first = [], 0, False
+    if chunk:
+        yield ("" if first else "\n") + "\n".join(chunk)
+
+
+def fasta_chunks(rows: Iterable, size: int = 65536) -> Iterator[str]:
+    """
+    Formats the (ID, sequence) rows as FASTA records and cuts the text into chunks of about the given size.
+    """
+    chunk, length = [], 0
+    for id, seq in rows:
+        record = ">{0}\n{1}\n".format(id, seq or "")
+        chunk.append(record)
+        length += len(record)
+        if length >= size:
+            yield "".join(chunk)
+            chunk, length = [], 0
+    if chunk:
+        yield "".join(chunk)
+
+
+def gzip_chunks(chunks: Iterable[str]) -> Iterator[bytes]:
+    """
+    Compresses the text chunks into one gzip stream.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def json_array_chunks(items: Iterable[str], size: int = 65536) -> Iterator[str]:
+    """
+    Joins the JSON encoded items into a JSON array and cuts it into chunks of about the given size.
+    """
+    chunk, length, separator = ["["], 1, ""
+    for item in items:
+        chunk.append(separator + item)
+        length += len(item) + 1
+        separator = ","
+        if length >= size:
+            yield "".join(chunk)
+            chunk, length = [], 0
+    chunk.append("]")
+    yield "".join(chunk)
+
+
+def to_json(schema, rows: Iterable) -> Iterator[str]:
+    """
+    Converts the ORM results into the given response schema and encodes them as JSON.
+    """
+    for row in rows:
+        yield schema.from_orm(row).json()
+
+
+def rows_to_json(rows: Iterable) -> Iterator[str]:
+    """
+    Encodes plain rows with the fast JSON encoder.
+    """
+    for row in rows:
+        yield dumps(row).decode("utf-8")
+
+
+async def iterate_in_executor(iterator: Iterator) -> AsyncIterator:
+    """
+    Iterates a blocking iterator (e.g. over a database cursor) in the database executor.
+    """
+    end = object()
+    while True:
+        item = await run_db(next, iterator, end)
+        if item is end:
+            break
+        yield item
+
+
+async def stream_chunks(first, chunks: Iterator, what: str) -> AsyncIterator:
+    """
+    Streams the first chunk and then the rest, pulled in the database executor. The status has been sent with the
+    first chunk, so an error after it is logged and raised again: the server aborts the response, and the client
+    sees an incomplete body instead of a truncated 200.
+    """
+    count = 1
+    yield first
+    try:
+        async for chunk in iterate_in_executor(chunks):
+            count += 1
+            yield chunk
+    except Exception:
+        log.exception("Streaming the {0} failed after {1} chunks, the response is aborted.".format(what, count))
+        raise
+    log.info("{0} have been retrieved.".format(what))
+
+
+async def start_stream(chunks: Iterator, what: str) -> Optional[AsyncIterator]:
+    """
+    Pulls the first chunk (which runs the query) before the response starts, so that errors are still answered
+    with 4xx/5xx by error_handling. Returns the stream, or None if there are no chunks.
+    """
+    end = object()
+    first = await run_db(next, chunks, end)
+    if first is end:
+        return None
+    return stream_chunks(first, chunks, what)
+
+
+async def plain_text_response(lines: Iterable[str], what: str) -> Response:
+    """
+    Streams the lines as plain text. The lines are pulled (e.g. from a database cursor) in the database executor.
+    """
+    stream = await start_stream(text_chunks(lines), what)
+    if stream is None:
+        log.info("No {0} match the search criteria.".format(what))
+        return PlainTextResponse("")
+    return StreamingResponse(stream, media_type="text/plain")
+
+
+async def json_array_response(items: Iterator[str], what: str) -> StreamingResponse:
+    """
+    Streams the JSON encoded items as a JSON array. If there are no items at all, 404 is raised.
+    """
+    first = await run_db(next, items, None)
+    if first is None:
+        log.debug("No matching {0} found".format(what))
+        raise HTTPException(status_code=404, detail="Item not found")
+    log.debug("{0} are being streamed.".format(what))
+    stream = await start_stream(json_array_chunks(itertools.chain([first], items)), what)
+    return StreamingResponse(stream, media_type="application/json")
+
+
+async def fasta_response(request: Request, rows: Iterator, what: str) -> StreamingResponse:
+    """
+    Streams the (ID, sequence) rows as FASTA, gzip compressed to clients that accept gzip.
+    If there are no rows at all, 404 is raised.
+    """
+    first = await run_db(next, rows, None)
+    if first is None:
+        log.debug("No matching {0} found".format(what))
+        raise HTTPException(status_code=404, detail="Item not found")
+    log.debug("{0} are being streamed.".format(what))
+    chunks = fasta_chunks(itertools.chain([first], rows))
+    headers = {"Vary": "Accept-Encoding"}
+    if accepts_gzip(request):
+        headers["Content-Encoding"] = "gzip"
+        chunks = gzip_chunks(chunks)
+    stream = await start_stream(chunks, what)
+    return StreamingResponse(stream, media_type="text/plain", headers=headers)
+
+
+async def read_ids(request: Request, regex: str, max_length: int) -> List[str]:
+    """
+    Reads the IDs of a bulk request from its body, either a JSON list (Content-Type: application/json)
+    or one ID per line.
+    """
+    try:
+        body = (await request.body()).decode("utf-8")
+        if request.headers.get("content-type", "").startswith("application/json"):
+            ids = json.loads(body)
+            if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+                raise ValueError("The body has to be a JSON list of IDs.")
+        else:
+            ids = [line.strip() for line in body.splitlines() if line.strip()]
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    if not ids:
+        raise HTTPException(status_code=422, detail="No IDs given.")
+    if len(ids) > MAX_BULK_IDS:
+        raise HTTPException(status_code=422, detail="At most {0} IDs can be requested at once.".format(MAX_BULK_IDS))
+    pattern = re.compile(regex)
+    invalid = [i for i in ids if len(i) > max_length or not pattern.match(i)]
+    if invalid:
+        raise HTTPException(status_code=422, detail="Invalid IDs: {0}".format(", ".join(invalid[:10])))
+    return ids
+
+
+@contextlib.asynccontextmanager
+async def open_session():
+    async with session_slots():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            await run_db(db.close)
+
+
+# Dependency. Connect to the database session
+async def get_db():
+    async with open_session() as db:
+        yield db
+
+
+# Dependency of the endpoints that stream their response, the session is held until the last chunk has been sent
+async def get_stream_db():
+    async with stream_slots(), open_session() as db:
+        yield db
 
 
 @api.get("/", tags=["Welcome and database version"], summary="Welcome", response_model=WELCOME)
 async def root(db: Session = Depends(get_db)):
-    query = db.query(Species.version).first()
+    query = await run_db(db.query(Species.version).first)
     version = query[0]
     log.debug(f"Fileshare-Version: {version}")
     return WELCOME(message="Welcome to the VOGDB-API.", version=version)
 
 
+@api.get("/metrics/pool", tags=["Metrics"], summary="Connection pool metrics", response_model=PoolMetrics,
+         description="Returns the utilization of the database connection pool and the time requests waited for a "
+                     "connection since the start of the server.")
+async def get_pool_metrics():
+    return PoolMetrics(**pool_metrics())
+
+
 @api.get("/vsearch/species",
          response_class=PlainTextResponse, tags=["species"], description="Searches the database for species matching the search "
                                                                        "criteria and returns their Taxon IDs.", summary="Species search")
-@limiter.limit("9/second")
+@limiter.limit()
+@response_cache.cached()
 async def search_species(
         request: Request,
-        db: Session = Depends(get_db),
+        db: Session = Depends(get_stream_db),
         taxon_id: List[int] = Query(None, title="Taxon ID", le=9999999, description="Species taxonomy ID",
                                     example={"2713301"}),
         name: List[str] = Query(None, max_length=20, title="species name",
@@ -88,22 +382,15 @@ async def search_species(
     with error_handling():
         log.debug("Received a vsearch/species request")
 
-        species_list = [str(i[0]) for i in get_species(db, taxon_id, name, phage, source)]
-
-        species = PlainTextResponse('\n'.join(species_list))
+        query = get_species(db, taxon_id, name, phage, source)
 
-        if not species.body.decode("utf-8"):
-            log.info("No Species match the search criteria.")
-
-        else:
-            log.info("Species have been retrieved.")
-
-        return species
+        return await plain_text_response((str(row[0]) for row in query), "Species")
 
 
 @api.get("/vsummary/species",
          response_model=List[Species_profile], tags=["species"], description="Returns information about species for which taxon IDs have been provided",  summary="Species summary")
-@limiter.limit("9/second")
+@limiter.limit()
+@response_cache.cached()
 async def get_summary_species(request: Request,
                               taxon_id: Optional[List[int]] = Query(..., title="Taxon ID", le=9999999,
                                                                     description="Species identity number",
@@ -120,7 +407,7 @@ async def get_summary_species(request: Request,
     with error_handling():
         log.debug("Received a vsummary/species GET with parameters: taxon_id = {0}".format(taxon_id))
 
-        species_summary = find_species_by_id(db, taxon_id)
+        species_summary = await run_db(to_schema, Species_profile, find_species_by_id, db, taxon_id)
 
         if not len(species_summary) == len(taxon_id):
             log.warning("At least one of the species was not found, or there were duplicates.\n"
@@ -138,7 +425,8 @@ async def get_summary_species(request: Request,
 @api.get("/vsearch/vog",
          response_class=PlainTextResponse, tags=["vog"], description="Searches the database for VOGs matching the search "
                                                                        "criteria and returns their VOG IDs.",  summary="VOG search")
-@limiter.limit("9/second")
+@limiter.limit()
+@response_cache.cached()
 async def search_vog(
         request: Request,
         id: Optional[Set[str]] = Query(None, max_length=10, regex="^VOG", title="VOG ID",
@@ -185,7 +473,7 @@ async def search_vog(
                                       description="When at least two taxonomy IDs or species names are provided,"
                                                   " the VOGs containing either are returned, when the union parameter is set to True. Otherwise the result is"
                                                   " the intersection of the VOGs contained in either group."),
-        db: Session = Depends(get_db)):
+        db: Session = Depends(get_stream_db)):
     """
     This functions searches a database and returns a list of vog unique identifiers (UIDs) for records in that database
     which meet the search criteria.
@@ -201,24 +489,16 @@ async def search_vog(
     with error_handling():
         log.debug("Received a vsearch/vog request")
 
-        vog_list = [str(i[0]) for i in get_vogs(db, id, pmin, pmax, smax, smin, functional_category, consensus_function,
-                                                mingLCA, maxgLCA, mingGLCA, maxgGLCA, ancestors, h_stringency,
-                                                m_stringency, l_stringency,
-                                                virus_specific, phages_nonphages, proteins, species, tax_id, union)]
-
-        vogs = PlainTextResponse('\n'.join(vog_list))
-
-        if not vogs.body.decode("utf-8"):
-            log.info("No VOGs match the search criteria.")
+        vog_list = await run_db(get_vogs, db, id, pmin, pmax, smax, smin, functional_category, consensus_function,
+                                mingLCA, maxgLCA, mingGLCA, maxgGLCA, ancestors, h_stringency, m_stringency,
+                                l_stringency, virus_specific, phages_nonphages, proteins, species, tax_id, union)
 
-        else:
-            log.info("VOGs have been retrieved.")
-
-        return vogs
+        return await plain_text_response(vog_list, "VOGs")
 
 
 @api.get("/vsummary/vog", response_model=List[VOG_profile], tags=["vog"], description="Returns information about VOGs for which VOG IDs have been provided",  summary="VOG summary")
-@limiter.limit("9/second")
+@limiter.limit()
+@response_cache.cached()
 async def get_summary_vog(request: Request, id: List[str] = Query(..., max_length=10, regex="^VOG", title="VOG ID",
                                                                   description="VOG identity number",
                                                                   example={"VOG00004"}),
@@ -234,7 +514,10 @@ async def get_summary_vog(request: Request, id: List[str] = Query(..., max_lengt
     with error_handling():
         log.debug("Received a vsummary/vog request")
 
-        vog_summary = find_vogs_by_uid(db, id)
+        if FAST_JSON:
+            vog_summary = await run_db(list, find_vog_profile_rows(db, id))
+        else:
+            vog_summary = await run_db(to_schema, VOG_profile, find_vogs_by_uid, db, id)
 
         if not vog_summary:
             log.debug("No matching VOGs found")
@@ -242,11 +525,35 @@ async def get_summary_vog(request: Request, id: List[str] = Query(..., max_lengt
         else:
             log.debug("VOG summaries have been retrieved.")
 
-        return vog_summary
+        return FastJSONResponse(vog_summary) if FAST_JSON else vog_summary
+
+
+@api.post("/vsummary/vog", response_model=List[VOG_profile], tags=["vog"],
+          description="Returns information about VOGs for the VOG IDs in the request body, "
+                      "either a JSON list or one ID per line", summary="VOG bulk summary")
+@limiter.limit()
+async def post_summary_vog(request: Request, db: Session = Depends(get_stream_db)):
+    """
+    This function returns vog summaries for a large list of unique identifiers (UIDs) given in the request body.
+    \f
+    :param db: database session dependency
+    :return: vog summary
+    """
+    id = await read_ids(request, "^VOG", 10)
+
+    with error_handling():
+        log.debug("Received a vsummary/vog POST with {0} IDs".format(len(id)))
+
+        if FAST_JSON:
+            items = rows_to_json(find_vog_profile_rows(db, id))
+        else:
+            items = to_json(VOG_profile, find_vogs_by_uid(db, id))
+        return await json_array_response(items, "VOG summaries")
 
 
 @api.get("/vfetch/vog/hmm", response_model=Dict[str, str], tags=["vog"], description="Returns the Hidden Markov Model (HMM) for the given VOG IDs.", summary="VOG HMM fetch")
-@limiter.limit("9/second")
+@limiter.limit(HEAVY)
+@response_cache.cached()
 async def get_fetch_vog_hmm(request: Request, id: List[str] = Query(..., max_length=10, regex="^VOG", title="VOG ID",
                                                                     description="VOG identity number",
                                                                     example={"VOG00004"})):
@@ -259,7 +566,8 @@ async def get_fetch_vog_hmm(request: Request, id: List[str] = Query(..., max_len
     with error_handling():
         log.debug("Received a vfetch/vog/hmm request")
 
-        vog_hmm = find_vogs_hmm_by_uid(id)
+        # reading and decompressing the files blocks, like a database call
+        vog_hmm = await run_db(find_vogs_hmm_by_uid, id)
 
         if len(vog_hmm) == 0:
             log.debug("No HMM found.")
@@ -270,7 +578,8 @@ async def get_fetch_vog_hmm(request: Request, id: List[str] = Query(..., max_len
 
 
 @api.get("/vfetch/vog/msa", response_model=Dict[str, str], tags=["vog"], description="Returns the Multiple Sequence Alignment (MSA) for the given VOG IDs.", summary="VOG MSA fetch")
-@limiter.limit("9/second")
+@limiter.limit(HEAVY)
+@response_cache.cached()
 async def get_fetch_vog_msa(request: Request, id: List[str] = Query(..., max_length=10, regex="^VOG", title="VOG ID",
                                                                     description="VOG identity number",
                                                                     example={"VOG00004"})):
@@ -282,7 +591,7 @@ async def get_fetch_vog_msa(request: Request, id: List[str] = Query(..., max_len
     """
     with error_handling():
         log.debug("Received a vfetch/vog/msa request")
-        vog_msa = find_vogs_msa_by_uid(id)
+        vog_msa = await run_db(find_vogs_msa_by_uid, id)
 
         if len(vog_msa) == 0:
             log.debug("No MSA found.")
@@ -294,39 +603,44 @@ async def get_fetch_vog_msa(request: Request, id: List[str] = Query(..., max_len
 
 
 @api.get("/vplain/vog/hmm/{id}", response_class=PlainTextResponse, tags=["vog"], description="Returns the Hidden Markov Model (HMM) for the given VOG IDs in plain text format.", summary="VOG HMM fetch plain text")
-async def plain_vog_hmm(id: str = Path(..., title="VOG id", min_length=8, regex="^VOG\d+$")):
+@response_cache.cached(vary=accepts_gzip)
+async def plain_vog_hmm(request: Request, id: str = Path(..., title="VOG id", min_length=8, regex="^VOG\d+$")):
     """
     Get the Hidden Markov Matrix of the given VOG as plain text.
+    The stored gzip file is sent as it is to clients that accept gzip.
     \f
     :param id: VOGID
     """
 
     with error_handling():
         try:
-            return PlainTextResponse(hmm_content(id))
-        except KeyError:
+            return await run_db(gzip_file_response, request, hmm_gzip, id)
+        except (KeyError, FileNotFoundError):
             raise HTTPException(404, "Not found")
 
 
 @api.get("/vplain/vog/msa/{id}", response_class=PlainTextResponse, tags=["vog"], description="Returns the Multiple Sequence Alignment (MSA) for the given VOG IDs in plain text format.", summary="VOG MSA fetch plain text")
-async def plain_vog_msa(id: str = Path(..., title="VOG id", min_length=8, regex="^VOG\d+$")):
+@response_cache.cached(vary=accepts_gzip)
+async def plain_vog_msa(request: Request, id: str = Path(..., title="VOG id", min_length=8, regex="^VOG\d+$")):
     """
     Get the Multiple Sequence Alignment of the given VOG as plain text.
+    The stored gzip file is sent as it is to clients that accept gzip.
     \f
     :param id: VOGID
     """
 
     with error_handling():
         try:
-            return PlainTextResponse(msa_content(id))
-        except KeyError:
+            return await run_db(gzip_file_response, request, msa_gzip, id)
+        except (KeyError, FileNotFoundError):
             raise HTTPException(404, "Not found")
 
 
 @api.get("/vsearch/protein",
          response_class=PlainTextResponse, tags=["protein"], description="Searches the database for proteins matching the search "
                                                                        "criteria and returns their Protein IDs.", summary="Protein search")
-@limiter.limit("9/second")
+@limiter.limit()
+@response_cache.cached()
 async def search_protein(request: Request,
                          species_name: List[str] = Query(None, max_length=20, regex="^[a-zA-Z\s]*$",
                                                          title="species name",
@@ -335,7 +649,7 @@ async def search_protein(request: Request,
                                                      description="Species identity number", example={"2713301"}),
                          VOG_id: List[str] = Query(None, max_length=10, regex="^VOG", title="VOG ID",
                                                    description="VOG identity number", example={"VOG00004"}),
-                         db: Session = Depends(get_db)):
+                         db: Session = Depends(get_stream_db)):
     """
     This functions searches a database and returns a list of Protein IDs for records in the database
     matching the search criteria.
@@ -351,21 +665,15 @@ async def search_protein(request: Request,
     with error_handling():
         log.debug("Received a vsearch/protein request")
 
-        protein_list = [str(i[0]) for i in get_proteins(db, species_name, taxon_id, VOG_id)]
+        query = get_proteins(db, species_name, taxon_id, VOG_id)
 
-        proteins = PlainTextResponse('\n'.join(protein_list))
-
-        if not proteins.body.decode("utf-8"):
-            log.debug("No Proteins match the search criteria.")
-        else:
-            log.debug("Proteins have been retrieved.")
-
-        return proteins
+        return await plain_text_response((str(row[0]) for row in query), "Proteins")
 
 
 @api.get("/vsummary/protein",
          response_model=List[Protein_profile], tags=["protein"], description="Returns information about Proteins for which Protein IDs have been provided", summary="Protein summary")
-@limiter.limit("9/second")
+@limiter.limit()
+@response_cache.cached()
 async def get_summary_protein(request: Request,
                               id: List[str] = Query(..., max_length=25, regex="^.*(YP|NP).*$", title="Protein ID",
                                                     description="Protein taxon identity number",
@@ -381,7 +689,10 @@ async def get_summary_protein(request: Request,
     with error_handling():
         log.debug("Received a vsummary/protein request")
 
-        protein_summary = find_proteins_by_id(db, id)
+        if FAST_JSON:
+            protein_summary = await run_db(list, find_protein_profile_rows(db, id))
+        else:
+            protein_summary = await run_db(to_schema, Protein_profile, find_proteins_by_id, db, id)
 
         if not len(protein_summary) == len(id):
             log.warning("At least one of the proteins was not found, or there were duplicates.\n"
@@ -393,12 +704,36 @@ async def get_summary_protein(request: Request,
         else:
             log.debug("Protein summaries have been retrieved.")
 
-        return protein_summary
+        return FastJSONResponse(protein_summary) if FAST_JSON else protein_summary
+
+
+@api.post("/vsummary/protein", response_model=List[Protein_profile], tags=["protein"],
+          description="Returns information about Proteins for the Protein IDs in the request body, "
+                      "either a JSON list or one ID per line", summary="Protein bulk summary")
+@limiter.limit()
+async def post_summary_protein(request: Request, db: Session = Depends(get_stream_db)):
+    """
+    This function returns protein summaries for a large list of Protein identifiers (pids) given in the request body.
+    \f
+    :param db: database session dependency
+    :return: protein summary
+    """
+    id = await read_ids(request, "^.*(YP|NP).*$", 25)
+
+    with error_handling():
+        log.debug("Received a vsummary/protein POST with {0} IDs".format(len(id)))
+
+        if FAST_JSON:
+            items = rows_to_json(find_protein_profile_rows(db, id))
+        else:
+            items = to_json(Protein_profile, find_proteins_by_id(db, id))
+        return await json_array_response(items, "Protein summaries")
 
 
 @api.get("/vfetch/protein/faa",
          response_model=List[AA_seq], tags=["protein"], description="Returns Aminoacid Sequences about Proteins for which Protein IDs have been provided", summary="Protein AA fetch")
-@limiter.limit("9/second")
+@limiter.limit(HEAVY)
+@response_cache.cached()
 async def get_fetch_protein_faa(request: Request,
                                 id: List[str] = Query(..., max_length=25, regex="^.*(YP|NP).*$", title="Protein ID",
                                                       description="Protein taxon identity number",
@@ -413,7 +748,7 @@ async def get_fetch_protein_faa(request: Request,
     """
     with error_handling():
         log.debug("Received a vfetch/protein/faa request")
-        protein_faa = find_protein_faa_by_id(db, id)
+        protein_faa = await run_db(to_schema, AA_seq, find_protein_faa_by_id, db, id)
         if not len(protein_faa) == len(id):
             log.warning("At least one of the proteins was not found, or there were duplicates.\n"
                         "IDs given: {0}".format(id))
@@ -427,9 +762,29 @@ async def get_fetch_protein_faa(request: Request,
         return protein_faa
 
 
+@api.post("/vfetch/protein/faa", response_model=List[AA_seq], tags=["protein"],
+          description="Returns Aminoacid Sequences for the Protein IDs in the request body, "
+                      "either a JSON list or one ID per line", summary="Protein AA bulk fetch")
+@limiter.limit(HEAVY)
+async def post_fetch_protein_faa(request: Request, db: Session = Depends(get_stream_db)):
+    """
+    This function returns Amino acid sequences for a large list of protein IDs given in the request body.
+    \f
+    :param db: database session dependency
+    :return: Amino acid sequences for the proteins
+    """
+    id = await read_ids(request, "^.*(YP|NP).*$", 25)
+
+    with error_handling():
+        log.debug("Received a vfetch/protein/faa POST with {0} IDs".format(len(id)))
+
+        return await json_array_response(to_json(AA_seq, find_protein_faa_by_id(db, id)), "Aminoacid sequences")
+
+
 @api.get("/vfetch/protein/fna",
          response_model=List[NT_seq], tags=["protein"], description="Returns Nucleotide Sequences about Proteins for which Protein IDs have been provided", summary="Protein NT fetch")
-@limiter.limit("9/second")
+@limiter.limit(HEAVY)
+@response_cache.cached()
 async def get_fetch_protein_fna(request: Request,
                                 id: List[str] = Query(..., max_length=25, regex="^.*(YP|NP).*$", title="Protein ID",
                                                       description="Protein taxon identity number",
@@ -445,7 +800,7 @@ async def get_fetch_protein_fna(request: Request,
     with error_handling():
         log.debug("Received a vfetch/protein/fna request")
 
-        protein_fna = find_protein_fna_by_id(db, id)
+        protein_fna = await run_db(to_schema, NT_seq, find_protein_fna_by_id, db, id)
 
         if not len(protein_fna) == len(id):
             log.warning("At least one of the proteins was not found, or there were duplicates.\n"
@@ -459,3 +814,103 @@ async def get_fetch_protein_fna(request: Request,
 
         return protein_fna
 
+
+@api.post("/vfetch/protein/fna", response_model=List[NT_seq], tags=["protein"],
+          description="Returns Nucleotide Sequences for the Protein IDs in the request body, "
+                      "either a JSON list or one ID per line", summary="Protein NT bulk fetch")
+@limiter.limit(HEAVY)
+async def post_fetch_protein_fna(request: Request, db: Session = Depends(get_stream_db)):
+    """
+    This function returns Nucleotide sequences for a large list of protein IDs given in the request body.
+    \f
+    :param db: database session dependency
+    :return: Nucleotide sequences for the proteins
+    """
+    id = await read_ids(request, "^.*(YP|NP).*$", 25)
+
+    with error_handling():
+        log.debug("Received a vfetch/protein/fna POST with {0} IDs".format(len(id)))
+
+        return await json_array_response(to_json(NT_seq, find_protein_fna_by_id(db, id)), "Nucleotide sequences")
+
+
+@api.get("/vplain/protein/faa", response_class=PlainTextResponse, tags=["protein"],
+         description="Returns the Aminoacid Sequences of the given Proteins in FASTA format.",
+         summary="Protein AA fetch FASTA")
+@limiter.limit(HEAVY)
+@response_cache.cached(vary=accepts_gzip)
+async def plain_protein_faa(request: Request,
+                            id: List[str] = Query(..., max_length=25, regex="^.*(YP|NP).*$", title="Protein ID",
+                                                  description="Protein taxon identity number",
+                                                  example={"2301601.YP_009812740.1"}),
+                            db: Session = Depends(get_stream_db)):
+    """
+    Get the Amino acid sequences of the proteins as FASTA, streamed from the database.
+    The response is gzip compressed for clients that accept gzip.
+    \f
+    :param id: ProteinID(s)
+    :param db: database session dependency
+    """
+    with error_handling():
+        log.debug("Received a vplain/protein/faa request")
+
+        return await fasta_response(request, find_protein_faa_by_id(db, id), "Aminoacid sequences")
+
+
+@api.post("/vplain/protein/faa", response_class=PlainTextResponse, tags=["protein"],
+          description="Returns the Aminoacid Sequences for the Protein IDs in the request body in FASTA format, "
+                      "the body is either a JSON list or one ID per line", summary="Protein AA bulk fetch FASTA")
+@limiter.limit(HEAVY)
+async def post_plain_protein_faa(request: Request, db: Session = Depends(get_stream_db)):
+    """
+    Get the Amino acid sequences for a large list of protein IDs given in the request body as FASTA.
+    \f
+    :param db: database session dependency
+    """
+    id = await read_ids(request, "^.*(YP|NP).*$", 25)
+
+    with error_handling():
+        log.debug("Received a vplain/protein/faa POST with {0} IDs".format(len(id)))
+
+        return await fasta_response(request, find_protein_faa_by_id(db, id), "Aminoacid sequences")
+
+
+@api.get("/vplain/protein/fna", response_class=PlainTextResponse, tags=["protein"],
+         description="Returns the Nucleotide Sequences of the given Proteins in FASTA format.",
+         summary="Protein NT fetch FASTA")
+@limiter.limit(HEAVY)
+@response_cache.cached(vary=accepts_gzip)
+async def plain_protein_fna(request: Request,
+                            id: List[str] = Query(..., max_length=25, regex="^.*(YP|NP).*$", title="Protein ID",
+                                                  description="Protein taxon identity number",
+                                                  example={"2301601.YP_009812740.1"}),
+                            db: Session = Depends(get_stream_db)):
+    """
+    Get the Nucleotide sequences of the proteins as FASTA, streamed from the database.
+    The response is gzip compressed for clients that accept gzip.
+    \f
+    :param id: ProteinID(s)
+    :param db: database session dependency
+    """
+    with error_handling():
+        log.debug("Received a vplain/protein/fna request")
+
+        return await fasta_response(request, find_protein_fna_by_id(db, id), "Nucleotide sequences")
+
+
+@api.post("/vplain/protein/fna", response_class=PlainTextResponse, tags=["protein"],
+          description="Returns the Nucleotide Sequences for the Protein IDs in the request body in FASTA format, "
+                      "the body is either a JSON list or one ID per line", summary="Protein NT bulk fetch FASTA")
+@limiter.limit(HEAVY)
+async def post_plain_protein_fna(request: Request, db: Session = Depends(get_stream_db)):
+    """
+    Get the Nucleotide sequences for a large list of protein IDs given in the request body as FASTA.
+    \f
+    :param db: database session dependency
+    """
+    id = await read_ids(request, "^.*(YP|NP).*$", 25)
+
+    with error_handling():
+        log.debug("Received a vplain/protein/fna POST with {0} IDs".format(len(id)))
+
+        return await fasta_response(request, find_protein_fna_by_id(db, id), "Nucleotide sequences")
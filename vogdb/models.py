@@ -1,7 +1,8 @@
 from sqlalchemy import Column, ForeignKey, Table
-from sqlalchemy.types import Boolean, Integer, String, Text
+from sqlalchemy.types import BigInteger, Boolean, Integer, LargeBinary, String, Text, TypeDecorator
 from sqlalchemy.orm import relationship
 from .database import Base
+from .sequences import pack_nt, unpack_nt
 
 """
 "model" refers to classes and instances that interact with the database.
@@ -9,10 +10,25 @@ A model is equivalent to a database table e.g. VOG table and it contains all the
 """
 
 
+class PackedNucleotides(TypeDecorator):
+    """
+    A nucleotide sequence, stored with 2 bits per base (see vogdb.sequences).
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return pack_nt(value)
+
+    def process_result_value(self, value, dialect):
+        return unpack_nt(value)
+
+
 class VOG(Base):
     __tablename__ = "VOG"
 
-    id = Column('VOG_ID', String(30), primary_key=True)
+    key = Column('VOGKey', Integer, primary_key=True)
+    id = Column('VOG_ID', String(30), nullable=False, unique=True)
     protein_count = Column('ProteinCount', Integer, nullable=False)
     species_count = Column('SpeciesCount', Integer, nullable=False)
     function = Column('FunctionalCategory', String(30), nullable=False)
@@ -47,22 +63,42 @@ class Species(Base):
 class Protein(Base):
     __tablename__ = "Protein"
 
-    id = Column('ProteinID', String(30), nullable=False, index=True, primary_key=True)
+    key = Column('ProteinKey', Integer, primary_key=True)
+    id = Column('ProteinID', String(30), nullable=False, unique=True)
     taxon_id = Column('TaxonID', Integer,  ForeignKey("Species.TaxonID"), nullable=False, index=True)
-    aa_seq = Column('AAseq', Text(65000), nullable=True)
-    nt_seq = Column('NTseq', Text(65000), nullable=True)
 
     species = relationship("Species", back_populates="proteins", lazy="joined")
     vogs = relationship('VOG', secondary='Member', back_populates='proteins')
     members = relationship('Member', back_populates='protein', lazy='selectin')
+    sequence = relationship('Sequence', back_populates='protein', uselist=False, lazy='select')
+
+
+# the sequences of a protein, apart from the Protein table, which is scanned and joined by the searches
+class Sequence(Base):
+    __tablename__ = "Sequence"
+
+    protein_key = Column('ProteinKey', Integer, ForeignKey('Protein.ProteinKey'), primary_key=True)
+    aa_seq = Column('AAseq', Text(65000), nullable=True)
+    nt_seq = Column('NTseq', PackedNucleotides, nullable=True)
+
+    protein = relationship("Protein", back_populates="sequence", lazy="select")
+
+
+# the row hashes of the release (see vogdb.loader.hashes), the API reads only the hashes of the input files
+class RowHash(Base):
+    __tablename__ = "RowHash"
+
+    table_name = Column('TableName', String(16), primary_key=True)
+    row_key = Column('RowKey', String(64), primary_key=True)
+    hash = Column('Hash', BigInteger, nullable=False)
 
 
-# m:n mapping table
+# m:n mapping table, on the integer keys of VOG and Protein
 class Member(Base):
     __tablename__ = "Member"
 
-    vog_id = Column('VOG_ID', String(30), ForeignKey('VOG.VOG_ID'), primary_key=True)
-    protein_id = Column('ProteinID', String(30), ForeignKey('Protein.ProteinID'), primary_key=True)
+    vog_key = Column('VOGKey', Integer, ForeignKey('VOG.VOGKey'), primary_key=True)
+    protein_key = Column('ProteinKey', Integer, ForeignKey('Protein.ProteinKey'), primary_key=True)
 
     vog = relationship("VOG", back_populates="members", lazy="joined")
     protein = relationship("Protein", back_populates="members", lazy="joined")
@@ -0,0 +1,214 @@
+import fcntl
+import functools
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from typing import Callable, Optional, Tuple
+
+from fastapi import HTTPException
+from starlette.requests import Request
+
+# get logger:
+log = logging.getLogger(__name__)
+
+"""
+Request limiter that charges every request by its size instead of counting calls. A client (by IP address)
+has a token bucket per endpoint of VOG_RATE_LIMIT_BURST cost units, refilled with VOG_RATE_LIMIT_RATE units per
+second.
+A request costs 1 unit plus VOG_RATE_LIMIT_ID_COST units for every further ID it asks for, times the weight
+of the endpoint, so a 25 protein summary costs as much as 7 single lookups.
+A request is let through once the bucket holds its cost (or is full, for requests larger than the bucket), and
+the whole cost is taken, so a large bulk request leaves the bucket in debt and the client waits until the
+refill has paid it off.
+The buckets live in a memory-mapped file (VOG_RATE_LIMIT_FILE, by default in /dev/shm), which all worker
+processes of a host share, so the limit holds for the host and not per worker. The file is a table of
+slots "<key hash><tokens><time>" (uint64, float64, float64) in sets of WAYS slots. A client is hashed to a set
+and takes a free slot of it, and every set is locked with a POSIX record lock while it is updated. In a full set
+the client takes over the least recently used slot with its tokens, so colliding clients share a bucket
+instead of refilling each other's.
+"""
+
+_SLOT = struct.Struct("<Qdd")
+
+# slots per set
+WAYS = 8
+
+# bytes of a bulk request body counted as one ID
+BODY_BYTES_PER_ID = 20
+
+# the query parameters that list IDs or names, the other parameters (filters and flags) are not counted
+ID_PARAMETERS = frozenset(["id", "taxon_id", "tax_id", "species", "species_name", "name", "proteins", "VOG_id"])
+
+
+def default_path() -> str:
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, "vogdb-ratelimit")
+
+
+def client_address(request: Request) -> str:
+    return request.client.host if request.client else "127.0.0.1"
+
+
+def request_ids(request: Request, max_ids: float = math.inf) -> float:
+    """
+    The size of a request in IDs: the number of values of the ID parameters, or for a request body its length,
+    at most max_ids. A body of unknown length (chunked transfer encoding) counts as max_ids IDs.
+    """
+    if request.method in ("POST", "PUT", "PATCH") and "content-length" not in request.headers:
+        return max_ids
+    body = int(request.headers.get("content-length") or 0)
+    ids = sum(1 for name, _ in request.query_params.multi_items() if name in ID_PARAMETERS)
+    return min(max(ids, math.ceil(body / BODY_BYTES_PER_ID), 1), max_ids)
+
+
+class SharedBuckets:
+    """
+    Token buckets in a memory-mapped file shared by processes.
+    """
+
+    def __init__(self, path: str, slots: int):
+        self.path = path
+        self.sets = max(slots // WAYS, 1)
+        self.lock = threading.Lock()
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = self.sets * WAYS * _SLOT.size
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        self.data = mmap.mmap(self.fd, size)
+
+    def close(self):
+        self.data.close()
+        os.close(self.fd)
+
+    def take(self, key: str, cost: float, rate: float, burst: float) -> float:
+        """
+        Takes cost tokens from the bucket of the key, if it has enough, or if it is full. The tokens may go
+        negative then, and the bucket refuses every request until the refill has paid off the debt.
+
+        :return: 0 if the tokens were taken, otherwise the seconds until the bucket has enough tokens
+        """
+        # 0 marks a free slot
+        digest = int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little") or 1
+        start = (digest % self.sets) * WAYS * _SLOT.size
+        # a request larger than the bucket is let through when the bucket is full
+        needed = min(cost, burst)
+
+        with self.lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, WAYS * _SLOT.size, start)
+            try:
+                # time.monotonic is the same clock in all processes of the host
+                now = time.monotonic()
+                offset, tokens, last = self._slot(start, digest, now, burst)
+                if now < last:
+                    # written before a reboot of the host
+                    tokens, last = burst, now
+                tokens = min(burst, tokens + (now - last) * rate)
+                wait = 0.0
+                if tokens >= needed:
+                    tokens -= cost
+                else:
+                    wait = (needed - tokens) / rate
+                _SLOT.pack_into(self.data, offset, digest, tokens, now)
+                return wait
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, WAYS * _SLOT.size, start)
+
+    def _slot(self, start: int, digest: int, now: float, burst: float) -> Tuple[int, float, float]:
+        """
+        Finds the slot of the key hash in the set at start.
+
+        :return: the offset of the slot and the tokens of the bucket at its last update
+        """
+        offsets = [start + i * _SLOT.size for i in range(WAYS)]
+        slots = [(offset,) + _SLOT.unpack_from(self.data, offset) for offset in offsets]
+        for offset, owner, tokens, last in slots:
+            if owner == digest:
+                return offset, tokens, last
+        for offset, owner, tokens, last in slots:
+            if owner == 0:
+                return offset, burst, now
+        # the tokens of the least recently used slot, which are all of them if it has been idle long enough
+        offset, _, tokens, last = min(slots, key=lambda slot: slot[3])
+        return offset, tokens, last
+
+
+class CostLimiter:
+    """
+    Limits the cost of the requests per client (see the module description).
+
+    :param key_func: returns the client of a request
+    :param enabled: False lets all requests through
+    :param max_ids: the largest number of IDs a request can ask for, charged for bodies of unknown length
+    """
+
+    def __init__(self, key_func: Callable[[Request], str], enabled: bool = True, path: Optional[str] = None,
+                 rate: float = 9, burst: float = 9, id_cost: float = 0.25, max_ids: float = math.inf,
+                 slots: int = 2 ** 16):
+        self.key_func = key_func
+        self.enabled = enabled
+        self.path = path or default_path()
+        self.rate = rate
+        self.burst = burst
+        self.id_cost = id_cost
+        self.max_ids = max_ids
+        self.slots = slots
+        self._buckets = None
+
+    @property
+    def buckets(self) -> SharedBuckets:
+        # opened in the worker process, not in the process that imports the app
+        if self._buckets is None:
+            self._buckets = SharedBuckets(self.path, self.slots)
+        return self._buckets
+
+    def cost(self, request: Request, weight: float = 1) -> float:
+        return weight * (1 + self.id_cost * (request_ids(request, self.max_ids) - 1))
+
+    def open(self, path: str):
+        """
+        Uses the buckets in the file at path from now on, e.g. a file of their own for tests.
+        """
+        if self._buckets is not None:
+            self._buckets.close()
+            self._buckets = None
+        self.path = path
+
+    def check(self, request: Request, weight: float = 1, scope: str = "") -> Tuple[float, float]:
+        """
+        Charges the request to the bucket of its client and the scope (the endpoint).
+
+        :return: the cost and 0 if the request may go on, otherwise the seconds the client has to wait
+        """
+        cost = self.cost(request, weight)
+        key = "{0}\t{1}".format(self.key_func(request), scope)
+        return cost, self.buckets.take(key, cost, self.rate, self.burst)
+
+    def limit(self, weight: float = 1):
+        """
+        Decorator for endpoints (with a request parameter), every endpoint has buckets of its own.
+        Requests over the limit are answered with 429 and a Retry-After header.
+
+        :param weight: cost factor of the endpoint, e.g. for endpoints returning sequences or files
+        """
+
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                request: Request = kwargs["request"]
+                if self.enabled:
+                    cost, wait = self.check(request, weight, func.__name__)
+                    if wait > 0:
+                        log.info("Rate limit exceeded by {0}: {1} cost units".format(self.key_func(request), cost))
+                        raise HTTPException(status_code=429, detail="Rate limit exceeded",
+                                            headers={"Retry-After": str(math.ceil(wait))})
+                return await func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
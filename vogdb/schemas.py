@@ -109,3 +109,17 @@ class NT_seq(ProteinID):
 
     class Config:
         orm_mode = True
+
+
+class PoolMetrics(BaseModel):
+    size: int = Field(..., example=10, description="open connections kept by the pool")
+    max_connections: Optional[int] = Field(..., example=20, description="pool size plus the allowed overflow")
+    checked_out: int = Field(..., example=3, description="connections in use right now")
+    checked_in: int = Field(..., example=7, description="idle connections in the pool")
+    max_checked_out: int = Field(..., example=12, description="most connections in use at the same time")
+    utilization: Optional[float] = Field(..., example=0.15, description="checked_out / max_connections")
+    checkouts: int = Field(..., example=125000)
+    timeouts: int = Field(..., example=0, description="checkouts that gave up after MYSQL_POOL_TIMEOUT")
+    wait_seconds_total: float = Field(..., example=1.25)
+    wait_seconds_max: float = Field(..., example=0.05)
+    wait_seconds_mean: float = Field(..., example=0.00001)
@@ -0,0 +1,87 @@
+import struct
+from typing import Optional
+
+import numpy as np
+
+"""
+The nucleotide sequences are stored packed (see the Sequence table): 2 bits per base for A, C, G and T,
+and an exception list for all other characters, e.g. the ambiguity codes N, R or Y.
+The packed form is the header "<length><number of exceptions>" (uint32, uint16), the exceptions
+"<position><run length><character>" (uint32, uint16, char), each a run of the same character,
+and then the bases, 4 per byte, the first one in the highest bits. An exception takes the place of bases "A".
+"""
+
+_HEADER = struct.Struct("<IH")
+_EXCEPTION = struct.Struct("<IHc")
+
+_BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+
+# 2 bit code of every byte, 255 for the exceptions
+_CODES = np.full(256, 255, dtype=np.uint8)
+_CODES[_BASES] = np.arange(4, dtype=np.uint8)
+
+# the longest run of one exception and the most exceptions of a sequence
+_MAX_RUN = 2 ** 16 - 1
+_MAX_EXCEPTIONS = 2 ** 16 - 1
+
+
+def _exception_runs(raw: np.ndarray, positions: np.ndarray):
+    """
+    Yields the runs of the same character at the given positions as (position, length, character).
+    """
+    start = None
+    for position in positions.tolist():
+        if start is not None and position == end and raw[position] == raw[start] and end - start < _MAX_RUN:
+            end += 1
+            continue
+        if start is not None:
+            yield start, end - start, int(raw[start])
+        start, end = position, position + 1
+    if start is not None:
+        yield start, end - start, int(raw[start])
+
+
+def pack_nt(seq: Optional[str]) -> Optional[bytes]:
+    """
+    Packs a nucleotide sequence, None stays None.
+    """
+    if seq is None:
+        return None
+    if not seq:
+        return _HEADER.pack(0, 0)
+    raw = np.frombuffer(seq.encode("ascii"), dtype=np.uint8)
+    codes = _CODES[raw]
+    other = codes == 255
+    exceptions = list(_exception_runs(raw, np.flatnonzero(other)))
+    if len(exceptions) > _MAX_EXCEPTIONS:
+        raise ValueError("The sequence has more than {0} runs of ambiguity codes.".format(_MAX_EXCEPTIONS))
+
+    padded = np.zeros(-(-len(codes) // 4) * 4, dtype=np.uint8)
+    padded[:len(codes)] = np.where(other, 0, codes)
+    packed = (padded[0::4] << 6) | (padded[1::4] << 4) | (padded[2::4] << 2) | padded[3::4]
+
+    return b"".join(
+        [_HEADER.pack(len(codes), len(exceptions))]
+        + [_EXCEPTION.pack(position, length, bytes([char])) for position, length, char in exceptions]
+        + [packed.astype(np.uint8).tobytes()]
+    )
+
+
+def unpack_nt(data: Optional[bytes]) -> Optional[str]:
+    """
+    Unpacks a nucleotide sequence packed by pack_nt, None stays None.
+    """
+    if data is None:
+        return None
+    length, count = _HEADER.unpack_from(data)
+    if not length:
+        return ""
+    offset = _HEADER.size + count * _EXCEPTION.size
+    packed = np.frombuffer(data, dtype=np.uint8, offset=offset)
+
+    codes = np.stack([packed >> 6, (packed >> 4) & 3, (packed >> 2) & 3, packed & 3], axis=1).ravel()[:length]
+    seq = _BASES[codes]
+    for position, run, char in _EXCEPTION.iter_unpack(data[_HEADER.size:offset]):
+        seq[position:position + run] = char[0]
+
+    return seq.tobytes().decode("ascii")
@@ -0,0 +1,113 @@
+import argparse
+import gc
+import logging
+import os
+import signal
+import time
+
+import uvicorn
+
+from .database import engine
+from .main import api, warm_up
+
+# get logger:
+log = logging.getLogger(__name__)
+
+"""
+Pre-forking server: python -m vogdb.serve starts VOG_WORKERS uvicorn workers on one listening socket.
+The parent process loads the read-only structures of the release (VOG catalog, species bitmaps, taxonomy and the
+indexes of the packed HMM and MSA files, see warm_up) before it forks, so the workers share their memory pages
+copy-on-write instead of building a copy each. The objects are moved out of reach of the garbage collector
+(gc.freeze), whose bookkeeping would otherwise write to, and so copy, every page of them in every worker.
+The parent only restarts workers that died and passes SIGINT and SIGTERM on to them.
+"""
+
+# a worker that dies sooner after its start is restarted only after this many seconds
+RESTART_DELAY = 1.0
+
+
+def prepare():
+    """
+    Loads the shared structures in the parent process and leaves it ready to fork.
+    """
+    try:
+        warm_up()
+    except Exception:
+        log.exception("Could not load the VOG catalog or the taxonomy before forking, every worker will load its own.")
+    # connections must not be shared between processes, every worker opens its own
+    engine.dispose()
+    gc.freeze()
+
+
+def start_worker(config: uvicorn.Config, sock) -> int:
+    pid = os.fork()
+    if pid:
+        return pid
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    gc.enable()
+    code = 0
+    try:
+        uvicorn.Server(config).run(sockets=[sock])
+    except BaseException:
+        log.exception("Worker {0} failed.".format(os.getpid()))
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def serve(host: str, port: int, workers: int):
+    # avoids freed holes in the pages of the objects loaded before the fork
+    gc.disable()
+    config = uvicorn.Config(api, host=host, port=port)
+    sock = config.bind_socket()
+    prepare()
+
+    started = {}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(started):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for _ in range(workers):
+        started[start_worker(config, sock)] = time.monotonic()
+    log.info("Started {0} workers.".format(workers))
+
+    while started:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        start = started.pop(pid, None)
+        if start is None or stopping:
+            continue
+        log.warning("Worker {0} exited with status {1}, restarting it.".format(pid, status))
+        if time.monotonic() - start < RESTART_DELAY:
+            time.sleep(RESTART_DELAY)
+        started[start_worker(config, sock)] = time.monotonic()
+
+    sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves the VOGDB-API with several worker processes.")
+    parser.add_argument("--host", default=os.environ.get("VOG_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("VOG_PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("VOG_WORKERS", os.cpu_count() or 1)),
+                        help="number of worker processes (VOG_WORKERS, by default the number of CPUs)")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers)
+
+
+if __name__ == "__main__":
+    main()
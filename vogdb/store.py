@@ -0,0 +1,78 @@
+import logging
+import mmap
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+# get logger:
+log = logging.getLogger(__name__)
+
+"""
+The HMM and MSA files of all VOGs are packed by the loader (vogdb.loader.packs) into one data file per kind
+(e.g. data/hmm.pack) together with an index (data/hmm.pack.idx). The index starts with a header line
+"#\t<size of the data file>" followed by lines "<VOG ID>\t<offset>\t<length>".
+Each entry is the unchanged gzip file of the VOG, so it can be served as it is to clients that accept gzip.
+The data file is memory-mapped, so serving an entry neither opens a file nor copies it more than once.
+"""
+
+PACK_SUFFIX = ".pack"
+INDEX_SUFFIX = ".pack.idx"
+
+_lock = threading.Lock()
+_stores: Dict[str, "PackedStore"] = {}
+
+
+class PackedStore:
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = os.stat(path + INDEX_SUFFIX).st_mtime
+
+        self.index: Dict[str, Tuple[int, int]] = {}
+        with open(path + INDEX_SUFFIX, "rt") as f:
+            _, size = f.readline().rstrip("\n").split("\t")
+            for line in f:
+                id, offset, length = line.rstrip("\n").split("\t")
+                self.index[id] = (int(offset), int(length))
+
+        with open(path + PACK_SUFFIX, "rb") as f:
+            if os.fstat(f.fileno()).st_size != int(size):
+                raise ValueError("{0} does not belong to its index.".format(path + PACK_SUFFIX))
+            # mmap of an empty file is not possible
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.index else b""
+
+        log.info("Opened {0} with {1} entries.".format(path + PACK_SUFFIX, len(self.index)))
+
+    def member(self, id: str) -> bytes:
+        """
+        Returns the gzip file of the given ID.
+        """
+        try:
+            offset, length = self.index[id]
+        except KeyError:
+            raise FileNotFoundError("{0} is not in {1}".format(id, self.path + PACK_SUFFIX))
+        return self.data[offset:offset + length]
+
+
+def packed_store(prefix: str) -> Optional[PackedStore]:
+    """
+    Returns the packed store for the given kind of data files ("hmm" or "raw_algs"),
+    or None if the loader did not pack them. The store is reopened when the loader has replaced the pack.
+    While the loader is replacing it, the previously opened store is used.
+    """
+    path = os.path.join(os.environ.get("VOG_DATA", "data"), prefix)
+    try:
+        mtime = os.stat(path + INDEX_SUFFIX).st_mtime
+    except FileNotFoundError:
+        return None
+
+    store = _stores.get(path)
+    if store is None or store.mtime != mtime:
+        with _lock:
+            store = _stores.get(path)
+            if store is None or store.mtime != mtime:
+                try:
+                    _stores[path] = store = PackedStore(path)
+                except (FileNotFoundError, ValueError):
+                    log.exception("Could not open the packed store {0}.".format(path + PACK_SUFFIX))
+    return store
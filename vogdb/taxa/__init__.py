@@ -1,3 +1,4 @@
 from .support import ncbi_taxa
+from .tree import TaxonomyTree, taxonomy_tree
 
-__all__ = [ 'ncbi_taxa' ]
\ No newline at end of file
+__all__ = [ 'ncbi_taxa', 'TaxonomyTree', 'taxonomy_tree' ]
\ No newline at end of file
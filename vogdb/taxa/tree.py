@@ -0,0 +1,154 @@
+import contextlib
+import logging
+import os
+import sqlite3
+import threading
+from typing import Callable, Iterable, List
+
+import numpy as np
+
+from .support import ncbi_taxa_path
+
+# get logger:
+log = logging.getLogger(__name__)
+
+"""
+The taxonomy tree is the part of the NCBI taxonomy that is spanned by the lineages of the species in the database.
+Its nodes are numbered in pre-order, and every node stores the last pre-order number of its subtree (nested sets).
+The species below a taxon are therefore a contiguous range of the species sorted by their pre-order number,
+which replaces the walk through the whole NCBI tree done by NCBITaxa.get_descendant_taxa.
+"""
+
+_lock = threading.Lock()
+_tree = None
+
+
+class TaxonomyTree:
+
+    def __init__(self, version: str, path: str, mtime: float, species: Iterable[int], lineages: dict):
+        """
+        :param version: the release of the species
+        :param path: the taxa.sqlite file the tree has been built from
+        :param mtime: modification time of that file
+        :param species: the taxon IDs of the species in the database
+        :param lineages: taxon ID -> lineage (from the taxon up to the root) of the species
+        """
+        self.version = version
+        self.path = path
+        self.mtime = mtime
+        self.species_set = frozenset(species)
+
+        children = {}
+        roots = []
+        for taxon in sorted(self.species_set):
+            lineage = lineages.get(taxon) or [taxon]
+            for child, parent in zip(lineage, lineage[1:]):
+                if child in children.setdefault(parent, set()):
+                    break
+                children[parent].add(child)
+            if lineage[-1] not in roots:
+                roots.append(lineage[-1])
+
+        # iterative depth first traversal, numbering the nodes in pre-order
+        taxa, first, last = [], {}, {}
+        stack = [(root, False) for root in sorted(roots, reverse=True)]
+        while stack:
+            node, done = stack.pop()
+            if done:
+                last[node] = len(taxa) - 1
+                continue
+            first[node] = len(taxa)
+            taxa.append(node)
+            stack.append((node, True))
+            stack.extend((child, False) for child in sorted(children.get(node, ()), reverse=True))
+
+        order = np.argsort(taxa)
+        self.taxa = np.array(taxa, dtype=np.int64)[order]
+        self.first = np.array([first[t] for t in taxa], dtype=np.int64)[order]
+        self.last = np.array([last[t] for t in taxa], dtype=np.int64)[order]
+
+        species_order = np.array(sorted(first[t] for t in self.species_set), dtype=np.int64)
+        self.species_order = species_order
+        self.species_by_order = np.array([taxa[i] for i in species_order], dtype=np.int64)
+
+    @classmethod
+    def load(cls, version: str, species: Iterable[int], path: str = None) -> "TaxonomyTree":
+        path = path or ncbi_taxa_path()
+        species = sorted(set(species))
+        log.info("Loading the taxonomy tree for {0} species from {1}...".format(len(species), path))
+
+        mtime = os.stat(path).st_mtime
+        lineages = {}
+        with _connect(path) as con:
+            for i in range(0, len(species), 500):
+                chunk = species[i:i + 500]
+                rows = con.execute("SELECT taxid, track FROM species WHERE taxid IN ({0})"
+                                   .format(",".join("?" * len(chunk))), chunk)
+                for taxid, track in rows:
+                    lineages[taxid] = [int(t) for t in track.split(",")]
+
+        missing = len(species) - len(lineages)
+        if missing:
+            log.warning("{0} species are not part of the NCBI taxonomy.".format(missing))
+        tree = cls(version, path, mtime, species, lineages)
+        log.info("Taxonomy tree loaded: {0} taxa.".format(len(tree.taxa)))
+        return tree
+
+    def _find(self, taxon: int) -> int:
+        i = np.searchsorted(self.taxa, taxon)
+        if i < len(self.taxa) and self.taxa[i] == taxon:
+            return i
+        return -1
+
+    def descendant_species(self, taxon: int) -> List[int]:
+        """
+        Returns the species in the database that are the given taxon or descend from it.
+        Raises a ValueError for taxon IDs that are not in the NCBI taxonomy.
+        """
+        i = self._find(taxon)
+        if i < 0:
+            # not on a lineage of our species: either a merged, an unrelated or an invalid taxon ID
+            with _connect(self.path) as con:
+                merged = con.execute("SELECT taxid_new FROM merged WHERE taxid_old = ?", (taxon,)).fetchone()
+                if merged:
+                    return self.descendant_species(merged[0]) if merged[0] != taxon else []
+                if not con.execute("SELECT 1 FROM species WHERE taxid = ?", (taxon,)).fetchone():
+                    raise ValueError("taxid not found: {0}".format(taxon))
+            return []
+
+        lo = np.searchsorted(self.species_order, self.first[i], side="left")
+        hi = np.searchsorted(self.species_order, self.last[i], side="right")
+        return self.species_by_order[lo:hi].tolist()
+
+    def is_descendant(self, taxon: int, ancestor: int) -> bool:
+        """
+        Tests whether the taxon lies in the subtree of the ancestor (both have to be in the tree).
+        """
+        i, j = self._find(taxon), self._find(ancestor)
+        return i >= 0 and j >= 0 and self.first[j] <= self.first[i] <= self.last[j]
+
+
+def _connect(path: str):
+    return contextlib.closing(sqlite3.connect("file:{0}?mode=ro".format(path), uri=True))
+
+
+def taxonomy_tree(version: str, species: Callable[[], Iterable[int]]) -> TaxonomyTree:
+    """
+    Returns the process wide taxonomy tree of the given release.
+    The tree is rebuilt for a new release or when the taxa.sqlite file has been refreshed (python -m vogdb.taxa).
+
+    :param version: the release version
+    :param species: returns the taxon IDs of the species of the release, called only when the tree is (re)built
+    """
+    global _tree
+    path = ncbi_taxa_path()
+    mtime = os.stat(path).st_mtime
+
+    def outdated(tree):
+        return tree is None or tree.version != version or tree.path != path or tree.mtime != mtime
+
+    if outdated(_tree):
+        with _lock:
+            if outdated(_tree):
+                _tree = TaxonomyTree.load(version, species(), path)
+    return _tree